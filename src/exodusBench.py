@@ -0,0 +1,421 @@
+﻿# -*- coding: utf-8 -*-
+#Carga de librerías
+import time
+import sys
+import os
+import glob
+import json
+import re
+import shlex
+import random
+import socket
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from io import BytesIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+import numpy as np
+from skimage import io, transform
+from PIL import Image
+import exodusWS
+
+ESCALA_ESPERAS_BENCH = 0.0001 #Factor de las esperas de cortesía y de reintento (exodusWS.ESCALA_ESPERAS) al rastrear el servidor local
+VALORES_EJEMPLO = {'IN_inicio': '1', 'IN_limite': '10', 'IN_tamano': '20', 'IN_iconoAFichero': 'binario', 'IN_modo': 'asincrono', 'IN_concurrencia': '4',
+                   'IN_tasa': '2.5', 'IN_puerto': '9100', 'IN_fraccion': '0.01', 'IN_procesos': '2', 'IN_campo': 'Trackers', 'IN_fichero': 'metricas.json',
+                   'columnas|indice': 'indice', 'texto|json': 'json'} #Valores con los que se sustituyen los parámetros de los ejemplos del README
+TRADUCCIONES_EJEMPLO = {'1 100 False asincrono 8 2': 'crawl 1 100 --icono False --modo asincrono --concurrencia 8 --tasa 2',
+                        'exportar False completa': 'exportar --icono False --completa',
+                        'tramos trabajar False tuberia': 'tramos trabajar --icono False --modo tuberia'} #Traducción esperada de los ejemplos de la sintaxis anterior del README
+
+def generarIconos(numero = 300, lado = 96, semilla = 0):
+    """
+    Genera iconos sintéticos codificados en PNG con la misma variedad de formatos que sirve el sitio: canal de transparencia (2D), RGB y RGBA.
+
+    Entrada: numero: Número de iconos a generar.
+             lado: Tamaño en píxeles del lado de cada icono antes de redimensionarlo.
+             semilla: Semilla del generador aleatorio para repetir las mismas medidas.
+
+    Salida: contenidos: Lista de bytes PNG.
+    """
+    generador = np.random.default_rng(semilla)
+    formas = [(lado, lado), (lado, lado, 3), (lado, lado, 4)]
+    contenidos = []
+    for i in range(numero):
+        imagen = generador.integers(0, 256, size = formas[i % len(formas)], dtype = np.uint8)
+        imagen[:lado // 4] = 0 #Franja a 0 para cubrir el caso de píxeles transparentes
+        buffer = BytesIO()
+        Image.fromarray(imagen).save(buffer, format = 'PNG')
+        contenidos.append(buffer.getvalue())
+    return contenidos
+
+def normalizarIconoOriginal(imagen):
+    """
+    Normalización de iconos tal y como la hacía obtenerIcono antes de vectorizarla, con el doble bucle sobre los píxeles. Se mantiene como referencia del benchmark.
+
+    Entrada: imagen: Array numpy de la imagen decodificada.
+
+    Salida: photo: Array numpy de forma (32,32,4).
+    """
+    photo = (transform.resize(imagen, (32, 32), mode='edge') * 255).astype(np.uint8)
+    if len(photo.shape) == 2:
+        rgba = np.full((32,32,4), 0).astype(np.uint8)
+        for i in range (0,32):
+            for j in range (0,32):
+                if photo[i][j] == 0:
+                    rgba[i][j][0] = 255
+                    rgba[i][j][1] = 255
+                    rgba[i][j][2] = 255
+                    rgba[i][j][3] = 0
+                else:
+                    rgba[i][j][3] = 255 - photo[i][j]
+        photo = rgba
+    if photo.shape[2] == 3:
+        rgba = np.full((32,32,4), 255)
+        rgba[:,:,0] = photo[:,:,0]
+        rgba[:,:,1] = photo[:,:,1]
+        rgba[:,:,2] = photo[:,:,2]
+        photo = rgba
+    return photo
+
+def benchIconos(numero = 300, procesos = exodusWS.PROCESOS_ICONOS):
+    """
+    Mide iconos por segundo en la decodificación y normalización: implementación original con bucles, versión vectorizada
+    y versión vectorizada por lotes en un pool de procesos. Comprueba además que todas producen los mismos iconos.
+
+    Entrada: numero: Número de iconos sintéticos a procesar.
+             procesos: Procesos del pool de la etapa por lotes.
+
+    Salida: resultados: Diccionario variante > iconos por segundo.
+    """
+    contenidos = generarIconos(numero)
+    resultados = {}
+
+    comienzo = time.perf_counter()
+    original = [normalizarIconoOriginal(io.imread(BytesIO(contenido))) for contenido in contenidos]
+    resultados['original'] = numero / (time.perf_counter() - comienzo)
+
+    comienzo = time.perf_counter()
+    vectorizado = [exodusWS.decodificarIcono(contenido)[0] for contenido in contenidos]
+    resultados['vectorizado'] = numero / (time.perf_counter() - comienzo)
+
+    comienzo = time.perf_counter()
+    lote = [photo for photo, error in exodusWS.procesarIconosLote(contenidos, procesos)]
+    resultados['lote_' + str(procesos) + '_procesos'] = numero / (time.perf_counter() - comienzo)
+
+    for antes, vector, porLote in zip(original, vectorizado, lote):
+        if not (np.array_equal(antes, vector) and np.array_equal(antes, porLote)):
+            print('Los iconos de la versión vectorizada no coinciden con la original')
+            break
+
+    for variante in resultados:
+        print(variante + ': ' + str(round(resultados[variante], 1)) + ' iconos/s')
+    return resultados
+
+def cargarCorpus(ruta = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'corpus')):
+    """
+    Carga las páginas de informe del corpus de pruebas y el resultado esperado de cada una (esperado.json).
+
+    Entrada: ruta: Directorio del corpus.
+
+    Salida: paginas: Diccionario nombre de fichero > bytes de la página.
+            esperado: Diccionario nombre de fichero > {'atributos', 'error', 'icono'}.
+    """
+    paginas = {}
+    for fichero in sorted(glob.glob(os.path.join(ruta, '*.html'))):
+        with open(fichero, 'rb') as html:
+            paginas[os.path.basename(fichero)] = html.read()
+    with open(os.path.join(ruta, 'esperado.json'), encoding = 'utf-8') as json_file:
+        esperado = json.load(json_file)
+    return paginas, esperado
+
+def benchParseo(repeticiones = 50):
+    """
+    Mide páginas por segundo en la extracción de atributos con BeautifulSoup y con el recorrido único de lxml sobre el corpus de pruebas,
+    y comprueba que ambos analizadores devuelven lo mismo que esperado.json, incluidos los errores por atributo.
+
+    Entrada: repeticiones: Veces que se analiza el corpus completo con cada analizador.
+
+    Salida: resultados: Diccionario analizador > páginas por segundo.
+    """
+    paginas, esperado = cargarCorpus()
+    resultados = {}
+    for analizador, funcion in [('bs4', exodusWS.extraerAtributosBs4), ('lxml', exodusWS.extraerAtributos)]:
+        for nombre in paginas: #Comprobar la paridad con el resultado esperado
+            atributos, error, ruta = funcion(paginas[nombre])
+            if json.loads(json.dumps([atributos, error, ruta])) != [esperado[nombre]['atributos'], esperado[nombre]['error'], esperado[nombre]['icono']]:
+                print('El analizador ' + analizador + ' no coincide con el resultado esperado en ' + nombre)
+        comienzo = time.perf_counter()
+        for i in range(repeticiones):
+            for nombre in paginas:
+                funcion(paginas[nombre])
+        resultados[analizador] = repeticiones * len(paginas) / (time.perf_counter() - comienzo)
+
+    for analizador in resultados:
+        print(analizador + ': ' + str(round(resultados[analizador], 1)) + ' páginas/s')
+    return resultados
+
+class ManejadorInformes(BaseHTTPRequestHandler):
+    """
+    Servidor local que sustituye al sitio de exodus-privacy en el benchmark de rastreo. Sirve /es/reports/<id>/ con la página del corpus
+    que corresponde al id (con el id del corpus sustituido por el pedido) y /es/reports/<id>/icon/ con un icono sintético.
+    Los fallos se inyectan de forma determinista por id según la configuración del servidor (ver servirInformes).
+    """
+    protocol_version = 'HTTP/1.1' #Conexiones persistentes, como el sitio real
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #Sin Nagle, para que las cabeceras y el cuerpo no esperen al ACK retardado
+
+    def do_GET(self):
+        conf = self.server.configuracion
+        partes = urlsplit(self.path)
+        ruta = [parte for parte in partes.path.split('/') if parte != '']
+        time.sleep(conf['latencia'])
+        try:
+            idElem = int(ruta[2])
+        except (IndexError, ValueError):
+            return self.responder(404)
+        if idElem > conf['ultimo'] or (conf['huecos'] > 0 and idElem % conf['huecos'] < 3): #Final de los informes y rachas de 3 informes inexistentes
+            return self.responder(404)
+        if len(ruta) > 3 and ruta[3] == 'icon':
+            return self.responder(200, self.server.iconos[idElem % len(self.server.iconos)], 'image/png')
+        if fallo(idElem, 0, conf['errores']):
+            with self.server.cerrojo:
+                primeraVez = idElem not in self.server.fallados
+                self.server.fallados.add(idElem)
+            if primeraVez: #Solo la primera petición de cada id falla, para que el rastreo lo recupere al reintentar
+                return self.responder(503)
+        if fallo(idElem, 1, conf['redirecciones']) and partes.query == '':
+            return self.responder(301, cabeceras = {'Location': partes.path + '?r=1'})
+        nombre, html = paginaInforme(self.server.paginas, idElem)
+        self.responder(200, html, 'text/html; charset=utf-8', lenta = fallo(idElem, 2, conf['lentas']))
+
+    def responder(self, codigo, cuerpo = b'', tipo = 'text/html', cabeceras = {}, lenta = False):
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        for cabecera in cabeceras:
+            self.send_header(cabecera, cabeceras[cabecera])
+        self.end_headers()
+        try:
+            if not lenta:
+                self.wfile.write(cuerpo)
+                return
+            trozo = len(cuerpo) // 8 + 1 #Cuerpo lento: se envía en 8 trozos separados por la latencia configurada
+            for posicion in range(0, len(cuerpo), trozo):
+                self.wfile.write(cuerpo[posicion:posicion + trozo])
+                self.wfile.flush()
+                time.sleep(self.server.configuracion['latencia'])
+        except (BrokenPipeError, ConnectionResetError): #El sondeo del final solo lee el código de estado y cierra la conexión
+            self.close_connection = True
+
+    def log_message(self, formato, *argumentos):
+        pass
+
+def fallo(idElem, tipo, fraccion):
+    """
+    Decide de forma determinista si se inyecta un fallo del tipo indicado en un id, para que todas las ejecuciones del benchmark sean comparables.
+
+    Entrada: idElem: Id del informe.
+             tipo: Número del tipo de fallo, para que cada tipo afecte a ids distintos.
+             fraccion: Fracción de ids afectados.
+
+    Salida: True si se inyecta el fallo.
+    """
+    return fraccion > 0 and random.Random(idElem * 10 + tipo).random() < fraccion
+
+def paginaInforme(paginas, idElem):
+    """
+    Página de informe sintética de un id: la página del corpus que le corresponde con su id sustituido por el pedido.
+
+    Entrada: paginas: Diccionario nombre de fichero > bytes de la página, de cargarCorpus.
+             idElem: Id del informe.
+
+    Salida: nombre: Nombre de la página del corpus usada, clave de esperado.json.
+            html: Bytes de la página.
+    """
+    nombres = sorted(paginas)
+    nombre = nombres[idElem % len(nombres)]
+    return nombre, paginas[nombre].replace(nombre[:-len('.html')].encode(), str(idElem).encode())
+
+def servirInformes(configuracion, puerto):
+    """
+    Arranca el servidor local de informes en un proceso propio, para que su memoria y su CPU no se mezclen con las del rastreo medido.
+
+    Entrada: configuracion: Diccionario con ultimo (último id existente), latencia (segundos por respuesta), huecos (cada cuántos ids
+                            empieza una racha de 3 ids inexistentes, 0 sin rachas) y las fracciones de ids con error 503 en la primera petición
+                            (errores), con redirección 301 (redirecciones) y con el cuerpo enviado lentamente (lentas).
+             puerto: multiprocessing.Value donde se publica el puerto asignado al servidor.
+    """
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ManejadorInformes)
+    servidor.daemon_threads = True
+    servidor.configuracion = configuracion
+    servidor.paginas = cargarCorpus()[0]
+    servidor.iconos = generarIconos(16, semilla = 1)
+    servidor.fallados = set()
+    servidor.cerrojo = threading.Lock()
+    puerto.value = servidor.server_address[1]
+    servidor.serve_forever()
+
+def datasetEsperado(numero, huecos):
+    """
+    Dataset de referencia que debe producir el rastreo de los ids 1..numero del servidor local con IN_iconoAFichero = False:
+    atributos de esperado.json con el id de cada informe e icono normalizado con la implementación original de referencia.
+
+    Entrada: numero: Último id existente en el servidor.
+             huecos: Periodo de las rachas de ids inexistentes del servidor.
+
+    Salida: Diccionario id > atributos, como exodus.json.
+    """
+    paginas, esperado = cargarCorpus()
+    iconos = [normalizarIconoOriginal(io.imread(BytesIO(contenido))).astype(np.uint8) for contenido in generarIconos(16, semilla = 1)]
+    dataset = {}
+    for idElem in range(1, numero + 1):
+        if huecos > 0 and idElem % huecos < 3:
+            continue
+        nombre = paginaInforme(paginas, idElem)[0]
+        atributos = dict(esperado[nombre]['atributos'])
+        atributos['Id'] = idElem
+        atributos['icon'] = iconos[idElem % len(iconos)].reshape(-1, 4).tolist()
+        if len(esperado[nombre]['error']) <= exodusWS.TOLERANCIA_ERRORES:
+            dataset[str(idElem)] = atributos
+    return dataset
+
+def ejecutarRastreo(modo, url, numero, concurrencia, tasa, resultado):
+    """
+    Rastrea el servidor local en un proceso propio y en un directorio temporal, para medir el pico de memoria de cada modo por separado.
+
+    Entrada: modo: Modo de rastreo ('secuencial', 'asincrono' o 'tuberia').
+             url: URL base del servidor local.
+             numero: Ids a rastrear desde el 1.
+             concurrencia: Peticiones simultáneas de los modos asíncrono y tubería.
+             tasa: Peticiones por segundo de los modos asíncrono y tubería.
+             resultado: multiprocessing.Queue donde se devuelven las medidas y el dataset obtenido.
+    """
+    exodusWS.URL_BASE = url + '/es/reports/'
+    exodusWS.URL_BASE_ICONOS = url + '/es'
+    exodusWS.ESCALA_ESPERAS = ESCALA_ESPERAS_BENCH
+    directorio = tempfile.mkdtemp(prefix = 'exodusBench')
+    os.chdir(directorio)
+    sys.stdout = open(os.devnull, 'w') #La salida del rastreo por página no interesa en el benchmark
+    comienzo = time.perf_counter()
+    exodusWS.rastreo(1, numero, False, modo, concurrencia, tasa)
+    segundos = time.perf_counter() - comienzo
+    exodusWS.compactarRegistro(exodusWS.FICHERO_ICONO_INTEGRADO) #Un registro por debajo de UMBRAL_COMPACTACION queda pendiente al terminar el rastreo
+    with open(exodusWS.FICHERO_ICONO_INTEGRADO) as json_file:
+        dataset = json.load(json_file)
+    try:
+        import resource
+        escala = 1024 * 1024 if sys.platform == 'darwin' else 1024 #ru_maxrss está en bytes en macOS y en KB en Linux
+        rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / escala, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / escala)
+    except ImportError: #El módulo resource no existe en Windows
+        rss = ('na', 'na')
+    os.chdir(tempfile.gettempdir())
+    shutil.rmtree(directorio, ignore_errors = True)
+    resultado.put({'segundos': segundos, 'rss': rss, 'metricas': exodusWS.metricas.instantanea(), 'dataset': dataset})
+
+def benchRastreo(numero = 200, modos = ('secuencial', 'asincrono', 'tuberia'), latencia = 0.01, errores = 0.05, huecos = 40,
+                 redirecciones = 0.05, lentas = 0.05, concurrencia = 8, tasa = 1000):
+    """
+    Benchmark de extremo a extremo del rastreo sin acceso a la red: cada modo rastrea desde cero un servidor local con fallos inyectados
+    (latencia, errores 503, rachas de 404, redirecciones 301 y cuerpos lentos). Se mide páginas por segundo, p50 y p99 de cada etapa
+    según las métricas de exodusWS, pico de memoria (RSS) del proceso de rastreo y de sus procesos hijos, y se compara el dataset
+    obtenido con el de referencia. Las esperas de cortesía se reducen con ESCALA_ESPERAS_BENCH.
+
+    Entrada: numero: Último id existente en el servidor; se rastrean los ids 1..numero + 10 para cubrir también el final de los informes.
+             modos: Modos de rastreo a medir.
+             latencia: Segundos de latencia de cada respuesta del servidor (y entre trozos de los cuerpos lentos).
+             errores, redirecciones, lentas: Fracción de ids con error 503 en la primera petición, con redirección 301 y con cuerpo lento.
+             huecos: Cada cuántos ids empieza una racha de 3 ids inexistentes (0 sin rachas).
+             concurrencia: Peticiones simultáneas de los modos asíncrono y tubería.
+             tasa: Peticiones por segundo de los modos asíncrono y tubería.
+
+    Salida: resultados: Diccionario modo > {'paginas_s', 'segundos', 'rss_mb', 'rss_hijos_mb', 'etapas', 'coincide', 'diferencias'}.
+    """
+    contexto = multiprocessing.get_context('spawn')
+    configuracion = {'ultimo': numero, 'latencia': latencia, 'huecos': huecos, 'errores': errores, 'redirecciones': redirecciones, 'lentas': lentas}
+    esperado = datasetEsperado(numero, huecos)
+    resultados = {}
+    for modo in modos:
+        puerto = contexto.Value('i', 0)
+        servidor = contexto.Process(target = servirInformes, args = (configuracion, puerto), daemon = True) #Servidor nuevo en cada modo: los 503 son de la primera petición
+        servidor.start()
+        while puerto.value == 0:
+            time.sleep(0.05)
+        cola = contexto.Queue()
+        rastreador = contexto.Process(target = ejecutarRastreo, args = (modo, 'http://127.0.0.1:' + str(puerto.value), numero + 10, concurrencia, tasa, cola))
+        rastreador.start()
+        medida = cola.get()
+        rastreador.join()
+        servidor.terminate()
+        servidor.join()
+
+        dataset = medida['dataset']
+        diferencias = sorted(set(esperado) ^ set(dataset)) + sorted(idElem for idElem in esperado if idElem in dataset and dataset[idElem] != esperado[idElem])
+        resultados[modo] = {'paginas_s': len(dataset) / medida['segundos'], 'segundos': medida['segundos'], 'rss_mb': medida['rss'][0], 'rss_hijos_mb': medida['rss'][1],
+                            'etapas': {etapa: (valores['p50'], valores['p99']) for etapa, valores in medida['metricas']['etapas'].items()},
+                            'coincide': len(diferencias) == 0, 'diferencias': diferencias}
+
+    for modo in resultados:
+        resultado = resultados[modo]
+        print(modo + ': ' + str(round(resultado['paginas_s'], 1)) + ' páginas/s en ' + str(round(resultado['segundos'], 2)) + ' s, RSS '
+              + str(resultado['rss_mb'] if resultado['rss_mb'] == 'na' else round(resultado['rss_mb'], 1)) + ' MB (hijos '
+              + str(resultado['rss_hijos_mb'] if resultado['rss_hijos_mb'] == 'na' else round(resultado['rss_hijos_mb'], 1)) + ' MB), '
+              + ('coincide con el dataset de referencia' if resultado['coincide'] else 'NO coincide con el dataset de referencia en los ids ' + ', '.join(resultado['diferencias'][:20])))
+        for etapa in sorted(resultado['etapas']):
+            print('\t' + etapa + ': p50 ' + str(resultado['etapas'][etapa][0]) + ' s, p99 ' + str(resultado['etapas'][etapa][1]) + ' s')
+    return resultados
+
+def comprobarSintaxis(ruta = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'README.md')):
+    """
+    Comprueba la línea de comandos de exodusWS con los ejemplos del README: cada línea de uso se prueba sin sus opciones entre corchetes
+    y con todas ellas (con los parámetros sustituidos por VALORES_EJEMPLO), y debe analizarse con crearParser sin que adaptarSintaxisAnterior
+    la modifique. Los ejemplos de la sintaxis anterior deben traducirse a los de TRADUCCIONES_EJEMPLO.
+
+    Entrada: ruta: Ruta del README.
+
+    Salida: fallos: Lista de tuplas (ejemplo, motivo) de los ejemplos que no se analizan como se espera.
+    """
+    with open(ruta, encoding = 'utf-8') as readme:
+        lineas = readme.read().splitlines()
+    ejemplos = []
+    for linea in lineas:
+        if linea.startswith('python exodusWS.py '):
+            uso = linea[len('python exodusWS.py '):]
+            for parametro in VALORES_EJEMPLO:
+                uso = uso.replace(parametro, VALORES_EJEMPLO[parametro])
+            ejemplos += [re.sub(r' ?\[[^\]]*\]', '', uso), re.sub(r'[\[\]]', '', uso)]
+        elif 'sintaxis posicional anterior' in linea: #Los ejemplos de la sintaxis anterior son los del paréntesis (p. ej. ...)
+            for parentesis in re.findall(r'\(p\. ej\. ([^)]*)\)', linea):
+                ejemplos += [(anterior, TRADUCCIONES_EJEMPLO.get(anterior)) for anterior in re.findall(r'\*(?:python exodusWS\.py )?([^*]+)\*', parentesis)]
+
+    fallos = []
+    for ejemplo in ejemplos:
+        ejemplo, esperado = ejemplo if isinstance(ejemplo, tuple) else (ejemplo, ejemplo)
+        argumentos = exodusWS.adaptarSintaxisAnterior(shlex.split(ejemplo))
+        try:
+            exodusWS.crearParser().parse_args(argumentos)
+            if esperado == None or argumentos != shlex.split(esperado):
+                fallos.append((ejemplo, 'se traduce a ' + ' '.join(argumentos)))
+        except SystemExit:
+            fallos.append((ejemplo, 'no se analiza (' + ' '.join(argumentos) + ')'))
+    print(str(len(ejemplos) - len(fallos)) + ' de ' + str(len(ejemplos)) + ' ejemplos del README correctos')
+    for ejemplo, motivo in fallos:
+        print('\t' + ejemplo + ': ' + motivo)
+    return fallos
+
+#Bloque main de llamada al benchmark
+if __name__ == "__main__":
+    IN_prueba = sys.argv[1].lower() if len(sys.argv) > 1 else 'iconos'
+    IN_numero = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    if IN_prueba == 'iconos':
+        benchIconos(IN_numero)
+    elif IN_prueba == 'parseo':
+        benchParseo(IN_numero if len(sys.argv) > 2 else 50)
+    elif IN_prueba == 'rastreo':
+        benchRastreo(IN_numero if len(sys.argv) > 2 else 200)
+    elif IN_prueba == 'sintaxis':
+        sys.exit(1 if len(comprobarSintaxis()) > 0 else 0)
@@ -1,19 +1,304 @@
 ﻿# -*- coding: utf-8 -*-
-#Carga de librerías
+#Carga de librerías. requests, BeautifulSoup, lxml y scikit-image se cargan en las funciones que las usan,
+#para que los comandos que no descargan ni analizan páginas (exportar, indexar, consultar, stats...) arranquen rápido.
 import time
-from bs4 import BeautifulSoup
 import regex as re
-import requests
+from io import BytesIO
 import json
-from skimage import io, transform
 import numpy as np
-import matplotlib.pyplot as plt
 import sys
+import os
+import asyncio
+import heapq
+import struct
+import zlib
+import zipfile
+import hashlib
+import sqlite3
+import socket
+import glob
+import itertools
+import bisect
+import contextlib
+import cProfile
+import pstats
+import atexit
+import random
+import argparse
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+#Constantes de configuración del user-agent
+HEADER = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate, sdch, br",
+    "Accept-Language": "en-US,en;q=0.8",
+    "Cache-Control": "no-cache",
+    "dnt": "1",
+    "Pragma": "no-cache",
+    "Upgrade-Insecure-Requests": "1",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/56.0.2924.87 Safari/537.36"
+}
+MAX_REINTENTOS = 10 #Veces que se intenta procesar la misma web
+ESCALA_ESPERAS = 1.0 #Factor aplicado a los segundos de espera de gestionarTiempos; el benchmark lo reduce para rastrear un servidor local
+MAX_REINTENTOS_404 = 3 #Sucesión de webs con más de 10 errores 404 que permitimos. Sirve para parar el rastreador cuando se ha llegado al final de los informes existentes y evitar trampa de araña. Con SONDEAR_FINAL, los informes inexistentes no cuentan
+SONDEAR_FINAL = True #Antes de rastrear, si el final del rango no existe, se localiza dentro del rango el último informe existente con búsqueda exponencial y binaria y el rango se recorta hasta él
+VENTANA_SONDEO = 5 #Ids consecutivos consultados en cada punto del sondeo, para que un hueco en la numeración no se confunda con el final
+REINTENTOS_SONDEO = 3 #Intentos de cada petición del sondeo antes de darla por indeterminada
+CODIGOS_AUSENTE = (404, 410) #Códigos con los que el servidor indica que el informe no existe: respuesta definitiva, sin reintentos
+TOLERANCIA_ERRORES = 3 #Marca el número máximo de atributos con valor 'na' que podrá contener cada elemento. Si se supera, no se incorpora al dataset.
+URL_BASE = 'https://reports.exodus-privacy.eu.org/es/reports/'
+URL_BASE_ICONOS = 'https://reports.exodus-privacy.eu.org/es'
+FICHERO_ICONO_INTEGRADO = 'exodus.json'
+FICHERO_ICONO_A_FICHERO = 'exodusNoIcon.json'
+FICHERO_ICONO_BINARIO = 'exodusIconBin.json'
+ICONO_BINARIO = 'binario' #Valor de iconoAFichero para guardar los iconos en un almacén binario en lugar de en el json o en ficheros PNG
+CONCURRENCIA_POR_HOST = 4 #Peticiones simultáneas permitidas contra un mismo servidor en el modo asíncrono
+TASA_PETICIONES = 1.0 #Peticiones por segundo permitidas en el modo asíncrono (presupuesto global del cubo de tokens)
+TASA_MINIMA = 0.05 #Suelo al que puede reducirse la tasa adaptativa ante errores o lentitud del servidor
+FACTOR_REDUCCION_TASA = 0.5 #Factor multiplicativo aplicado a la tasa cuando hay errores o la latencia supera el objetivo
+INCREMENTO_TASA = 0.05 #Peticiones por segundo que se recuperan, de forma aditiva, por cada segundo de respuestas sanas
+LATENCIA_OBJETIVO = 5.0 #Segundos de respuesta a partir de los cuales se considera que el servidor está saturado
+ESPERA_MAXIMA_REINTENTO = 3600 #Techo en segundos del retroceso exponencial de un elemento pendiente de reintento
+ESPERA_MAXIMA_RETRY_AFTER = 600 #Techo en segundos de la espera que puede imponer el servidor con la cabecera Retry-After
+TAMANO_POOL = 10 #Conexiones persistentes que mantiene abiertas la sesión HTTP compartida por servidor
+TIMEOUT_CONEXION = 10 #Segundos máximos para establecer la conexión con el servidor
+TIMEOUT_LECTURA = 60 #Segundos máximos de espera de datos del servidor una vez conectado
+PUNTO_CONTROL_REGISTROS = 50 #Anotaciones en el registro incremental tras las que se fuerza su volcado a disco (fsync)
+PUNTO_CONTROL_SEGUNDOS = 30 #Segundos máximos entre volcados a disco del registro incremental
+UMBRAL_COMPACTACION = 32 << 20 #Bytes del registro incremental a partir de los que se compacta al terminar un rastreo; por debajo queda pendiente para el siguiente
+PROCESOS_ICONOS = os.cpu_count() or 1 #Procesos dedicados a decodificar y redimensionar iconos fuera del camino crítico de la descarga
+MOTOR_PARSEO = 'lxml' #Analizador de las páginas de informe: 'lxml' (recorrido único con lxml y BeautifulSoup solo para páginas no contempladas) o 'bs4'
+HILOS_ICONOS = 4 #Hilos que codifican y escriben en segundo plano los iconos PNG cuando iconoAFichero == True
+PROCESOS_PARSEO = os.cpu_count() or 1 #Procesos del modo tubería que analizan el html y decodifican los iconos
+TAMANO_COLA_TUBERIA = 32 #Elementos que puede acumular cada cola entre etapas del modo tubería antes de frenar a la etapa anterior
+ICONOS_EN_ARCHIVO = False #Si es True, los iconos PNG se agrupan en un único zip (exodusNoIcon.png.zip) en lugar de un fichero por aplicación
+ARCHIVAR_RESPUESTAS = False #Si es True, el html de los informes y los bytes de los iconos se guardan en el archivo de respuestas para poder reanalizarlos sin rastrear
+FICHERO_ARCHIVO = 'exodusRespuestas.archivo' #Fichero de contenidos del archivo de respuestas; su índice es exodusRespuestas.archivo.jsonl
+FICHERO_COORDINACION = 'exodusTramos.db' #Base de datos SQLite con los tramos de ids y sus arriendos en el rastreo por tramos
+DIRECTORIO_TRAMOS = 'tramos' #Directorio donde cada trabajador del rastreo por tramos escribe el dataset de sus tramos
+TAMANO_TRAMO = 1000 #Ids de cada tramo del rastreo por tramos
+DURACION_ARRIENDO = 600 #Segundos de validez del arriendo de un tramo; el trabajador lo renueva cada tercio de este tiempo mientras lo rastrea
+LOTE_EXPORTACION = 10000 #Filas de la exportación en columnas que se acumulan en memoria antes de añadirlas a los ficheros y confirmarlas
+COLUMNAS_ENTERAS = ('Tracker_count', 'Permissions_count', 'Permissions_warning_count') #Atributos exportados como columnas int32
+COLUMNAS_CODIFICADAS = ('Name', 'Version', 'Downloads', 'Developer', 'Country') #Atributos de texto exportados como códigos int32 de un diccionario
+COLUMNAS_LISTA = ('Trackers', 'Purposes', 'Permissions') #Listas exportadas como códigos int32 de un diccionario y el final acumulado de cada lista
+CAMPOS_INDICE = ('Trackers', 'Purposes', 'Permissions', 'Developer') #Atributos cuyos valores se indexan en el índice invertido
+FICHERO_METRICAS = 'exodusMetricas.json' #Fichero json donde se vuelcan periódicamente las métricas del rastreo
+INTERVALO_METRICAS = 10 #Segundos entre volcados del fichero de métricas
+PUERTO_METRICAS = None #Puerto del endpoint HTTP /metrics en formato de texto de Prometheus; None para no abrirlo
+LIMITES_HISTOGRAMA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) #Límites superiores en segundos de las cubetas de los histogramas de latencia
+PERFILAR_MUESTRA = 0.0 #Fracción de páginas cuyo tratamiento se perfila con cProfile (0 desactiva el perfilado)
+FICHERO_PERFIL = 'exodusPerfil.prof' #Perfil acumulado de las páginas perfiladas, legible con pstats o snakeviz
+SINTAXIS_ANTERIOR = {'crawl': ('--icono', '--modo', '--concurrencia', '--tasa'), 'compactar': ('--icono',), 'reparse': ('--icono',),
+                     'refrescar': ('--icono', '--limite', '--concurrencia', '--tasa'), 'exportar': ('--icono', '--completa'),
+                     'indexar': ('--icono', '--completa'), 'consultar': ('--icono', '', '--campo'), 'tramos preparar': ('', '', ''),
+                     'tramos trabajar': ('--icono', '--modo', '--concurrencia', '--tasa'), 'tramos fusionar': ('--icono', '--forzar'), 'tramos estado': ()} #Opción de la sintaxis actual que corresponde a cada parámetro posicional de la anterior ('' si sigue siendo posicional)
+
+sesionPorDefecto = None #Sesión compartida que se usa cuando no se indica otra, creada en el primer uso
+
+class Metricas:
+    """
+    Instrumentación del rastreo: histogramas de latencia por etapa (descarga, parseo, icono_descarga, icono_redimension, icono_escritura,
+    persistencia) con las cubetas de LIMITES_HISTOGRAMA, y contadores por código HTTP, por atributo con error, por anotación del registro
+    y de segundos de espera por motivo (esperas de gestionarTiempos y del cubo de tokens). El análisis se mide dentro del pool que lo ejecuta
+    (ver cronometrar) y su espera en la cola del pool aparte, como parseo_espera; el resto de etapas que se ejecutan en un pool de procesos
+    se miden desde el hilo que las encarga, tal y como las ve el rastreo. Con PERFILAR_MUESTRA > 0 perfila con cProfile esa fracción de
+    páginas y acumula el perfil. Hay una única instancia del módulo, metricas, que se vuelca con volcarMetricas y se sirve con iniciarMetricas.
+    Es segura entre hilos.
+    """
+    ETIQUETAS = {'peticiones': 'codigo', 'errores_atributo': 'atributo', 'espera_segundos': 'motivo', 'anotaciones': 'tipo'} #Nombre de la etiqueta de Prometheus de cada contador
+
+    def __init__(self):
+        self.cerrojo = threading.Lock()
+        self.cerrojoPerfil = threading.Lock() #cProfile solo admite un perfilador activo a la vez
+        self.inicio = time.time()
+        self.histogramas = {}
+        self.contadores = {}
+        self.perfil = None
+        self.paginasPerfiladas = 0
+
+    def observar(self, etapa, segundos):
+        with self.cerrojo:
+            histograma = self.histogramas.setdefault(etapa, {'cubetas': [0] * (len(LIMITES_HISTOGRAMA) + 1), 'suma': 0.0, 'cuenta': 0})
+            histograma['cubetas'][bisect.bisect_left(LIMITES_HISTOGRAMA, segundos)] += 1
+            histograma['suma'] += segundos
+            histograma['cuenta'] += 1
+
+    @contextlib.contextmanager
+    def medir(self, etapa):
+        comienzo = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(etapa, time.perf_counter() - comienzo)
+
+    def contar(self, nombre, etiqueta, valor = 1):
+        with self.cerrojo:
+            contador = self.contadores.setdefault(nombre, {})
+            contador[str(etiqueta)] = contador.get(str(etiqueta), 0) + valor
+
+    def contarErrores(self, error):
+        for clave in error:
+            self.contar('errores_atributo', clave)
+
+    def enMuestra(self):
+        #Decide al azar si la página entra en la fracción PERFILAR_MUESTRA que se perfila
+        return PERFILAR_MUESTRA > 0 and random.random() < PERFILAR_MUESTRA
+
+    def perfilar(self, funcion, *argumentos):
+        """
+        Ejecuta funcion(*argumentos) y, para una fracción PERFILAR_MUESTRA de las llamadas, la perfila con cProfile y acumula el perfil.
+        """
+        if not self.enMuestra():
+            return funcion(*argumentos)
+        return self.perfilarLlamada(funcion, *argumentos)
+
+    def perfilarLlamada(self, funcion, *argumentos):
+        #Si ya hay otra llamada perfilándose en otro hilo, esta se ejecuta sin perfilar
+        if not self.cerrojoPerfil.acquire(blocking = False):
+            return funcion(*argumentos)
+        try:
+            perfil = cProfile.Profile()
+            resultado = perfil.runcall(funcion, *argumentos)
+            with self.cerrojo:
+                self.paginasPerfiladas += 1
+                if self.perfil == None:
+                    self.perfil = pstats.Stats(perfil)
+                else:
+                    self.perfil.add(perfil)
+            return resultado
+        finally:
+            self.cerrojoPerfil.release()
+
+    def percentil(self, etapa, fraccion):
+        #Estimación del percentil por el límite superior de la cubeta en que cae; el de la última cubeta es el máximo de LIMITES_HISTOGRAMA
+        histograma = self.histogramas[etapa]
+        acumulado = 0
+        for posicion, cuenta in enumerate(histograma['cubetas']):
+            acumulado += cuenta
+            if acumulado >= fraccion * histograma['cuenta']:
+                return LIMITES_HISTOGRAMA[min(posicion, len(LIMITES_HISTOGRAMA) - 1)]
+        return LIMITES_HISTOGRAMA[-1]
+
+    def instantanea(self):
+        """
+        Devuelve un diccionario serializable en json con el estado actual de los histogramas y contadores.
+        """
+        with self.cerrojo:
+            etapas = {}
+            for etapa, histograma in self.histogramas.items():
+                etapas[etapa] = {'cuenta': histograma['cuenta'], 'suma': round(histograma['suma'], 6),
+                                 'media': round(histograma['suma'] / histograma['cuenta'], 6) if histograma['cuenta'] > 0 else 0,
+                                 'p50': self.percentil(etapa, 0.5), 'p99': self.percentil(etapa, 0.99),
+                                 'cubetas': dict(zip([str(limite) for limite in LIMITES_HISTOGRAMA] + ['+Inf'], histograma['cubetas']))}
+            return {'inicio': datetime.fromtimestamp(self.inicio, timezone.utc).isoformat(), 'segundos': round(time.time() - self.inicio, 3),
+                    'etapas': etapas, 'contadores': {nombre: dict(contador) for nombre, contador in self.contadores.items()},
+                    'paginas_perfiladas': self.paginasPerfiladas}
+
+    def prometheus(self):
+        """
+        Devuelve las métricas en el formato de texto de Prometheus.
+        """
+        def escapar(valor):
+            return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lineas = []
+        with self.cerrojo:
+            lineas.append('# TYPE exodus_etapa_segundos histogram')
+            for etapa, histograma in sorted(self.histogramas.items()):
+                acumulado = 0
+                for limite, cuenta in zip([str(limite) for limite in LIMITES_HISTOGRAMA] + ['+Inf'], histograma['cubetas']):
+                    acumulado += cuenta
+                    lineas.append('exodus_etapa_segundos_bucket{etapa="' + etapa + '",le="' + limite + '"} ' + str(acumulado))
+                lineas.append('exodus_etapa_segundos_sum{etapa="' + etapa + '"} ' + repr(histograma['suma']))
+                lineas.append('exodus_etapa_segundos_count{etapa="' + etapa + '"} ' + str(histograma['cuenta']))
+            for nombre, contador in sorted(self.contadores.items()):
+                lineas.append('# TYPE exodus_' + nombre + '_total counter')
+                for etiqueta, valor in sorted(contador.items()):
+                    lineas.append('exodus_' + nombre + '_total{' + self.ETIQUETAS.get(nombre, 'etiqueta') + '="' + escapar(etiqueta) + '"} ' + str(valor))
+        return '\n'.join(lineas) + '\n'
+
+metricas = Metricas() #Métricas del proceso, compartidas por todos los modos de rastreo
+
+def cronometrar(funcion, *argumentos):
+    """
+    Ejecuta funcion(*argumentos) dentro del pool al que se encarga y devuelve su resultado junto con los segundos que ha tardado,
+    de modo que quien la encarga puede separar el tiempo de ejecución de la espera de la tarea en la cola del pool.
+
+    Salida: Tupla (resultado, segundos).
+    """
+    comienzo = time.perf_counter()
+    resultado = funcion(*argumentos)
+    return resultado, time.perf_counter() - comienzo
+
+class ManejadorMetricas(BaseHTTPRequestHandler):
+    """
+    Endpoint HTTP de las métricas: /metrics en formato de texto de Prometheus y /metrics.json con la instantánea en json.
+    """
+    def do_GET(self):
+        if self.path == '/metrics':
+            cuerpo, tipo = metricas.prometheus().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            cuerpo, tipo = json.dumps(metricas.instantanea()).encode('utf-8'), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *argumentos): #Las peticiones del recolector no se muestran en la salida del rastreo
+        pass
+
+def volcarMetricas(rutaFichero = FICHERO_METRICAS):
+    """
+    Vuelca de forma atómica la instantánea de las métricas en el fichero json y, si se ha perfilado alguna página, el perfil acumulado en FICHERO_PERFIL.
+
+    Entrada: rutaFichero: Ruta del fichero json de métricas.
+    """
+    try:
+        volcarJsonAtomico(rutaFichero, metricas.instantanea())
+        with metricas.cerrojo:
+            if metricas.perfil != None:
+                metricas.perfil.dump_stats(FICHERO_PERFIL)
+    except Exception as e:
+        print('Error volcando las métricas\n\t' + str(e))
+
+def iniciarMetricas(rutaFichero = FICHERO_METRICAS, intervalo = INTERVALO_METRICAS, puerto = PUERTO_METRICAS):
+    """
+    Expone las métricas del proceso: un hilo las vuelca en el fichero json cada intervalo segundos y una última vez al salir del proceso,
+    y si se indica un puerto se sirven por HTTP para Prometheus.
+
+    Entrada: rutaFichero: Ruta del fichero json de métricas.
+             intervalo: Segundos entre volcados.
+             puerto: Puerto del endpoint HTTP /metrics o None para no abrirlo.
+    """
+    def volcarPeriodicamente():
+        while True:
+            time.sleep(intervalo)
+            volcarMetricas(rutaFichero)
+
+    threading.Thread(target = volcarPeriodicamente, daemon = True).start()
+    atexit.register(volcarMetricas, rutaFichero)
+    if puerto != None:
+        servidor = ThreadingHTTPServer(('', puerto), ManejadorMetricas)
+        servidor.daemon_threads = True
+        threading.Thread(target = servidor.serve_forever, daemon = True).start()
+        print('Métricas en http://localhost:' + str(puerto) + '/metrics')
 
 def cargarElementosTratados(rutaDataSet):
     """
     Created on Sun Nov 01 14:00:00 2020
     Se encargaq de cargar el json del dataset actual en un diccionario y devolver en una lista, aquellos elementos ya tratados en base a su atributo Id
+    Si existe el registro incremental de una sesión anterior sin compactar, se reproducen sus elementos sobre el dataset.
   
     @author: luimoco
 
@@ -25,33 +310,354 @@ def cargarElementosTratados(rutaDataSet):
     try:
         with open(rutaDataSet) as json_file: 
             data_dict = json.load(json_file)
-            data_list = [int(x) for x in data_dict]
     except Exception:
         data_dict = {}
-        data_list = []
+
+    for anotacion in leerRegistro(rutaRegistro(rutaDataSet)):
+        if anotacion['tipo'] == 'elemento':
+            data_dict[anotacion['id']] = anotacion['datos']
+    data_list = [int(x) for x in data_dict]
 
     return data_dict, data_list 
 
-def crearListaElementosATratar(tratados, inicio = 1, limite = 100):
+class MapaBits:
+    """
+    Conjunto compacto de ids enteros no negativos representado como un mapa de bits: un bit por id posible.
+    150000 ids ocupan unos 19 KB frente a varios MB de una lista o un set de enteros de Python, y la consulta de pertenencia es O(1).
+
+    Entrada: ids: Ids iniciales del conjunto.
+    """
+    def __init__(self, ids = ()):
+        self.bits = bytearray()
+        for idElem in ids:
+            self.add(idElem)
+
+    def add(self, idElem):
+        byte = idElem >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte - len(self.bits) + 1))
+        self.bits[byte] |= 1 << (idElem & 7)
+
+    def update(self, otro):
+        #Unión con otro MapaBits, byte a byte
+        if len(otro.bits) > len(self.bits):
+            self.bits.extend(bytes(len(otro.bits) - len(self.bits)))
+        for byte, valor in enumerate(otro.bits):
+            if valor != 0:
+                self.bits[byte] |= valor
+
+    def __contains__(self, idElem):
+        byte = idElem >> 3
+        return 0 <= byte < len(self.bits) and (self.bits[byte] >> (idElem & 7)) & 1 == 1
+
+    def __iter__(self):
+        for byte, valor in enumerate(self.bits):
+            if valor != 0:
+                for bit in range(8):
+                    if (valor >> bit) & 1:
+                        yield (byte << 3) + bit
+
+    def __len__(self):
+        return sum(bin(valor).count('1') for valor in self.bits)
+
+    def guardar(self, ruta):
+        temporal = ruta + '.tmp'
+        with open(temporal, 'wb') as fichero:
+            fichero.write(self.bits)
+            fichero.flush()
+            os.fsync(fichero.fileno())
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        mapa = cls()
+        with open(ruta, 'rb') as fichero:
+            mapa.bits = bytearray(fichero.read())
+        return mapa
+
+def rutaAusentes(rutaDataSet):
+    """
+    Devuelve la ruta del conjunto de ids ausentes (informes que el servidor responde 404) del dataset. Ej. exodus.json > exodus.ausentes
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+
+    Salida: Ruta del fichero con el MapaBits de ids ausentes.
+    """
+    return os.path.splitext(rutaDataSet)[0] + '.ausentes'
+
+def cargarIdsAusentes(rutaDataSet):
+    """
+    Carga los ids que el servidor ha respondido como inexistentes en rastreos anteriores, para no volver a pedirlos.
+    Incluye los anotados en el registro incremental de una sesión anterior sin compactar.
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+
+    Salida: ausentes: MapaBits con los ids ausentes.
+    """
+    ausentes = MapaBits()
+    if os.path.exists(rutaAusentes(rutaDataSet)):
+        try:
+            ausentes = MapaBits.cargar(rutaAusentes(rutaDataSet))
+        except Exception as e:
+            print('Error leyendo los ids ausentes ' + rutaAusentes(rutaDataSet) + '\n\t' + str(e))
+    for anotacion in leerRegistro(rutaRegistro(rutaDataSet)):
+        if anotacion['tipo'] == 'ausente':
+            ausentes.add(int(anotacion['id']))
+    return ausentes
+
+def recortarAusentes(ausentes, tratados):
+    """
+    Conserva solo los ids ausentes anteriores al mayor id del dataset: son huecos de la numeración, que no se volverán a pedir.
+    Los posteriores al último informe conocido pueden ser informes aún no publicados, por lo que no se guardan y los rastreos futuros los vuelven a pedir.
+
+    Entrada: ausentes: MapaBits con los ids que el servidor ha respondido como inexistentes.
+             tratados: Ids del dataset (diccionario id > elemento o cualquier iterable de ids).
+
+    Salida: MapaBits con los ids ausentes confirmados.
+    """
+    ultimo = max((int(idElem) for idElem in tratados), default = 0)
+    return MapaBits(idElem for idElem in ausentes if idElem < ultimo)
+
+def rutaIndiceIds(rutaDataSet):
+    """
+    Devuelve la ruta del índice de ids tratados que acompaña al json del dataset. Ej. exodus.json > exodus.ids
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+
+    Salida: Ruta del fichero con el MapaBits de ids.
+    """
+    return os.path.splitext(rutaDataSet)[0] + '.ids'
+
+def recorrerDataSet(rutaDataSet, tamanoBloque = 1 << 20):
+    """
+    Recorre en streaming los elementos del json del dataset sin cargarlo entero: se lee por bloques y cada elemento se decodifica
+    y se entrega de uno en uno, de modo que la memoria usada es la de un bloque y no la de todo el dataset.
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+             tamanoBloque: Caracteres leídos del fichero en cada lectura.
+
+    Salida: Generador de tuplas (id entero, diccionario de atributos).
+    """
+    decodificador = json.JSONDecoder()
+    espacios = re.compile(r'[\s,:]*')
+    with open(rutaDataSet, encoding = 'utf-8') as fichero:
+        buffer = fichero.read(tamanoBloque)
+        pos = buffer.find('{')
+        if pos == -1: #Fichero vacío o sin elementos
+            return
+        pos += 1
+        while True:
+            pos = espacios.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == '}':
+                return
+            try:
+                clave, fin = decodificador.raw_decode(buffer, pos)
+                fin = espacios.match(buffer, fin).end()
+                valor, fin = decodificador.raw_decode(buffer, fin)
+            except ValueError: #Elemento partido entre dos bloques: se descarta lo ya procesado del buffer y se lee el siguiente bloque
+                bloque = fichero.read(tamanoBloque)
+                if bloque == '':
+                    return
+                buffer = buffer[pos:] + bloque
+                pos = 0
+                continue
+            pos = fin
+            yield int(clave), valor
+
+def recorrerIdsDataSet(rutaDataSet, tamanoBloque = 1 << 20):
+    """
+    Recorre en streaming las claves de primer nivel (ids) del json del dataset sin cargarlo entero; cada elemento se descarta de inmediato.
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+             tamanoBloque: Caracteres leídos del fichero en cada lectura.
+
+    Salida: Generador de ids enteros.
+    """
+    for idElem, valor in recorrerDataSet(rutaDataSet, tamanoBloque):
+        yield idElem
+
+def cargarIdsTratados(rutaDataSet, conRegistro = True):
+    """
+    Alternativa ligera a cargarElementosTratados para reanudar el rastreo: obtiene solo los ids ya tratados en un MapaBits, sin materializar los elementos.
+    Si el índice de ids del dataset está al día se lee directamente; si no, se recorre el json en streaming y se regenera el índice.
+    Después se añaden los ids del registro incremental de una sesión anterior sin compactar.
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+             conRegistro: Si es False, solo se obtienen los ids del json, sin los del registro incremental.
+
+    Salida: tratados: MapaBits con los ids ya tratados.
+    """
+    rutaIndice = rutaIndiceIds(rutaDataSet)
+    tratados = None
+    if os.path.exists(rutaIndice) and os.path.exists(rutaDataSet) and os.path.getmtime(rutaIndice) >= os.path.getmtime(rutaDataSet):
+        try:
+            tratados = MapaBits.cargar(rutaIndice)
+        except Exception:
+            tratados = None
+    if tratados == None:
+        tratados = MapaBits()
+        if os.path.exists(rutaDataSet):
+            try:
+                for idElem in recorrerIdsDataSet(rutaDataSet):
+                    tratados.add(idElem)
+                tratados.guardar(rutaIndice)
+            except Exception as e:
+                print('Error leyendo los ids del dataset ' + rutaDataSet + '\n\t' + str(e))
+
+    for anotacion in (leerRegistro(rutaRegistro(rutaDataSet)) if conRegistro else ()):
+        if anotacion['tipo'] == 'elemento':
+            tratados.add(int(anotacion['id']))
+
+    return tratados
+
+def crearListaElementosATratar(tratados, inicio = 1, limite = 100, ausentes = None):
     """
     Created on Fri Oct 30 19:36:00 2020
     Devuelve una lista de enteros para iterar con aquellos elementos que no han sido tratados previamente o se han tratado con error desde un número inicial hasta un límite fijado.
 
     @author: luimoco
 
-    Entrada:  tratados: De esta lista se obtiene información de los elementos están ya tratados.
+    Entrada:  tratados: De esta colección (lista, set o MapaBits) se obtiene información de los elementos están ya tratados.
             inicio: Establece el id para comenzar a iterar.
             limite: Establece un límite, marcado desde el inicio, para la iteración de rastreo.
+            ausentes: MapaBits con los ids que el servidor ha respondido como inexistentes, que tampoco se vuelven a pedir.
 
     Salida: Una lista de identificadores de elementos y que no hayan sido tratados previamente
     """
 
-    lista = list(range(inicio, inicio + limite))
-    return [x for x in lista if x not in tratados]
+    if isinstance(tratados, list): #Una lista haría la comprobación O(N·M); se convierte a set para que sea O(rango)
+        tratados = set(tratados)
+    if ausentes == None:
+        ausentes = ()
+    return [x for x in range(inicio, inicio + limite) if x not in tratados and x not in ausentes]
+
+def existeInforme(idElem, sesion, cubo):
+    """
+    Comprueba si existe la página de informe de un id. Se respeta el cubo de tokens en cada petición. El contenido de la respuesta se lee
+    siempre para que la conexión vuelva a la sesión y la siguiente petición del sondeo la reutilice.
+
+    Entrada: idElem: Id del informe.
+             sesion: Sesión HTTP compartida.
+             cubo: CuboTokens que limita la tasa de peticiones del sondeo.
+
+    Salida: True si existe, False si el servidor responde que no existe (CODIGOS_AUSENTE) o None si no se ha podido averiguar.
+    """
+    for intento in range(1, REINTENTOS_SONDEO + 1):
+        cubo.adquirir()
+        try:
+            web = sesion.get(URL_BASE + str(idElem) + '/', timeout = (TIMEOUT_CONEXION, TIMEOUT_LECTURA))
+            if web.status_code == 200:
+                return True
+            if web.status_code in CODIGOS_AUSENTE:
+                return False
+            retryAfter = leerRetryAfter(web)
+            if retryAfter != None:
+                cubo.pausar(retryAfter)
+        except Exception as e:
+            print('Error sondeando el informe ' + str(idElem) + '\n\tIntento ' + str(intento) + ' de ' + str(REINTENTOS_SONDEO) + '.\n\t' + str(e))
+        cubo.reducir()
+    return None
+
+def sondearUltimoId(desde, hasta, sesion, cubo, ventana = VENTANA_SONDEO):
+    """
+    Localiza el último informe existente entre desde y hasta (excluido), con búsqueda exponencial (desde+1, +2, +4...) hasta
+    dar con un punto sin informes y búsqueda binaria entre el último punto con informes y ese. Un punto se considera con informes
+    si existe alguno de los ventana ids consecutivos que empiezan en él. Nunca se consultan ids de hasta en adelante.
+    Como un hueco en la numeración más largo que la ventana parecería el final, el candidato se confirma buscando informes en ventanas
+    a distancias crecientes (ventana, 2*ventana, 4*ventana...) hasta el final del rango, cuya última ventana se consulta siempre;
+    si aparece alguno, la búsqueda continúa desde él. Así un hueco no recorta el rango por largo que sea, siempre que los informes
+    posteriores lleguen al final del rango u ocupen al menos tantos ids como el hueco.
+    Si no se puede averiguar si un id existe, se considera que existe para no acortar el rastreo.
+
+    Entrada: desde: Id a partir del que buscar, normalmente el mayor ya tratado o el inicio del rango.
+             hasta: Id siguiente al último del rango.
+             sesion: Sesión HTTP compartida.
+             cubo: CuboTokens que limita la tasa de peticiones del sondeo.
+             ventana: Ids consecutivos consultados en cada punto.
+
+    Salida: Id del último informe existente del rango, o None si no se ha localizado ningún informe entre desde y hasta.
+    """
+    conocidos = {}
+
+    def hayInformes(punto):
+        for idElem in range(punto, min(punto + ventana, hasta)):
+            if idElem not in conocidos:
+                conocidos[idElem] = existeInforme(idElem, sesion, cubo)
+            if conocidos[idElem] != False:
+                return True
+        return False
+
+    def siguienteInforme(ultimo):
+        #Primer punto con informes tras el candidato, en ventanas a distancias crecientes y una última al final del rango
+        desplazamiento = 0
+        while ultimo + 1 + desplazamiento < hasta - ventana:
+            if hayInformes(ultimo + 1 + desplazamiento):
+                return ultimo + 1 + desplazamiento
+            desplazamiento = max(ventana, desplazamiento * 2)
+        punto = max(ultimo + 1, hasta - ventana)
+        return punto if hayInformes(punto) else None
+
+    vivo = siguienteInforme(desde - 1)
+    if vivo == None:
+        return None
+    while True:
+        paso = 1
+        muerto = min(vivo + paso, hasta)
+        while hayInformes(muerto): #Búsqueda exponencial hasta un punto sin informes, que como mucho es el final del rango
+            vivo, paso = muerto, paso * 2
+            muerto = min(vivo + paso, hasta)
+        while muerto - vivo > 1: #Búsqueda binaria entre el último punto con informes y el primero sin ellos
+            medio = (vivo + muerto) // 2
+            if hayInformes(medio):
+                vivo = medio
+            else:
+                muerto = medio
+        siguiente = siguienteInforme(muerto - 1) #Confirmar que no es un hueco antes de darlo por el final
+        if siguiente == None:
+            return muerto - 1
+        vivo = siguiente
+
+def acotarRango(inicio, limite, tratados, cubo):
+    """
+    Si SONDEAR_FINAL está activado, recorta el rango a rastrear al último informe existente en el sitio. Primero se comprueba el último id
+    del rango: si existe (o ya está tratado), no hay nada que recortar y no se sondea. Si no, se localiza el último informe del rango con
+    sondearUltimoId desde el mayor id ya tratado del rango o desde su inicio. Si el sondeo no localiza ningún informe, no se recorta: se avisa y se rastrea el rango pedido.
+
+    Entrada: inicio: Id del primer informe a rastrear.
+             limite: Número de informes a rastrear desde el inicio.
+             tratados: MapaBits con los ids ya tratados.
+             cubo: CuboTokens que limita la tasa de peticiones del sondeo.
+
+    Salida: limite: Número de informes a rastrear desde el inicio, sin pasar del último existente.
+    """
+    if SONDEAR_FINAL != True or limite <= 0:
+        return limite
+    hasta = inicio + limite
+    sesion = obtenerSesion()
+    if (hasta - 1) in tratados or existeInforme(hasta - 1, sesion, cubo) != False: #El final del rango existe: no hay nada que recortar
+        return limite
+    desde = max([idElem for idElem in tratados if inicio <= idElem < hasta] + [inicio])
+    ultimo = sondearUltimoId(desde, hasta, sesion, cubo)
+    if ultimo == None:
+        print('Aviso: el sondeo no ha localizado informes entre ' + str(desde) + ' y ' + str(hasta - 1) + '; se rastrea el rango pedido sin recortarlo')
+        return limite
+    print('Último informe existente localizado: ' + str(ultimo))
+    return max(0, min(limite, ultimo - inicio + 1))
+
+def cuboSondeo(modo, tasa):
+    """
+    Devuelve el CuboTokens con el que acotarRango sondea el final del rango en cada modo de rastreo.
+
+    Entrada: modo: Modo de rastreo, como en rastreo().
+             tasa: En modos asíncrono y tubería, peticiones por segundo permitidas en total.
 
-    return lista
+    Salida: CuboTokens al ritmo de la espera estándar en el modo secuencial o a la tasa indicada en el resto.
+    """
+    if modo == 'secuencial':
+        return CuboTokens(1 / gestionarTiempos('ESPERA_ESTANDAR', 1, esperar = False))
+    return CuboTokens(tasa)
 
-def gestionarTiempos(motivo = 'ESPERA_ESTANDAR', intento = 1):
+def gestionarTiempos(motivo = 'ESPERA_ESTANDAR', intento = 1, esperar = True):
     """
     Created on Fri Oct 30 19:41:00 2020
     Herramienta para la gestión temporal del user-agent, a acelerando o frenando el ritmo de ejecución a partir de eventos producidos durante el proceso.
@@ -60,6 +666,9 @@ def gestionarTiempos(motivo = 'ESPERA_ESTANDAR', intento = 1):
 
     Entrada:motivo: Indicador del evento producido en el rastreador
             intento: Señala el intento actual de recuperación de la página que servirá de multiplicador para esperar más o menos tiempo.
+            esperar: Si es False no se bloquea el proceso y solo se calcula el retraso, para que el modo asíncrono pueda esperar sin parar al resto de peticiones.
+
+    Salida: retraso: Segundos de espera correspondientes al evento.
     """
     MOTIVOS = {'ESPERA_ESTANDAR':3,
                'ESPERA_ERROR_CONEXION':3600,
@@ -68,11 +677,136 @@ def gestionarTiempos(motivo = 'ESPERA_ESTANDAR', intento = 1):
                'ESPERA_ERROR_CLIENTE':5,
                'ESPERA_CORRECTA_INCIDENCIAS':10}
     
-    retraso = MOTIVOS[motivo] * intento
+    retraso = MOTIVOS[motivo] * intento * ESCALA_ESPERAS
     
-    time.sleep(retraso)
+    if esperar == True:
+        metricas.contar('espera_segundos', motivo, retraso)
+        time.sleep(retraso)
+
+    return retraso
     
-def obtenerIcono(ruta):
+def crearSesion(tamanoPool = TAMANO_POOL):
+    """
+    Crea la sesión HTTP compartida por la descarga de páginas y de iconos, con un pool de conexiones persistentes (keep-alive)
+    para no repetir el establecimiento TCP+TLS en cada petición al mismo servidor.
+
+    Entrada: tamanoPool: Conexiones que se mantienen abiertas por servidor. En modo asíncrono debe cubrir las peticiones simultáneas.
+
+    Salida: sesion: requests.Session con la cabecera del user-agent. Los reintentos los gestiona el rastreador, no el adaptador.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    sesion = requests.Session()
+    adaptador = HTTPAdapter(pool_connections = tamanoPool, pool_maxsize = tamanoPool, max_retries = 0)
+    sesion.mount('https://', adaptador)
+    sesion.mount('http://', adaptador)
+    sesion.headers.update(HEADER)
+    sesion.headers['Connection'] = 'keep-alive'
+    return sesion
+
+def obtenerSesion(sesion = None):
+    """
+    Devuelve la sesión indicada o, si no se indica ninguna, la sesión compartida por defecto del módulo.
+
+    Entrada: sesion: Sesión HTTP a utilizar o None.
+
+    Salida: sesion: Sesión HTTP con pool de conexiones.
+    """
+    global sesionPorDefecto
+    if sesion != None:
+        return sesion
+    if sesionPorDefecto == None:
+        sesionPorDefecto = crearSesion()
+    return sesionPorDefecto
+
+def descargarIcono(ruta, sesion = None):
+    """
+    Descarga los bytes del icono de la aplicación con la sesión HTTP compartida, sin decodificarlos.
+
+    Entrada: ruta: El atributo src obtenido en el rastreo de la página para poder conformar la URL desde la que rescatar la imagen desde el servidor.
+             sesion: Sesión HTTP compartida con la descarga de páginas.
+
+    Salida: contenido: Bytes de la imagen o None si se ha producido un error.
+            error: Si se ha producido un error, se devuelve el mensaje para poder incluirlo en el tratamiento de errores de la página.
+    """
+    ruta = URL_BASE_ICONOS + ruta + '/'
+    try:
+        with metricas.medir('icono_descarga'):
+            respuesta = obtenerSesion(sesion).get(ruta, timeout = (TIMEOUT_CONEXION, TIMEOUT_LECTURA))
+        respuesta.raise_for_status()
+        return respuesta.content, ''
+    except Exception as e:
+        return None, str(e)
+
+def normalizarIcono(imagen):
+    """
+    Redimensiona la imagen decodificada a 32x32 y la normaliza a RGBA mediante operaciones sobre arrays, sin recorrer los píxeles.
+
+    Entrada: imagen: Array numpy de la imagen decodificada, en escala de grises / canal de transparencia (2D), escala de grises con transparencia (LA), RGB o RGBA.
+
+    Salida: photo: Array numpy uint8 de forma (32,32,4).
+    """
+    from skimage import transform
+    photo = (transform.resize(imagen, (32, 32), mode='edge') * 255).astype(np.uint8)
+    if len(photo.shape) == 2: #Tratamiento cuando la imagen solo tiene el canal de transparencia: los píxeles a 0 pasan a blanco transparente y el resto a negro con alfa 255 - valor
+        vacio = photo == 0
+        rgba = np.zeros((32,32,4), dtype = np.uint8)
+        rgba[vacio, :3] = 255
+        rgba[:,:,3] = np.where(vacio, 0, 255 - photo)
+        photo = rgba
+    if photo.shape[2] == 2: #Tratamiento de la escala de grises con transparencia (LA): el gris se copia a los tres canales de color y se conserva el alfa
+        photo = np.dstack((photo[:,:,0], photo[:,:,0], photo[:,:,0], photo[:,:,1]))
+    if photo.shape[2] == 3: #Tratamiento para añadir el canal alpha si la foto original no tenía transparencias
+        photo = np.dstack((photo, np.full((32,32), 255, dtype = np.uint8)))
+
+    return photo
+
+def decodificarIcono(contenido):
+    """
+    Decodifica en memoria los bytes del icono y lo normaliza. Es independiente de la red y del estado del módulo para poder ejecutarse en un pool de procesos.
+
+    Entrada: contenido: Bytes de la imagen descargada.
+
+    Salida: photo: Array numpy uint8 de forma (32,32,4) o None si se ha producido un error.
+            error: Si se ha producido un error, se devuelve el mensaje para poder incluirlo en el tratamiento de errores de la página.
+    """
+    from skimage import io
+    try:
+        return normalizarIcono(io.imread(BytesIO(contenido))), ''
+    except Exception as e:
+        return None, str(e)
+
+def procesarIconosLote(contenidos, procesos = PROCESOS_ICONOS):
+    """
+    Etapa por lotes de iconos: decodifica y redimensiona en un pool de procesos los iconos ya descargados, separada de la descarga del html.
+
+    Entrada: contenidos: Lista de bytes de imágenes descargadas.
+             procesos: Número de procesos del pool.
+
+    Salida: Lista de tuplas (photo, error) en el mismo orden que contenidos.
+    """
+    if procesos <= 1:
+        return [decodificarIcono(contenido) for contenido in contenidos]
+    with ProcessPoolExecutor(max_workers = procesos) as pool:
+        return list(pool.map(decodificarIcono, contenidos, chunksize = max(1, len(contenidos) // (4 * procesos))))
+
+def obtenerIconoArray(ruta, sesion = None):
+    """
+    Descarga y normaliza el icono de la aplicación a un array RGBA de 32x32 píxeles. Es la base de obtenerIcono, sin convertir el resultado a listas.
+
+    Entrada: ruta: El atributo src obtenido en el rastreo de la página para poder conformar la URL desde la que rescatar la imagen desde el servidor.
+             sesion: Sesión HTTP compartida con la descarga de páginas. Los bytes del icono se descargan con ella y se decodifican en memoria.
+
+    Salida: photo: Array numpy uint8 de forma (32,32,4) con los componentes RGBA, o None si se ha producido un error.
+            error: Si se ha producido un error, se devuelve el mensaje para poder incluirlo en el tratamiento de errores de la página.
+    """
+    contenido, error = descargarIcono(ruta, sesion)
+    if contenido == None:
+        return None, error
+
+    return decodificarIcono(contenido)
+
+def obtenerIcono(ruta, sesion = None):
     """
     Created on Fri Nov 01 14:11:00 2020
     Devuelve la imagen procesada del icono de la aplicación obtenido desde el servidor a través de la ruta que se obtiene del rastreo de la página donde está contenida la imagen.
@@ -80,6 +814,7 @@ def obtenerIcono(ruta):
     @author: luimoco
     
     Entrada: ruta: El atributo src obtenido en el rastreo de la página para poder conformar la URL desde la que rescatar la imagen desde el servidor.
+             sesion: Sesión HTTP compartida con la descarga de páginas. Los bytes del icono se descargan con ella y se decodifican en memoria.
     
     Salida: icono: La imagen procesada en un formato que se pueda tratar por un dataset.
                    Se devuelve una lista de 32*32 elementos, donde cada elemento es un pixel representado por otra lista de 4
@@ -88,39 +823,13 @@ def obtenerIcono(ruta):
                    dibujarla con plt.imshow > plt.imshow(np.array(icon).reshape(32,32,4))
             error: Si se ha producido un error, se devuelve el mensaje para poder incluirlo en el tratamiento de errores de la página.
     """
-    
-    URL_BASE = 'https://reports.exodus-privacy.eu.org/es'
-    ruta = URL_BASE + ruta + '/'
-    try:
-        photo = (transform.resize(io.imread(ruta), (32, 32), mode='edge') * 255).astype(np.uint8)
-        if len(photo.shape) == 2: #Tratamiento cuando la imagen solo tiene el canal de transparencia
-            rgba = np.full((32,32,4), 0).astype(np.uint8)
-            for i in range (0,32):
-                for j in range (0,32):
-                    if photo[i][j] == 0:
-                        rgba[i][j][0] = 255
-                        rgba[i][j][1] = 255
-                        rgba[i][j][2] = 255
-                        rgba[i][j][3] = 0
-                    else:
-                        rgba[i][j][3] = 255 - photo[i][j]
-            photo = rgba
-        if photo.shape[2] == 3: #Tratamiento para añadir el canal alpha si la foto original no tenía transparencias
-            rgba = np.full((32,32,4), 255)
-            rgba[:,:,0] = photo[:,:,0]
-            rgba[:,:,1] = photo[:,:,1]
-            rgba[:,:,2] = photo[:,:,2]
-            photo = rgba
-        
-        icono = photo.reshape(-1,4).tolist()
-        error = ''
-    except Exception as e:
-        icono = []
-        error = str(e)
-    
-    return icono, error
+    photo, error = obtenerIconoArray(ruta, sesion)
+    if photo is None:
+        return [], error
 
-def rastrearHtml(html, iconoAFichero):
+    return photo.reshape(-1,4).tolist(), error
+
+def rastrearHtml(html, iconoAFichero, sesion = None, almacenIconos = None, archivo = None, idElem = None):
     """
     Created on Fri Oct 30 22:30:00 2020
     Módulo principal para el proceso de extracción de los atributos del dataset a partir de la página web solicitada al servidor.
@@ -130,6 +839,10 @@ def rastrearHtml(html, iconoAFichero):
 
     Entrada: html: Contenido de la request de la página del elemento a rastrear.
              iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             sesion: Sesión HTTP con la que descargar el icono.
+             almacenIconos: Destino del icono según el modo: EscritorIconos si iconoAFichero == True o AlmacenIconos si iconoAFichero == ICONO_BINARIO.
+             archivo: ArchivoRespuestas donde guardar el html y los bytes del icono, o None.
+             idElem: Id del informe con el que se archivan el html y el icono.
   
     Salida: atributos: Se trata de un diccionario clave/valor con los atributos que se quieren recuperar y su valor. Su estructura esté preparda para poder almacenar de una manera
                        directa la información en un formato Json.
@@ -147,14 +860,42 @@ def rastrearHtml(html, iconoAFichero):
                           'Country' : 'país'
                           'Developer' : 'desarrollador'
                           'Icon' : [[RGBA]] << En el caso de iconoAFichero == False
+                          'Icon' : {'Fichero': 'almacén', 'Posicion': posición} << En el caso de iconoAFichero == ICONO_BINARIO
                         }
 
             error: Información del atributo cuya recuperación ha provocado el error y su fallo para poder investigarlo posteriormente. En el caso que un atributo falle, se incorporará
                    un valor desconocido 'na'
     """
+    if archivo != None:
+        archivo.guardar(idElem, 'html', html)
+    with metricas.medir('parseo'):
+        atributos, error, ruta = extraerAtributos(html)
+    contenido, fallo = descargarIcono(ruta, sesion)
+    icono = None
+    if contenido != None:
+        if archivo != None:
+            archivo.guardar(idElem, 'icono', contenido)
+        with metricas.medir('icono_redimension'):
+            icono, fallo = decodificarIcono(contenido)
+    incorporarIcono(atributos, error, icono, fallo, iconoAFichero, almacenIconos)
+
+    return atributos, error
+
+def extraerAtributosBs4(html):
+    """
+    Extracción de los atributos de la página del informe salvo el icono, del que solo se obtiene su ruta para tratarlo aparte.
+    Es el analizador original con BeautifulSoup y sirve de referencia a extraerAtributosLxml.
+
+    Entrada: html: Contenido de la request de la página del elemento a rastrear.
+
+    Salida: atributos: Diccionario de atributos descrito en rastrearHtml, sin el icono.
+            error: Diccionario de errores por atributo descrito en rastrearHtml.
+            ruta: Atributo src de la imagen del icono.
+    """
     atributos = {}
     error = {}
 
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, features='lxml')
   
     #Id de la aplicación
@@ -312,141 +1053,1230 @@ def rastrearHtml(html, iconoAFichero):
 
     #Icono
     ruta = soup.find('img',{'class':'rounded'})['src']
-    icono, fallo = obtenerIcono(ruta)
-    
-    if fallo == '':
-        if iconoAFichero == True: #Si preferimos un dataset con ficheros de imágen se guardan en la misma ruta.
-            plt.axis('off')
-            plt.imshow(np.array(icono).reshape(32,32,4))
-            plt.savefig((appId + '.png'))
-            plt.clf()
-        else: #Si preferimos un dataet con la imagen RGBA integrada, se incluye en el atributo.
-            atributos['icon'] = icono
-    else:
-        error['Icon'] = fallo
-        if iconoAFichero == False:
-            atributos['Icon'] = 'na'
 
-    return atributos, error
+    return atributos, error, ruta
 
-def rastreo(inicio, limite, iconoAFichero):
-    #Inicializar cabecera del user-agent
-    HEADER = {
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "Accept-Encoding": "gzip, deflate, sdch, br",
-        "Accept-Language": "en-US,en;q=0.8",
-        "Cache-Control": "no-cache",
-        "dnt": "1",
-        "Pragma": "no-cache",
-        "Upgrade-Insecure-Requests": "1",
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/56.0.2924.87 Safari/537.36"
-    }
-    MAX_REINTENTOS = 10 #Veces que se intenta procesar la misma web
-    MAX_REINTENTOS_404 = 3 #Sucesión de webs con más de 10 errores 404 que permitimos. Sirve para parar el rastreador cuando se ha llegado al final de los informes existentes y evitar trampa de araña
-    TOLERANCIA_ERRORES = 3 #Marca el número máximo de atributos con valor 'na' que podrá contener cada elemento. Si se supera, no se incorpora al dataset.
-    URL_BASE = 'https://reports.exodus-privacy.eu.org/es/reports/'
-    FICHERO_ICONO_INTEGRADO = 'exodus.json'
-    FICHERO_ICONO_A_FICHERO = 'exodusNoIcon.json'
-    
-    #Inicializar el fichero exodus a utilizar.
-    if iconoAFichero == False:
-        fichero = FICHERO_ICONO_INTEGRADO
-    else:
-        fichero = FICHERO_ICONO_A_FICHERO
+def hijosBs4(el):
+    """
+    Devuelve los nodos hijos de un elemento de lxml con el mismo modelo que Tag.contents de BeautifulSoup: textos y elementos intercalados.
+    Los comentarios no se contemplan y provocan que la página se analice con BeautifulSoup.
 
-    #Inicializar lista de los elementos ya tratados a partir del json del dataset.
-    tratados_dict, tratados_list = cargarElementosTratados(fichero)
-    #Inicializar intentos
-    intento = 1
-    #Inicializar intentos 404
-    intento404 = 1
-    #Inicializar repetición
-    repeticion = True
-    #Inicializar índice de elementos
-    elem = 0
-    #Inicializar incidencias
-    incidencias = {}
-    
-    #Crear lista de elementos a tratar(Serie_elementos_tratados, inicio, limite)
-    lista = crearListaElementosATratar(tratados_list, inicio, limite)
-    #Crear el diccionario donde se recogeran los elementos procesados de la sesión.
-    scrap_json = {}
-    
-    while elem < len(lista) and intento <= MAX_REINTENTOS and repeticion == True: #Mientras existan elementos en la lista, durante un número marcado de reintentos y si no se para la extracción
-        web = None
-        url = URL_BASE + str(lista[elem]) + '/'
-    
-        try: #Manejo de posibles excepciones causadas por la petición de la página gestionando tiempos, repeticiones o paradas
-            web = requests.get(url, headers = HEADER)
-        except requests.exceptions.ConnectionError as e:
-            gestionarTiempos('ESPERA_ERROR_CONEXION', intento)
-            print('Error de conexión procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.\n\t' + str(e))
-            repeticion = True
-        except requests.exceptions.ConnectTimeout as e:
-            gestionarTiempos('ESPERA_TIMEOUT', intento)
-            repeticion = True
-            print('Error de conexión procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.\n\t' + str(e))
-        except requests.exceptions.ProxyError as e:
-            repeticion = False
-            print('Error fatal de proxy procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.\n\t' + str(e))
-        except requests.exceptions.SSLError as e:
-            repeticion = False
-            print('Error fatal de SSL procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.\n\t' + str(e))
-        except Exception as e:
-            repeticion = False
-            print('Error fatal no controlado procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.\n\t' + str(e))
-    
-        if web != None: #Si se ha recuperado información del servidor, comprobamos su status.
-            if (web.status_code >= 500) and (web.status_code < 600): #Errores en el servidor
-                print('Error ' + str(web.status_code) + ' de servidor producido en la request procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
-                gestionarTiempos('ESPERA_ERROR_SERVIDOR', intento)
-                repeticion = True
-                if intento < MAX_REINTENTOS:
-                    intento += 1
-                else:
-                    intento = 1
-                    elem += 1
-            if (web.status_code >= 400) and (web.status_code < 500): #Errores en el cliente > Avisar y volvemos a intentarlo tras un tiempo hasta agotar intentos y pasar al siguiente
-                print('Error ' + str(web.status_code) + ' de cliente producido en la request procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
-                gestionarTiempos('ESPERA_ERROR_CLIENTE', intento)
-                repeticion = True
-                if intento < MAX_REINTENTOS:
-                    intento += 1
-                else:
-                    if intento404 < MAX_REINTENTOS_404:
-                        intento = 1
-                        intento404 += 1
-                        elem += 1
-                    else:
-                        break
-            if (web.status_code >= 300) and (web.status_code < 400): #Errores de redirección > Paramos el rastreo de esta url y seguimos.
-                print('Error ' + str(web.status_code) + ' de redirección en la request procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.')
-                repeticion = False
-                intento = 1
-                elem += 1
-            if (web.status_code > 200) and (web.status_code < 300): #Petición correcta con incidencias > Avisar y volvemos a intentarlo tras un tiempo hasta agotar intentos y pasar al siguiente.
-                print('Incidencia ' + str(web.status_code) + ' tras petición correcta procesando  ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
-                gestionarTiempos('ESPERA_CORRECTA_INCIDENCIAS', intento)
-                repeticion = True
-                if intento < MAX_REINTENTOS:
-                    intento += 1
-                else:
+    Entrada: el: Elemento de lxml.
+
+    Salida: Lista de nodos (str o elemento de lxml).
+    """
+    nodos = []
+    if el.text:
+        nodos.append(el.text)
+    for hijo in el:
+        if not isinstance(hijo.tag, str):
+            raise ValueError('Comentario o instrucción no contemplada')
+        nodos.append(hijo)
+        if hijo.tail:
+            nodos.append(hijo.tail)
+    return nodos
+
+def hermanosBs4(el, numero = 2):
+    """
+    Devuelve los primeros nodos hermanos siguientes de un elemento de lxml con el mismo modelo que next_sibling de BeautifulSoup.
+
+    Entrada: el: Elemento de lxml.
+             numero: Número de hermanos a devolver como máximo.
+
+    Salida: Lista de nodos (str o elemento de lxml).
+    """
+    nodos = []
+    if el.tail:
+        nodos.append(el.tail)
+    for hermano in el.itersiblings():
+        if len(nodos) >= numero:
+            break
+        if not isinstance(hermano.tag, str):
+            raise ValueError('Comentario o instrucción no contemplada')
+        nodos.append(hermano)
+        if hermano.tail:
+            nodos.append(hermano.tail)
+    return nodos[:numero]
+
+def cadenaBs4(nodo):
+    """
+    Equivalente de la propiedad .string de BeautifulSoup para nodos de lxml: el texto si el nodo tiene un único hijo de texto, directo o anidado, o None.
+
+    Entrada: nodo: str o elemento de lxml.
+
+    Salida: str o None.
+    """
+    if isinstance(nodo, str):
+        return nodo
+    contenido = hijosBs4(nodo)
+    if len(contenido) != 1:
+        return None
+    return cadenaBs4(contenido[0])
+
+def textoBs4(el):
+    """
+    Equivalente de la propiedad .text de BeautifulSoup para elementos de lxml. BeautifulSoup no incluye el texto de script, style, template, rt y rp,
+    por lo que solo en ese caso se recorre el árbol en python; en el resto se usa text_content de lxml.
+
+    Entrada: el: Elemento de lxml.
+
+    Salida: str con el texto del elemento.
+    """
+    if next(el.iterdescendants('script', 'style', 'template', 'rt', 'rp'), None) == None:
+        return str(el.text_content())
+    partes = []
+    def recorrer(nodo):
+        if nodo.text:
+            partes.append(nodo.text)
+        for hijo in nodo:
+            if isinstance(hijo.tag, str) and hijo.tag not in ('script', 'style', 'template', 'rt', 'rp'):
+                recorrer(hijo)
+            if hijo.tail:
+                partes.append(hijo.tail)
+    recorrer(el)
+    return ''.join(partes)
+
+def extraerAtributosLxml(html):
+    """
+    Analizador rápido de la página del informe con lxml. Localiza en un único recorrido del árbol todas las etiquetas de las que se extraen atributos
+    y calcula una sola vez el texto de cada bloque <div class = "col-md-8 col-12">, en lugar de las búsquedas repetidas de extraerAtributosBs4.
+    Reproduce exactamente los atributos y errores de extraerAtributosBs4. Si la página se sale de la estructura esperada y el error
+    dependería de los detalles de BeautifulSoup, lanza una excepción para que extraerAtributos la analice con extraerAtributosBs4.
+
+    Entrada: html: Contenido de la request de la página del elemento a rastrear.
+
+    Salida: atributos, error, ruta: Como en extraerAtributosBs4.
+    """
+    atributos = {}
+    error = {}
+
+    import lxml.html
+    texto = html.decode('utf-8') if isinstance(html, bytes) else html
+    doc = lxml.html.document_fromstring(texto)
+
+    #Único recorrido del árbol localizando las etiquetas de interés
+    entrada = titulo = enlaceRastreadores = enlacePermisos = imagen = None
+    bloques = []
+    negritas = []
+    for el in doc.iter():
+        nombre = el.tag
+        if nombre == 'div':
+            if ' '.join(el.get('class', '').split()) == 'col-md-8 col-12':
+                bloques.append(el)
+        elif nombre == 'b':
+            negritas.append(el)
+        elif nombre == 'a':
+            if enlaceRastreadores == None and el.get('href') == '#trackers':
+                enlaceRastreadores = el
+            elif enlacePermisos == None and el.get('href') == '#permissions':
+                enlacePermisos = el
+        elif nombre == 'input':
+            if entrada == None and el.get('name') == 'next':
+                entrada = el
+        elif nombre == 'h1':
+            if titulo == None:
+                titulo = el
+        elif nombre == 'img':
+            if imagen == None and 'rounded' in el.get('class', '').split():
+                imagen = el
+    textos = [textoBs4(bloque) for bloque in bloques]
+
+    #Id de la aplicación
+    atributos['Id'] = int(entrada.get('value').split('/')[2])
+
+    #Nombre
+    atributos['Name'] = str.strip(cadenaBs4(titulo))
+
+    #Número de rastreadores y de permisos
+    for clave, enlace in (('Tracker_count', enlaceRastreadores), ('Permissions_count', enlacePermisos)):
+        for tag in hijosBs4(enlace):
+            if not isinstance(tag, str) and tag.tag == 'span':
+                atributos[clave] = int(cadenaBs4(tag))
+
+    #Versión, descargas y fecha de análisis
+    descr = next(t for t in textos if 'Versión' in t)
+    try:
+        meses = {'Enero':'01','Febrero':'02','Marzo':'03','Abril':'04','Mayo':'05','Junio':'06','Julio':'07','Agosto':'08','Septiembre':'09','Octubre':'10','Noviembre':'11','Diciembre':'12'}
+        if 'Versión' in descr:
+            atributos['Version'] = re.search(r'([0-9]*\.)+[0-9]*', descr).group()
+        else:
+            atributos['Version'] = 'na'
+        if 'Descargas' in descr:
+            atributos['Downloads'] = re.search(r'Descargas: ([0-9]*(,[0-9]+)*(\+)*)', descr).group(1) or ''
+        else:
+            atributos['Downloads'] = 'na'
+    except Exception as e:
+        error['VersionDownloads'] = str(e)
+        atributos['Version'] = 'na'
+        atributos['Downloads'] = 'na'
+    try:
+        fecha = re.search(r'creado el ([0-9]{1,2}) de (.*?) de ([0-9]{4})', descr)
+        atributos['Analysis_date'] = fecha.group(1) + '-' + meses[fecha.group(2)] + '-' + fecha.group(3)
+    except Exception as e:
+        error['Analysis_date'] = str(e)
+        atributos['Analysis_date'] = 'na'
+
+    #Trackers: como en extraerAtributosBs4, si ningún bloque los menciona se usa el último
+    rastreadores = bloques[next((i for i, t in enumerate(textos) if 'rastreadores en la aplicación' in t), len(bloques) - 1)]
+    trackers = []
+    for tag in hijosBs4(rastreadores):
+        if not isinstance(tag, str) and tag.tag == 'p' and len(tag.attrib) > 0:
+            nombre = cadenaBs4(hijosBs4(tag)[0])
+            hermanos = hermanosBs4(tag)
+            info_propositos = hermanos[0]
+            if isinstance(info_propositos, str) or info_propositos.tag != 'span':
+                info_propositos = hermanos[1]
+            if isinstance(info_propositos, str):
+                raise ValueError('Propósitos no contemplados')
+            propositos = []
+            if cadenaBs4(info_propositos) != '':
+                for proposito in info_propositos.iterdescendants('span'):
+                    propositos.append(cadenaBs4(proposito))
+            trackers.append({nombre:propositos})
+    atributos['Trackers'] = trackers
+
+    #Permisos y permisos peligrosos
+    bloquePermisos = bloques[next((i for i, t in enumerate(textos) if 'permisos en la aplicación' in t), len(bloques) - 1)]
+    permisos = []
+    for permiso in bloquePermisos.iterdescendants('span'):
+        if permiso.get('data-placement') == 'top':
+            textoPermiso = textoBs4(permiso)
+            if textoPermiso not in permisos:
+                permisos.append(textoPermiso)
+    atributos['Permissions'] = permisos
+    atributos['Permissions_warning_count'] = sum(1 for img in bloquePermisos.iterdescendants('img') if img.get('title') == 'Protection level: dangerous')
+
+    #País, desarrollador
+    tag = next(b for b in negritas if 'Emisor:' in textoBs4(b))
+    nodo = hermanosBs4(tag)[1]
+    emisor = nodo if isinstance(nodo, str) else textoBs4(nodo)
+    if '=' in emisor: #Hay información de emisores que se codifica con clave = valor
+        if 'organizationName=' in emisor:
+            valor = emisor[emisor.find('organizationName=')+17:]
+            atributos['Developer'] = valor[:valor.find(',')] if ',' in valor else valor
+        else:
+            atributos['Developer'] = 'na'
+        if 'countryName=' in emisor:
+            valor = emisor[emisor.find('countryName=')+12:]
+            atributos['Country'] = valor[:valor.find(',')] if ',' in valor else valor
+        else:
+            atributos['Country'] = 'na'
+    if ':' in emisor: #Hay información de emisores que se codifica con clave : valor
+        if 'Organization:' in emisor:
+            valor = emisor[emisor.find('Organization:')+14:]
+            atributos['Developer'] = valor[:valor.find(',')] if ',' in valor else valor
+        else:
+            atributos['Developer'] = 'na'
+        if 'Country:' in emisor:
+            valor = emisor[emisor.find('Country:')+9:]
+            atributos['Country'] = valor[:valor.find(',')] if ',' in valor else valor
+        else:
+            atributos['Country'] = 'na'
+
+    #Icono
+    ruta = imagen.get('src')
+    if ruta == None:
+        raise KeyError('src')
+
+    return atributos, error, ruta
+
+def extraerAtributos(html):
+    """
+    Extracción de los atributos de la página del informe salvo el icono, del que solo se obtiene su ruta para tratarlo aparte.
+    Usa el analizador indicado en MOTOR_PARSEO. Con 'lxml', las páginas que el analizador rápido no contempla se analizan con BeautifulSoup,
+    de modo que el resultado es siempre el de extraerAtributosBs4.
+
+    Entrada: html: Contenido de la request de la página del elemento a rastrear.
+
+    Salida: atributos: Diccionario de atributos descrito en rastrearHtml, sin el icono.
+            error: Diccionario de errores por atributo descrito en rastrearHtml.
+            ruta: Atributo src de la imagen del icono.
+    """
+    if MOTOR_PARSEO == 'lxml':
+        try:
+            return extraerAtributosLxml(html)
+        except Exception:
+            pass
+    return extraerAtributosBs4(html)
+
+def incorporarIcono(atributos, error, icono, fallo, iconoAFichero, almacenIconos = None):
+    """
+    Incorpora al elemento el icono ya procesado según el modo elegido: integrado en el atributo, a fichero PNG o al almacén binario.
+
+    Entrada: atributos: Diccionario de atributos del elemento, que se completa con el icono.
+             error: Diccionario de errores del elemento, que se completa con el fallo del icono si lo hay.
+             icono: Array uint8 (32,32,4) del icono o None.
+             fallo: Mensaje de error del tratamiento del icono o ''.
+             iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             almacenIconos: Destino del icono según el modo: EscritorIconos si iconoAFichero == True o AlmacenIconos si iconoAFichero == ICONO_BINARIO.
+                            Si no se indica en el modo True, el PNG se escribe en el momento en el directorio actual.
+    """
+    if fallo == '':
+        try:
+            if iconoAFichero == True: #Si preferimos un dataset con ficheros de imágen se guardan en la misma ruta o en el zip de iconos.
+                if almacenIconos != None:
+                    almacenIconos.guardar(atributos['Id'], icono)
+                else:
+                    with metricas.medir('icono_escritura'):
+                        datos = codificarPng(icono) #Se codifica antes de abrir el fichero para no dejar un PNG vacío si el icono no es válido
+                        with open(str(atributos['Id']) + '.png', 'wb') as fichero:
+                            fichero.write(datos)
+            elif iconoAFichero == ICONO_BINARIO: #Si preferimos los iconos en un almacén binario, el atributo solo guarda su referencia.
+                atributos['Icon'] = {'Fichero': os.path.basename(almacenIconos.ruta), 'Posicion': almacenIconos.guardar(atributos['Id'] if atributos['Id'] != 'na' else -1, icono)}
+            else: #Si preferimos un dataet con la imagen RGBA integrada, se incluye en el atributo.
+                atributos['icon'] = validarIcono(icono).reshape(-1,4).tolist()
+        except ValueError as e: #Un icono con forma o tipo no admitidos queda como fallo del icono en lugar de corromper el almacén
+            fallo = str(e)
+    if fallo != '':
+        error['Icon'] = fallo
+        if iconoAFichero != True:
+            atributos['Icon'] = 'na'
+    metricas.contarErrores(error) #Con el fallo del icono, el diccionario de errores del elemento ya está completo
+
+def leerModoIcono(texto):
+    """
+    Interpreta el parámetro IN_iconoAFichero de la línea de comandos.
+
+    Entrada: texto: 'true', 'false' o 'binario' (sin distinguir mayúsculas).
+
+    Salida: True, False o ICONO_BINARIO.
+    """
+    if texto.lower() == ICONO_BINARIO:
+        return ICONO_BINARIO
+    return texto.lower() == 'true'
+
+def ficheroDataSet(iconoAFichero):
+    """
+    Devuelve el fichero json del dataset que corresponde al modo de tratamiento de los iconos.
+
+    Entrada: iconoAFichero: False (icono integrado en el json), True (iconos en ficheros PNG) o ICONO_BINARIO (iconos en un almacén binario).
+
+    Salida: Ruta del json del dataset.
+    """
+    if iconoAFichero == ICONO_BINARIO:
+        return FICHERO_ICONO_BINARIO
+    if iconoAFichero == False:
+        return FICHERO_ICONO_INTEGRADO
+    return FICHERO_ICONO_A_FICHERO
+
+def rutaAlmacenIconos(rutaDataSet):
+    """
+    Devuelve la ruta del almacén binario de iconos asociado al json del dataset. Ej. exodusIconBin.json > exodusIconBin.iconos
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+
+    Salida: Ruta del fichero binario de iconos. Su índice de ids está en la misma ruta con extensión .iconos.ids
+    """
+    return os.path.splitext(rutaDataSet)[0] + '.iconos'
+
+def validarIcono(icono):
+    """
+    Comprueba que el icono tiene la forma y el tipo de los iconos normalizados, (32,32,4) uint8, antes de guardarlo. Un icono con otra forma
+    desalinearía las posiciones de tamaño fijo del almacén binario o no se podría codificar como PNG RGBA.
+
+    Entrada: icono: Array numpy del icono.
+
+    Salida: icono: El mismo icono como array numpy. Lanza ValueError si su forma o su tipo no son los esperados.
+    """
+    icono = np.asarray(icono)
+    if icono.shape != (32, 32, 4) or icono.dtype != np.uint8:
+        raise ValueError('Icono no admitido: forma ' + str(icono.shape) + ' y tipo ' + str(icono.dtype) + ' en lugar de (32, 32, 4) uint8')
+    return icono
+
+class AlmacenIconos:
+    """
+    Almacén binario de iconos: cada icono ocupa una posición de tamaño fijo 32x32x4 bytes (uint8 RGBA) en un fichero de solo añadido,
+    y un segundo fichero guarda el id de la aplicación de cada posición como int64. Así los iconos pesan 4 KB por aplicación en lugar de
+    15~20 KB de texto en el json, y se pueden cargar con cargarIconos como un np.memmap de forma (N,32,32,4) sin copiarlos a memoria.
+    Si una caída deja los dos ficheros desalineados, al abrir el almacén se recortan a las posiciones completas en ambos.
+    Los iconos se fuerzan a disco en cada punto de control del registro incremental, antes que las anotaciones que los referencian (ver depurarRegistro).
+    Con reutilizar, el icono de un id que ya tiene posición en el almacén sustituye en su sitio al anterior en lugar de añadirse,
+    para que volver a analizar los mismos ids (reparse) no haga crecer el almacén.
+    Es seguro entre hilos.
+
+    Entrada: ruta: Ruta del fichero binario de iconos.
+             reutilizar: Indicador para reescribir la posición existente de cada id en lugar de añadir otra.
+    """
+    TAMANO_ICONO = 32 * 32 * 4
+
+    def __init__(self, ruta, reutilizar = False):
+        self.ruta = ruta
+        self.rutaIds = ruta + '.ids'
+        self.cerrojo = threading.Lock()
+        self.ficheroIconos = open(self.ruta, 'ab')
+        self.ficheroIds = open(self.rutaIds, 'ab')
+        self.posiciones = min(os.path.getsize(self.ruta) // self.TAMANO_ICONO, os.path.getsize(self.rutaIds) // 8)
+        self.ficheroIconos.truncate(self.posiciones * self.TAMANO_ICONO)
+        self.ficheroIds.truncate(self.posiciones * 8)
+        self.existentes = {}
+        self.ficheroSustituciones = None
+        if reutilizar: #Última posición de cada id; los ids 'na' (-1) nunca se reutilizan
+            ids = np.fromfile(self.rutaIds, dtype = np.int64)[:self.posiciones]
+            self.existentes = {int(idElem): posicion for posicion, idElem in enumerate(ids.tolist()) if idElem >= 0}
+
+    def guardar(self, idElem, icono):
+        """
+        Añade el icono (array uint8 de forma (32,32,4)) y devuelve la posición que ocupa en el almacén. Cualquier otro icono se rechaza con ValueError.
+        """
+        datos = np.ascontiguousarray(validarIcono(icono)).tobytes()
+        with metricas.medir('icono_escritura'), self.cerrojo:
+            if int(idElem) in self.existentes: #Se sustituye en su sitio; un fichero en modo 'ab' solo escribe al final, así que se usa otro descriptor
+                if self.ficheroSustituciones == None:
+                    self.ficheroSustituciones = open(self.ruta, 'r+b')
+                self.ficheroSustituciones.seek(self.existentes[int(idElem)] * self.TAMANO_ICONO)
+                self.ficheroSustituciones.write(datos)
+                self.ficheroSustituciones.flush()
+                return self.existentes[int(idElem)]
+            self.ficheroIconos.write(datos)
+            self.ficheroIds.write(np.array([idElem], dtype = np.int64).tobytes())
+            for fichero in (self.ficheroIconos, self.ficheroIds): #El icono llega al sistema operativo antes de que el registro anote su posición
+                fichero.flush()
+            posicion = self.posiciones
+            self.posiciones += 1
+        return posicion
+
+    def volcar(self):
+        #Fuerza a disco los iconos guardados; el registro incremental lo invoca en cada punto de control antes de volcarse él
+        with self.cerrojo:
+            for fichero in (self.ficheroIconos, self.ficheroIds, self.ficheroSustituciones):
+                if fichero != None:
+                    fichero.flush()
+                    os.fsync(fichero.fileno())
+
+    def cerrar(self):
+        self.volcar()
+        with self.cerrojo:
+            for fichero in (self.ficheroIconos, self.ficheroIds, self.ficheroSustituciones):
+                if fichero != None:
+                    fichero.close()
+
+def cargarIconos(ruta):
+    """
+    Abre el almacén binario de iconos para su análisis sin copiarlo a memoria.
+
+    Entrada: ruta: Ruta del fichero binario de iconos.
+
+    Salida: iconos: np.memmap de solo lectura de forma (N,32,32,4) y tipo uint8. iconos[posicion] es el icono referenciado por el atributo Icon.
+            ids: Array int64 con el id de la aplicación de cada posición.
+    """
+    ids = np.fromfile(ruta + '.ids', dtype = np.int64)
+    posiciones = min(len(ids), os.path.getsize(ruta) // AlmacenIconos.TAMANO_ICONO)
+    if posiciones == 0:
+        return np.zeros((0, 32, 32, 4), dtype = np.uint8), ids[:0]
+    iconos = np.memmap(ruta, dtype = np.uint8, mode = 'r', shape = (posiciones, 32, 32, 4))
+    return iconos, ids[:posiciones]
+
+def codificarPng(icono):
+    """
+    Codifica directamente un icono RGBA uint8 como PNG del mismo tamaño (32x32), sin pasar por una figura de matplotlib.
+
+    Entrada: icono: Array numpy uint8 de forma (alto, ancho, 4).
+
+    Salida: Bytes del fichero PNG. Lanza ValueError si el icono no tiene cuatro canales.
+    """
+    if np.ndim(icono) != 3 or np.shape(icono)[2] != 4:
+        raise ValueError('El PNG se codifica como RGBA y el icono tiene forma ' + str(np.shape(icono)))
+    alto, ancho = icono.shape[0], icono.shape[1]
+    filas = np.zeros((alto, 1 + ancho * 4), dtype = np.uint8) #Cada fila empieza con el byte de filtro 0 (sin filtro)
+    filas[:, 1:] = np.ascontiguousarray(icono, dtype = np.uint8).reshape(alto, ancho * 4)
+
+    def bloque(tipo, datos):
+        return struct.pack('>I', len(datos)) + tipo + datos + struct.pack('>I', zlib.crc32(tipo + datos) & 0xffffffff)
+
+    cabecera = struct.pack('>IIBBBBB', ancho, alto, 8, 6, 0, 0, 0) #8 bits por canal, tipo de color 6 (RGBA)
+    return b'\x89PNG\r\n\x1a\n' + bloque(b'IHDR', cabecera) + bloque(b'IDAT', zlib.compress(filas.tobytes(), 6)) + bloque(b'IEND', b'')
+
+class ZipIconos:
+    """
+    Zip de iconos PNG sin entradas repetidas. Los iconos de aplicaciones que aún no están en el zip se añaden al final directamente;
+    los que sustituyen a uno existente (p. ej. al volver a rastrear, refrescar o fusionar un id ya guardado) se dejan en un directorio
+    auxiliar y, al cerrar, el zip se reescribe una sola vez con la última versión de cada icono. Si una caída deja el directorio auxiliar,
+    sus iconos se incorporan al cerrar el zip en la siguiente ejecución. No es seguro entre hilos: quien lo comparta debe serializar las escrituras.
+
+    Entrada: ruta: Ruta del zip de iconos.
+    """
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.rutaSustitutos = ruta + '.sustitutos'
+        self.archivo = zipfile.ZipFile(ruta, 'a', zipfile.ZIP_STORED) #Los PNG ya van comprimidos
+        self.nombres = set(self.archivo.namelist())
+
+    def writestr(self, nombre, datos):
+        if nombre not in self.nombres:
+            self.archivo.writestr(nombre, datos)
+            self.nombres.add(nombre)
+        else: #Añadirlo de nuevo dejaría dos entradas con el mismo nombre
+            os.makedirs(self.rutaSustitutos, exist_ok = True)
+            with open(os.path.join(self.rutaSustitutos, nombre), 'wb') as fichero:
+                fichero.write(datos)
+
+    def close(self):
+        self.archivo.close()
+        if not os.path.isdir(self.rutaSustitutos):
+            return
+        sustitutos = set(os.listdir(self.rutaSustitutos))
+        temporal = self.ruta + '.tmp'
+        with zipfile.ZipFile(self.ruta) as anterior, zipfile.ZipFile(temporal, 'w', zipfile.ZIP_STORED) as nuevo:
+            ultimas = {info.filename: info for info in anterior.infolist()} #Si el zip ya tenía entradas repetidas, se conserva la última
+            for nombre, info in ultimas.items():
+                if nombre not in sustitutos:
+                    nuevo.writestr(info, anterior.read(info))
+            for nombre in sorted(sustitutos):
+                nuevo.write(os.path.join(self.rutaSustitutos, nombre), nombre)
+        os.replace(temporal, self.ruta)
+        for nombre in sustitutos:
+            os.remove(os.path.join(self.rutaSustitutos, nombre))
+        os.rmdir(self.rutaSustitutos)
+
+class EscritorIconos:
+    """
+    Escritor de iconos PNG en segundo plano para el modo iconoAFichero == True. Cada icono se codifica con codificarPng en un pool de hilos,
+    sin bloquear la descarga ni el análisis de páginas. Los iconos se escriben como <Id>.png en el directorio indicado o, si se
+    indica un archivo, se agrupan dentro de un único fichero zip (ver ZipIconos) en lugar de crear un fichero pequeño por aplicación.
+    Es seguro entre hilos.
+
+    Entrada: directorio: Directorio donde escribir los PNG cuando no se usa archivo.
+             rutaArchivo: Ruta del zip donde agrupar los iconos o None.
+             hilos: Hilos del pool de escritura.
+    """
+    def __init__(self, directorio = '.', rutaArchivo = None, hilos = HILOS_ICONOS):
+        self.directorio = directorio
+        self.ruta = rutaArchivo if rutaArchivo != None else directorio
+        self.archivo = ZipIconos(rutaArchivo) if rutaArchivo != None else None
+        self.cerrojo = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers = hilos)
+
+    def guardar(self, idElem, icono):
+        """
+        Encarga la escritura del icono (array uint8 de forma (32,32,4)) y devuelve el nombre del PNG. El icono se comprueba antes de encargarla,
+        para que un icono no admitido se rechace con ValueError y quede en los errores del elemento en lugar de perderse en el pool.
+        """
+        nombre = str(idElem) + '.png'
+        self.pool.submit(self.escribir, nombre, validarIcono(icono))
+        return nombre
+
+    def escribir(self, nombre, icono):
+        try:
+            with metricas.medir('icono_escritura'):
+                datos = codificarPng(icono)
+                if self.archivo != None:
+                    with self.cerrojo:
+                        self.archivo.writestr(nombre, datos)
+                else:
+                    with open(os.path.join(self.directorio, nombre), 'wb') as fichero:
+                        fichero.write(datos)
+        except Exception as e:
+            print('Error escribiendo el icono ' + nombre + '\n\t' + str(e))
+
+    def cerrar(self):
+        self.pool.shutdown(wait = True)
+        if self.archivo != None:
+            self.archivo.close()
+
+def abrirAlmacenIconos(iconoAFichero, rutaDataSet, reutilizar = False):
+    """
+    Abre el destino de los iconos que corresponde al modo elegido.
+
+    Entrada: iconoAFichero: False (icono integrado en el json), True (iconos en ficheros PNG) o ICONO_BINARIO (iconos en un almacén binario).
+             rutaDataSet: Ruta del json del dataset.
+             reutilizar: En el almacén binario, reescribir la posición que ya tenga cada id en lugar de añadir otra (ver AlmacenIconos).
+
+    Salida: AlmacenIconos, EscritorIconos o None si el icono va integrado en el json.
+    """
+    if iconoAFichero == ICONO_BINARIO:
+        return AlmacenIconos(rutaAlmacenIconos(rutaDataSet), reutilizar)
+    if iconoAFichero == True:
+        return EscritorIconos(rutaArchivo = os.path.splitext(rutaDataSet)[0] + '.png.zip' if ICONOS_EN_ARCHIVO == True else None)
+    return None
+
+class ArchivoRespuestas:
+    """
+    Archivo de respuestas en bruto: guarda el html de las páginas de informe y los bytes de los iconos tal y como los sirve el servidor,
+    para poder volver a analizarlos con reanalizarArchivo sin repetir el rastreo. Cada contenido se comprime con zlib y se añade a un fichero
+    de solo añadido direccionado por su hash sha256, de modo que un contenido repetido (p. ej. el mismo icono) solo se guarda una vez.
+    Un índice JSON Lines (<ruta>.jsonl) anota por cada id y tipo ('html' o 'icono') el hash, la posición y la longitud del contenido comprimido.
+    La línea del índice se escribe después del contenido, así que una caída nunca deja el índice apuntando a datos inexistentes.
+    Es seguro entre hilos.
+
+    Entrada: ruta: Ruta del fichero de contenidos del archivo.
+    """
+    def __init__(self, ruta = FICHERO_ARCHIVO):
+        self.ruta = ruta
+        self.rutaIndice = ruta + '.jsonl'
+        self.cerrojo = threading.Lock()
+        self.objetos = {} #hash > (posición, longitud)
+        self.elementos = {} #id > {'html': (posición, longitud), 'icono': (posición, longitud)} con la última versión archivada
+        for entrada in leerRegistro(self.rutaIndice):
+            self.objetos[entrada['hash']] = (entrada['posicion'], entrada['longitud'])
+            self.elementos.setdefault(entrada['id'], {})[entrada['tipo']] = (entrada['posicion'], entrada['longitud'])
+        self.ficheroDatos = open(self.ruta, 'ab')
+        self.ficheroIndice = open(self.rutaIndice, 'a', encoding = 'utf-8')
+
+    def guardar(self, idElem, tipo, contenido):
+        """
+        Archiva el contenido ('html' o 'icono') del elemento si no estaba ya archivado y anota su referencia en el índice.
+        """
+        resumen = hashlib.sha256(contenido).hexdigest()
+        comprimido = None if resumen in self.objetos else zlib.compress(contenido, 6)
+        with self.cerrojo:
+            if resumen not in self.objetos:
+                self.ficheroDatos.seek(0, os.SEEK_END)
+                self.objetos[resumen] = (self.ficheroDatos.tell(), len(comprimido))
+                self.ficheroDatos.write(comprimido)
+                self.ficheroDatos.flush()
+            posicion, longitud = self.objetos[resumen]
+            self.elementos.setdefault(str(idElem), {})[tipo] = (posicion, longitud)
+            self.ficheroIndice.write(json.dumps({'id': str(idElem), 'tipo': tipo, 'hash': resumen, 'posicion': posicion, 'longitud': longitud}) + '\n')
+            self.ficheroIndice.flush()
+
+    def cerrar(self):
+        with self.cerrojo:
+            for fichero in (self.ficheroDatos, self.ficheroIndice):
+                fichero.flush()
+                os.fsync(fichero.fileno())
+                fichero.close()
+
+def leerObjetoArchivado(ruta, referencia):
+    """
+    Lee y descomprime un contenido del archivo de respuestas.
+
+    Entrada: ruta: Ruta del fichero de contenidos del archivo.
+             referencia: Tupla (posición, longitud) anotada en el índice.
+
+    Salida: Bytes originales del contenido.
+    """
+    posicion, longitud = referencia
+    with open(ruta, 'rb') as fichero:
+        fichero.seek(posicion)
+        return zlib.decompress(fichero.read(longitud))
+
+def abrirArchivoRespuestas():
+    """
+    Abre el archivo de respuestas si está activado ARCHIVAR_RESPUESTAS.
+
+    Salida: ArchivoRespuestas o None.
+    """
+    return ArchivoRespuestas(FICHERO_ARCHIVO) if ARCHIVAR_RESPUESTAS == True else None
+
+def rutaValidadores(rutaDataSet):
+    """
+    Devuelve la ruta de los validadores de las páginas del dataset. Ej. exodus.json > exodus.validadores.jsonl
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+
+    Salida: Ruta del fichero JSON Lines de validadores.
+    """
+    return os.path.splitext(rutaDataSet)[0] + '.validadores.jsonl'
+
+class ValidadoresPaginas:
+    """
+    Validadores de las páginas de informe ya rastreadas: ETag, Last-Modified y hash sha256 del html de la última respuesta completa.
+    Permiten revisitar un informe con una petición condicional (If-None-Match / If-Modified-Since) y, si el servidor no la admite,
+    reconocer por el hash que el html no ha cambiado para no volver a analizarlo. Se guardan en un fichero JSON Lines de solo añadido
+    donde la última línea de cada id es la vigente; al cerrar se reescribe si acumula demasiadas líneas obsoletas.
+    Es seguro entre hilos.
+
+    Entrada: ruta: Ruta del fichero JSON Lines de validadores.
+    """
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.cerrojo = threading.Lock()
+        self.entradas = {}
+        self.lineas = 0
+        for entrada in leerRegistro(self.ruta):
+            self.entradas[entrada.pop('id')] = entrada
+            self.lineas += 1
+        self.fichero = open(self.ruta, 'a', encoding = 'utf-8')
+        self.resumen = {'No_modificado': 0, 'Mismo_hash': 0, 'Modificado': 0, 'Retirado': 0}
+
+    def cabeceras(self, idElem):
+        """
+        Devuelve las cabeceras de la petición condicional del elemento, vacías si no hay validadores.
+        """
+        entrada = self.entradas.get(str(idElem), {})
+        cabeceras = {}
+        if 'ETag' in entrada:
+            cabeceras['If-None-Match'] = entrada['ETag']
+        if 'Last-Modified' in entrada:
+            cabeceras['If-Modified-Since'] = entrada['Last-Modified']
+        return cabeceras
+
+    def sinCambios(self, idElem, web):
+        """
+        Indica si la respuesta corresponde al mismo html ya analizado: 304 a la petición condicional o mismo hash del contenido. Lleva la cuenta en resumen.
+        """
+        if web.status_code == 304:
+            motivo = 'No_modificado'
+        elif self.entradas.get(str(idElem), {}).get('Hash') == hashlib.sha256(web.content).hexdigest():
+            motivo = 'Mismo_hash'
+        else:
+            motivo = 'Modificado'
+        with self.cerrojo:
+            self.resumen[motivo] += 1
+        return motivo != 'Modificado'
+
+    def retirado(self, idElem):
+        """
+        Lleva la cuenta en resumen de los elementos del dataset que el servidor responde como inexistentes al revalidarlos.
+        """
+        with self.cerrojo:
+            self.resumen['Retirado'] += 1
+
+    def anotar(self, idElem, web):
+        """
+        Actualiza los validadores del elemento con la respuesta. Una respuesta 304 conserva el hash del html anterior.
+        """
+        with self.cerrojo:
+            entrada = dict(self.entradas.get(str(idElem), {}))
+            if web.status_code == 200:
+                entrada['Hash'] = hashlib.sha256(web.content).hexdigest()
+            for cabecera in ('ETag', 'Last-Modified'):
+                if cabecera in web.headers:
+                    entrada[cabecera] = web.headers[cabecera]
+            self.entradas[str(idElem)] = entrada
+            self.fichero.write(json.dumps(dict({'id': str(idElem)}, **entrada)) + '\n')
+            self.fichero.flush()
+            self.lineas += 1
+
+    def incorporar(self, idElem, entrada):
+        """
+        Sustituye los validadores del elemento por los indicados, p. ej. los de un tramo al fusionarlo.
+        """
+        with self.cerrojo:
+            self.entradas[str(idElem)] = dict(entrada)
+            self.fichero.write(json.dumps(dict({'id': str(idElem)}, **entrada)) + '\n')
+            self.lineas += 1
+
+    def cerrar(self):
+        with self.cerrojo:
+            self.fichero.close()
+            if self.lineas > 2 * len(self.entradas): #Reescritura con solo la línea vigente de cada id
+                temporal = self.ruta + '.tmp'
+                with open(temporal, 'w', encoding = 'utf-8') as fichero:
+                    for idElem in self.entradas:
+                        fichero.write(json.dumps(dict({'id': idElem}, **self.entradas[idElem])) + '\n')
+                    fichero.flush()
+                    os.fsync(fichero.fileno())
+                os.replace(temporal, self.ruta)
+
+def rutaRegistro(rutaDataSet):
+    """
+    Devuelve la ruta del registro incremental asociado al json del dataset. Ej. exodus.json > exodus.registro.jsonl
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+
+    Salida: Ruta del fichero JSON Lines del registro.
+    """
+    return os.path.splitext(rutaDataSet)[0] + '.registro.jsonl'
+
+def leerRegistro(ruta):
+    """
+    Recorre las anotaciones del registro incremental en el orden en que se escribieron.
+    Una última línea incompleta por una caída a mitad de escritura se descarta.
+
+    Entrada: ruta: Ruta del fichero JSON Lines del registro.
+
+    Salida: Generador de anotaciones {'tipo': 'elemento' | 'incidencia' | 'ausente' | 'fin', 'id': 'id', 'datos': {...}, 'rango': 'inicio_fin'}
+    """
+    if not os.path.exists(ruta):
+        return
+    with open(ruta, encoding = 'utf-8') as fichero:
+        for linea in fichero:
+            try:
+                yield json.loads(linea)
+            except ValueError:
+                continue
+
+class RegistroIncremental:
+    """
+    Registro de solo añadido (JSON Lines) donde se anotan los elementos rastreados y sus incidencias a medida que se producen,
+    en lugar de mantenerlos en memoria hasta el final del rastreo. Cada anotación se entrega al sistema operativo al escribirse
+    y periódicamente se fuerza a disco con fsync, de modo que una caída o parada solo pierde lo posterior al último punto de control.
+    Es seguro entre hilos.
+
+    Entrada: rutaDataSet: Ruta del json del dataset al que pertenece el registro.
+             inicio: Id inicial del rango rastreado, para nombrar el fichero de incidencias en la compactación.
+             limite: Número de elementos del rango rastreado.
+             almacenIconos: Destino de los iconos de la sesión. Si es un AlmacenIconos, se fuerza a disco en cada punto de control antes que el registro.
+    """
+    def __init__(self, rutaDataSet, inicio, limite, almacenIconos = None):
+        self.ruta = rutaRegistro(rutaDataSet)
+        self.almacenIconos = almacenIconos
+        self.rango = str(inicio) + '_' + str(inicio + limite - 1)
+        self.fichero = open(self.ruta, 'a', encoding = 'utf-8')
+        self.cerrojo = threading.Lock()
+        self.sinVolcar = 0
+        self.ultimoVolcado = time.monotonic()
+
+    def anotar(self, tipo, idElem, datos):
+        linea = json.dumps({'tipo': tipo, 'id': str(idElem), 'datos': datos, 'rango': self.rango}) + '\n'
+        metricas.contar('anotaciones', tipo)
+        with metricas.medir('persistencia'), self.cerrojo:
+            self.fichero.write(linea)
+            self.fichero.flush()
+            self.sinVolcar += 1
+            if self.sinVolcar >= PUNTO_CONTROL_REGISTROS or time.monotonic() - self.ultimoVolcado >= PUNTO_CONTROL_SEGUNDOS:
+                self.puntoControl()
+
+    def anotarElemento(self, idElem, app):
+        self.anotar('elemento', idElem, app)
+
+    def anotarIncidencia(self, idElem, error):
+        self.anotar('incidencia', idElem, error)
+
+    def anotarAusente(self, idElem):
+        self.anotar('ausente', idElem, {})
+
+    def anotarFin(self):
+        #Rango terminado: aunque su registro quede pendiente de compactar, no hay que reanudarlo
+        self.anotar('fin', '', {})
+
+    def puntoControl(self):
+        if isinstance(self.almacenIconos, AlmacenIconos): #Las posiciones anotadas deben existir en disco antes que las anotaciones
+            self.almacenIconos.volcar()
+        os.fsync(self.fichero.fileno())
+        self.sinVolcar = 0
+        self.ultimoVolcado = time.monotonic()
+
+    def cerrar(self):
+        with self.cerrojo:
+            self.puntoControl()
+            self.fichero.close()
+
+def depurarRegistro(rutaDataSet):
+    """
+    Descarta del registro incremental los elementos cuyo icono apunta a una posición que no existe en el almacén binario de iconos,
+    lo que ocurre si una caída impide que el icono llegue a disco antes que su anotación. Esos elementos dejan de considerarse
+    tratados y se vuelven a rastrear. El registro solo se reescribe si hay alguno, y no debe estar abierto para anotar.
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+
+    Salida: Número de elementos descartados.
+    """
+    ruta = rutaRegistro(rutaDataSet)
+    if not os.path.exists(ruta):
+        return 0
+    rutaIconos = rutaAlmacenIconos(rutaDataSet)
+    posiciones = 0
+    if os.path.exists(rutaIconos) and os.path.exists(rutaIconos + '.ids'):
+        posiciones = min(os.path.getsize(rutaIconos) // AlmacenIconos.TAMANO_ICONO, os.path.getsize(rutaIconos + '.ids') // 8)
+    descartadas = set()
+    for numero, anotacion in enumerate(leerRegistro(ruta)):
+        icono = anotacion['datos'].get('Icon') if anotacion['tipo'] == 'elemento' else None
+        if isinstance(icono, dict) and not (isinstance(icono.get('Posicion'), int) and 0 <= icono['Posicion'] < posiciones):
+            descartadas.add(numero)
+    if len(descartadas) == 0:
+        return 0
+
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding = 'utf-8') as salida:
+        for numero, anotacion in enumerate(leerRegistro(ruta)):
+            if numero not in descartadas:
+                salida.write(json.dumps(anotacion) + '\n')
+        salida.flush()
+        os.fsync(salida.fileno())
+    os.replace(temporal, ruta)
+    print('Registro ' + ruta + ': ' + str(len(descartadas)) + ' elementos con el icono fuera del almacén se descartan para volver a rastrearlos')
+    return len(descartadas)
+
+def volcarJsonAtomico(ruta, datos):
+    """
+    Escribe un json en un fichero temporal, lo fuerza a disco y lo renombra sobre el definitivo, para que nunca quede un fichero a medias.
+
+    Entrada: ruta: Ruta del fichero json de destino.
+             datos: Diccionario a volcar.
+    """
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w') as outfile:
+        json.dump(datos, outfile)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temporal, ruta)
+
+def anadirElementosDataSet(rutaDataSet, elementos, sustituir):
+    """
+    Incorpora elementos al json del dataset sin cargarlo entero, escribiendo un fichero temporal que se fuerza a disco y se renombra sobre el definitivo.
+    Si ninguno está ya en el dataset, el json actual se copia tal cual y los elementos se añaden al final; si alguno lo sustituye,
+    el json se recorre en streaming y cada elemento se escribe con su versión nueva cuando la hay. El formato es el de json.dump.
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+             elementos: Diccionario id > atributos con los elementos a incorporar, en el orden en que se añaden.
+             sustituir: Indicador de que alguno de los elementos ya está en el dataset.
+    """
+    pendientes = dict(elementos)
+    separador = b'{'
+    temporal = rutaDataSet + '.tmp'
+    with open(temporal, 'wb') as salida:
+        if os.path.exists(rutaDataSet) and os.path.getsize(rutaDataSet) > 0:
+            if sustituir:
+                for idElem, valor in recorrerDataSet(rutaDataSet):
+                    salida.write(separador + json.dumps(str(idElem)).encode() + b': ' + json.dumps(pendientes.pop(str(idElem), valor)).encode())
+                    separador = b', '
+            else:
+                tamano = os.path.getsize(rutaDataSet)
+                with open(rutaDataSet, 'rb') as entrada:
+                    entrada.seek(tamano - min(tamano, 4096))
+                    cola = entrada.read().rstrip()
+                    if not cola.endswith(b'}'):
+                        raise ValueError('El dataset ' + rutaDataSet + ' no termina en }')
+                    if not cola[:-1].rstrip().endswith(b'{'): #Dataset con elementos: se copia todo salvo la llave de cierre, por bloques
+                        restante = tamano - min(tamano, 4096) + len(cola) - 1
+                        entrada.seek(0)
+                        while restante > 0:
+                            bloque = entrada.read(min(restante, 1 << 20))
+                            salida.write(bloque)
+                            restante -= len(bloque)
+                        separador = b', '
+        for idElem, valor in pendientes.items():
+            salida.write(separador + json.dumps(idElem).encode() + b': ' + json.dumps(valor).encode())
+            separador = b', '
+        salida.write(b'{}' if separador == b'{' else b'}')
+        salida.flush()
+        os.fsync(salida.fileno())
+    os.replace(temporal, rutaDataSet)
+
+def compactarRegistro(rutaDataSet, umbral = 0):
+    """
+    Compacta el registro incremental sobre el dataset: incorpora sus elementos a exodus.json / exodusNoIcon.json sin cargar el json entero
+    (ver anadirElementosDataSet), genera los ficheros incidencias_inicio_fin.json con la misma estructura de siempre y añade los ids ausentes
+    anteriores al último informe del dataset a exodus.ausentes / exodusNoIcon.ausentes (ver recortarAusentes).
+    Si el dataset tiene índice invertido, se indexan en él los elementos del registro. Al terminar se elimina el registro.
+    Con un umbral, el registro más pequeño se deja pendiente: los rastreos, la reanudación y las estadísticas lo reproducen sin compactar.
+    Se puede invocar en cualquier momento, también tras una caída, y repetirla no altera el resultado.
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+             umbral: Bytes del registro por debajo de los cuales no se compacta. Por defecto se compacta siempre.
+    """
+    ruta = rutaRegistro(rutaDataSet)
+    if not os.path.exists(ruta):
+        return
+    if os.path.getsize(ruta) < umbral:
+        print('Registro ' + ruta + ' pendiente de compactar (' + str(os.path.getsize(ruta)) + ' bytes); se compacta con: python exodusWS.py compactar')
+        return
+    depurarRegistro(rutaDataSet)
+    incidencias = {}
+    elementos = {}
+    hayAusentes = False
+    for anotacion in leerRegistro(ruta):
+        if anotacion['tipo'] == 'elemento':
+            elementos[anotacion['id']] = anotacion['datos']
+        elif anotacion['tipo'] == 'incidencia':
+            incidencias.setdefault(anotacion['rango'], {}).setdefault(anotacion['id'], {}).update(anotacion['datos'])
+        elif anotacion['tipo'] == 'ausente':
+            hayAusentes = True
+
+    try:
+        tratados = cargarIdsTratados(rutaDataSet, conRegistro = False)
+        if len(elementos) > 0 or not os.path.exists(rutaDataSet): #Volcar el nuevo fichero con el dataset.
+            anadirElementosDataSet(rutaDataSet, elementos, any(int(idElem) in tratados for idElem in elementos))
+        for idElem in elementos:
+            tratados.add(int(idElem))
+        tratados.guardar(rutaIndiceIds(rutaDataSet)) #Y su índice de ids, posterior al dataset para que se considere al día
+        if hayAusentes: #Los ids ausentes del registro se suman a los de rastreos anteriores, salvo los posteriores al último informe del dataset
+            recortarAusentes(cargarIdsAusentes(rutaDataSet), tratados).guardar(rutaAusentes(rutaDataSet))
+        if len(elementos) > 0 and os.path.exists(rutaIndiceInvertido(rutaDataSet) + '.json'): #Mantener al día el índice invertido si se ha creado
+            actualizarIndice(rutaDataSet, ((int(idElem), elementos[idElem]) for idElem in sorted(elementos, key = int)))
+        for rango in incidencias: #Volcar los ficheros de incidencias, conservando las de sesiones previas del mismo rango
+            rutaIncidencias = 'incidencias_' + rango + '.json'
+            try:
+                with open(rutaIncidencias) as json_file:
+                    previas = json.load(json_file)
+            except Exception:
+                previas = {}
+            previas.update(incidencias[rango])
+            volcarJsonAtomico(rutaIncidencias, previas)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    except Exception as e:
+        print('Error escribiendo dataset')
+        print(e)
+
+def reanalizarElemento(tarea):
+    """
+    Vuelve a analizar un elemento a partir de su html y su icono archivados, sin acceso a la red. Se ejecuta en el pool de procesos de reanalizarArchivo.
+
+    Entrada: tarea: Tupla (ruta del archivo, referencia del html, referencia del icono o None).
+
+    Salida: atributos, error: Descritos en rastrearHtml, sin el icono incorporado.
+            icono: Array uint8 (32,32,4) del icono o None.
+            fallo: Mensaje de error del tratamiento del icono o ''.
+    """
+    ruta, referenciaHtml, referenciaIcono = tarea
+    try:
+        atributos, error, rutaIcono = extraerAtributos(leerObjetoArchivado(ruta, referenciaHtml))
+    except Exception as e: #Un html archivado que no se puede analizar queda como incidencia sin detener el reanálisis
+        return None, {'Html': str(e)}, None, ''
+    if referenciaIcono == None:
+        return atributos, error, None, 'Icono no archivado'
+    try:
+        icono, fallo = decodificarIcono(leerObjetoArchivado(ruta, referenciaIcono))
+    except Exception as e:
+        icono, fallo = None, str(e)
+    return atributos, error, icono, fallo
+
+def reanalizarArchivo(iconoAFichero, rutaArchivo = FICHERO_ARCHIVO, procesos = PROCESOS_PARSEO):
+    """
+    Reconstruye el dataset a partir del archivo de respuestas, sin acceso a la red, repartiendo el análisis entre un pool de procesos.
+    Cada elemento archivado se analiza con la versión actual de extraerAtributos y sustituye a su versión anterior en el dataset;
+    los elementos del dataset que no están en el archivo se conservan. Las incidencias se anotan en el registro incremental
+    y se compactan como en el rastreo, en incidencias_inicio_fin.json con el rango de ids del archivo.
+
+    Entrada: iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             rutaArchivo: Ruta del fichero de contenidos del archivo de respuestas.
+             procesos: Procesos del pool de análisis.
+    """
+    if not os.path.exists(rutaArchivo + '.jsonl'):
+        print('No existe el archivo de respuestas ' + rutaArchivo)
+        return
+    archivo = ArchivoRespuestas(rutaArchivo)
+    archivo.cerrar() #Solo se necesita su índice
+    ids = sorted([idElem for idElem in archivo.elementos if 'html' in archivo.elementos[idElem]], key = int)
+    if len(ids) == 0:
+        print('El archivo de respuestas no contiene páginas')
+        return
+
+    fichero = ficheroDataSet(iconoAFichero)
+    almacenIconos = abrirAlmacenIconos(iconoAFichero, fichero, reutilizar = True) #Los ids ya analizados conservan su posición en el almacén
+    registro = RegistroIncremental(fichero, int(ids[0]), int(ids[-1]) - int(ids[0]) + 1, almacenIconos)
+    tareas = [(rutaArchivo, archivo.elementos[idElem]['html'], archivo.elementos[idElem].get('icono')) for idElem in ids]
+
+    try:
+        with ProcessPoolExecutor(max_workers = procesos) as pool:
+            for idElem, (app, error, icono, fallo) in zip(ids, pool.map(reanalizarElemento, tareas, chunksize = max(1, len(tareas) // (4 * procesos)))):
+                if app != None:
+                    incorporarIcono(app, error, icono, fallo, iconoAFichero, almacenIconos)
+                    if len(error) <= TOLERANCIA_ERRORES:
+                        registro.anotarElemento(idElem, app)
+                registro.anotarIncidencia(idElem, error)
+        registro.anotarFin()
+    finally:
+        registro.cerrar()
+        if almacenIconos != None:
+            almacenIconos.cerrar()
+
+    print('Reanálisis finalizado: ' + str(len(ids)) + ' elementos')
+    compactarRegistro(fichero, UMBRAL_COMPACTACION)
+
+class CuboTokens:
+    """
+    Limitador global de peticiones por segundo mediante un cubo de tokens. La cortesía con el servidor se fija por tasa y no por esperas fijas entre peticiones.
+    Cada petición reserva un token; si el cubo está vacío, la reserva devuelve el tiempo a esperar hasta que le corresponda su turno.
+    La tasa es adaptativa (AIMD): se reduce multiplicativamente ante errores o latencias altas y se recupera de forma aditiva con respuestas sanas,
+    sin superar nunca la tasa configurada. Una cabecera Retry-After pausa todas las peticiones hasta el instante indicado por el servidor.
+    Es seguro entre hilos para poder compartirse entre el bucle asíncrono y los hilos de trabajo.
+
+    Entrada: tasa: Tokens que se reponen por segundo (peticiones por segundo permitidas). Es también el techo de la tasa adaptativa.
+             capacidad: Número máximo de tokens acumulables, es decir, ráfaga permitida tras un periodo sin peticiones.
+    """
+    def __init__(self, tasa = TASA_PETICIONES, capacidad = 1):
+        self.tasaMaxima = float(tasa)
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad)
+        self.tokens = self.capacidad
+        self.ultimo = time.monotonic()
+        self.ultimaReduccion = 0.0
+        self.ultimoAumento = self.ultimo
+        self.pausaHasta = 0.0
+        self.cerrojo = threading.Lock()
+
+    def reponer(self):
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+        self.ultimo = ahora
+
+    def reservar(self):
+        with self.cerrojo:
+            self.reponer()
+            self.tokens -= 1
+            pausa = max(0.0, self.pausaHasta - self.ultimo)
+            if self.tokens >= 0:
+                return pausa
+            return pausa + -self.tokens / self.tasa #Tokens en deuda hasta que llegue el turno de esta petición
+
+    def adquirir(self):
+        espera = self.reservar()
+        metricas.contar('espera_segundos', 'CUBO_TOKENS', espera)
+        time.sleep(espera)
+
+    async def adquirirAsincrono(self):
+        espera = self.reservar()
+        metricas.contar('espera_segundos', 'CUBO_TOKENS', espera)
+        await asyncio.sleep(espera)
+
+    def reducir(self):
+        with self.cerrojo:
+            ahora = time.monotonic()
+            if ahora - self.ultimaReduccion >= 1 / self.tasa: #Una sola reducción por intervalo entre peticiones, para no encadenar cortes por respuestas de la misma ráfaga
+                self.reponer()
+                self.tasa = max(TASA_MINIMA, self.tasa * FACTOR_REDUCCION_TASA)
+                self.ultimaReduccion = ahora
+
+    def aumentar(self):
+        with self.cerrojo:
+            self.reponer()
+            transcurrido = min(1.0, self.ultimo - self.ultimoAumento) #Paso fijo por segundo de respuestas sanas, sin que una respuesta tras una pausa larga acumule más de un segundo
+            self.ultimoAumento = self.ultimo
+            self.tasa = min(self.tasaMaxima, self.tasa + INCREMENTO_TASA * transcurrido)
+
+    def pausar(self, segundos):
+        with self.cerrojo:
+            self.pausaHasta = max(self.pausaHasta, time.monotonic() + min(segundos, ESPERA_MAXIMA_RETRY_AFTER))
+
+def rastreo(inicio, limite, iconoAFichero, modo = 'secuencial', concurrencia = CONCURRENCIA_POR_HOST, tasa = TASA_PETICIONES, fichero = None, previos = None, sondear = True):
+    """
+    Procedimiento principal de rastreo de los informes de aplicaciones desde el id inicial hasta el límite fijado.
+
+    Entrada: inicio: Id del primer informe a rastrear.
+             limite: Número de informes a rastrear desde el inicio.
+             iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             modo: 'secuencial' para el rastreo original de una petición cada vez, 'asincrono' para el motor concurrente limitado por tasa
+                   o 'tuberia' para el rastreo por etapas con análisis en varios procesos.
+             concurrencia: En modos asíncrono y tubería, peticiones simultáneas permitidas por servidor.
+             tasa: En modos asíncrono y tubería, peticiones por segundo permitidas en total.
+             fichero: Ruta del json del dataset, p. ej. el de un tramo en el rastreo por tramos. Por defecto el que corresponde a iconoAFichero.
+             previos: Tupla (tratados, ausentes) de MapaBits con ids ya resueltos en otros datasets, que tampoco se piden. Por defecto ninguno.
+             sondear: Si es False, el rango no se recorta con acotarRango, p. ej. porque el rastreo por tramos ya lo ha sondeado.
+
+    Salida: limite: Número de informes rastreados desde el inicio, una vez recortado el rango al último existente.
+    """
+    depurarRegistro(fichero if fichero != None else ficheroDataSet(iconoAFichero)) #Al reanudar, los elementos sin su icono en el almacén se vuelven a rastrear
+    if modo == 'asincrono':
+        return rastreoAsincrono(inicio, limite, iconoAFichero, concurrencia, tasa, fichero, previos, sondear)
+    if modo == 'tuberia':
+        return rastreoTuberia(inicio, limite, iconoAFichero, concurrencia, tasa, fichero, previos, sondear)
+    import requests
+
+    #Inicializar el fichero exodus a utilizar.
+    if fichero == None:
+        fichero = ficheroDataSet(iconoAFichero)
+
+    #Inicializar los ids de los elementos ya tratados a partir del índice o del json del dataset, sin cargar los elementos.
+    tratados = cargarIdsTratados(fichero)
+    #Inicializar los ids que el servidor ya respondió como inexistentes, que no se vuelven a pedir
+    ausentes = cargarIdsAusentes(fichero)
+    #Añadir los ids ya resueltos en otros datasets (p. ej. el principal en el rastreo por tramos)
+    if previos != None:
+        tratados.update(previos[0])
+        ausentes.update(previos[1])
+    #Recortar el rango al último informe existente en el sitio, sondeando al ritmo de la espera estándar
+    if sondear == True:
+        limite = acotarRango(inicio, limite, tratados, cuboSondeo('secuencial', tasa))
+    #Inicializar intentos
+    intento = 1
+    #Inicializar intentos 404
+    intento404 = 1
+    #Inicializar repetición
+    repeticion = True
+    #Inicializar índice de elementos
+    elem = 0
+    
+    #Crear lista de elementos a tratar(Serie_elementos_tratados, inicio, limite)
+    lista = crearListaElementosATratar(tratados, inicio, limite, ausentes)
+    #Abrir el escritor de PNG o el almacén binario de iconos según el modo elegido
+    almacenIconos = abrirAlmacenIconos(iconoAFichero, fichero)
+    #Crear el registro incremental donde se anotarán los elementos procesados y las incidencias de la sesión.
+    registro = RegistroIncremental(fichero, inicio, limite, almacenIconos)
+    #Crear la sesión HTTP con conexiones persistentes compartida por páginas e iconos
+    sesion = crearSesion()
+    #Abrir el archivo de respuestas en bruto si está activado
+    archivo = abrirArchivoRespuestas()
+    #Abrir los validadores de las páginas para poder refrescarlas después con peticiones condicionales
+    validadores = ValidadoresPaginas(rutaValidadores(fichero))
+    
+    while elem < len(lista) and intento <= MAX_REINTENTOS and repeticion == True: #Mientras existan elementos en la lista, durante un número marcado de reintentos y si no se para la extracción
+        web = None
+        url = URL_BASE + str(lista[elem]) + '/'
+    
+        try: #Manejo de posibles excepciones causadas por la petición de la página gestionando tiempos, repeticiones o paradas
+            web = pedirPagina(sesion, url)
+        except requests.exceptions.ConnectionError as e:
+            gestionarTiempos('ESPERA_ERROR_CONEXION', intento)
+            print('Error de conexión procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.\n\t' + str(e))
+            repeticion = True
+        except requests.exceptions.ConnectTimeout as e:
+            gestionarTiempos('ESPERA_TIMEOUT', intento)
+            repeticion = True
+            print('Error de conexión procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.\n\t' + str(e))
+        except requests.exceptions.ReadTimeout as e:
+            gestionarTiempos('ESPERA_TIMEOUT', intento)
+            repeticion = True
+            print('Error de timeout procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.\n\t' + str(e))
+        except requests.exceptions.ProxyError as e:
+            repeticion = False
+            print('Error fatal de proxy procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.\n\t' + str(e))
+        except requests.exceptions.SSLError as e:
+            repeticion = False
+            print('Error fatal de SSL procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.\n\t' + str(e))
+        except Exception as e:
+            repeticion = False
+            print('Error fatal no controlado procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.\n\t' + str(e))
+    
+        if web != None: #Si se ha recuperado información del servidor, comprobamos su status.
+            if (web.status_code >= 500) and (web.status_code < 600): #Errores en el servidor
+                print('Error ' + str(web.status_code) + ' de servidor producido en la request procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
+                gestionarTiempos('ESPERA_ERROR_SERVIDOR', intento)
+                repeticion = True
+                if intento < MAX_REINTENTOS:
+                    intento += 1
+                else:
+                    intento = 1
+                    elem += 1
+            if web.status_code in CODIGOS_AUSENTE: #Informe inexistente > Respuesta definitiva: se anota como ausente y se pasa al siguiente sin reintentarlo
+                print('Informe inexistente (' + str(web.status_code) + ') procesando ' + url)
+                registro.anotarAusente(lista[elem])
+                intento = 1
+                elem += 1
+                if SONDEAR_FINAL != True: #Sin sondeo del final, una sucesión de informes inexistentes sirve de criterio de parada
+                    if intento404 < MAX_REINTENTOS_404:
+                        intento404 += 1
+                    else:
+                        break
+                gestionarTiempos('ESPERA_ESTANDAR', intento)
+            elif (web.status_code >= 400) and (web.status_code < 500): #Errores en el cliente > Avisar y volvemos a intentarlo tras un tiempo hasta agotar intentos y pasar al siguiente
+                print('Error ' + str(web.status_code) + ' de cliente producido en la request procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
+                gestionarTiempos('ESPERA_ERROR_CLIENTE', intento)
+                repeticion = True
+                if intento < MAX_REINTENTOS:
+                    intento += 1
+                else:
+                    if intento404 < MAX_REINTENTOS_404:
+                        intento = 1
+                        intento404 += 1
+                        elem += 1
+                    else:
+                        break
+            if (web.status_code >= 300) and (web.status_code < 400): #Errores de redirección > Paramos el rastreo de esta url y seguimos.
+                print('Error ' + str(web.status_code) + ' de redirección en la request procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.')
+                repeticion = False
+                intento = 1
+                elem += 1
+            if (web.status_code > 200) and (web.status_code < 300): #Petición correcta con incidencias > Avisar y volvemos a intentarlo tras un tiempo hasta agotar intentos y pasar al siguiente.
+                print('Incidencia ' + str(web.status_code) + ' tras petición correcta procesando  ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
+                gestionarTiempos('ESPERA_CORRECTA_INCIDENCIAS', intento)
+                repeticion = True
+                if intento < MAX_REINTENTOS:
+                    intento += 1
+                else:
                     intento = 1
                     elem += 1
             if web.status_code == 200: #Petición correcta y html a nuestra disposición
-                app, error = rastrearHtml(web.content, iconoAFichero)
+                try:
+                    app, error = metricas.perfilar(rastrearHtml, web.content, iconoAFichero, sesion, almacenIconos, archivo, lista[elem])
+                except Exception as e: #Una página que no se puede analizar se trata como un fallo del parseador: incidencia y siguiente elemento
+                    app, error = None, {'Parseo': str(e)}
                 if app != None: #Si se ha procesado la web correctamente y extraído la información
                     if len(error) > TOLERANCIA_ERRORES: #Tolerancia a errores, solo se registran como incidencia los elementos que superan la tolerancia. Si no la superan, quedan registrados con sus na donde fallara.
-                        incidencias[str(lista[elem])] = error
+                        registro.anotarIncidencia(lista[elem], error)
                     else:
-                        scrap_json[str(lista[elem])] = app
-                        incidencias[str(lista[elem])] = error
+                        registro.anotarElemento(lista[elem], app)
+                        registro.anotarIncidencia(lista[elem], error)
+                    validadores.anotar(lista[elem], web)
                     elem += 1
                     intento = 1
                     print('Rastreada url ' + url + ' con éxito')
                     gestionarTiempos('ESPERA_ESTANDAR', intento)
                 else: #Si no se ha procesado por un fallo del parseador del html se apunta la incidencia y se procede con el siguiente
-                    incidencias[str(lista[elem])] = error
+                    registro.anotarIncidencia(lista[elem], error)
                     elem += 1
                     intento = 1
         else: #Si no se ha recuperado información del servidor
@@ -457,23 +2287,1708 @@ def rastreo(inicio, limite, iconoAFichero):
                 elem += 1
     
     print('Rastreo finalizado')
-    #Actualizar el diccionario de los elmentos ya tratados con los rastreados en esta sesión y guardar el dataset y las incidencias
-    tratados_dict.update(scrap_json)
-    
+    #Cerrar el registro, los validadores, el almacén de iconos y el archivo de respuestas y compactar el registro sobre el dataset y las incidencias
+    registro.anotarFin()
+    registro.cerrar()
+    validadores.cerrar()
+    if almacenIconos != None:
+        almacenIconos.cerrar()
+    if archivo != None:
+        archivo.cerrar()
+    compactarRegistro(fichero, UMBRAL_COMPACTACION)
+    return limite
+
+def evaluarRespuesta(codigo):
+    """
+    Clasifica el código de estado de la respuesta del servidor según los mismos tramos que trata el rastreo secuencial.
+
+    Entrada: codigo: Código de estado HTTP de la respuesta.
+
+    Salida: Uno de 'ERROR_SERVIDOR', 'ERROR_CLIENTE', 'REDIRECCION', 'CORRECTA_INCIDENCIAS', 'CORRECTA' o None si el código no se contempla.
+    """
+    if (codigo >= 500) and (codigo < 600):
+        return 'ERROR_SERVIDOR'
+    if (codigo >= 400) and (codigo < 500):
+        return 'ERROR_CLIENTE'
+    if (codigo >= 300) and (codigo < 400):
+        return 'REDIRECCION'
+    if (codigo > 200) and (codigo < 300):
+        return 'CORRECTA_INCIDENCIAS'
+    if codigo == 200:
+        return 'CORRECTA'
+    return None
+
+def leerRetryAfter(web):
+    """
+    Interpreta la cabecera Retry-After de la respuesta, que puede venir en segundos o como fecha HTTP.
+
+    Entrada: web: Respuesta de requests.
+
+    Salida: Segundos que el servidor pide esperar o None si no hay cabecera o no es interpretable.
+    """
+    valor = web.headers.get('Retry-After')
+    if valor == None:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(valor) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+def calcularEsperaReintento(motivo, intento, retryAfter = None):
+    """
+    Calcula cuándo reintentar un elemento fallido: retroceso exponencial sobre la espera base del motivo, con techo y variación aleatoria
+    para que los elementos que fallan a la vez no vuelvan a la vez. Si el servidor indica Retry-After, se respeta su valor hasta ESPERA_MAXIMA_RETRY_AFTER.
+
+    Entrada: motivo: Indicador del evento producido en el rastreador (clave de MOTIVOS en gestionarTiempos).
+             intento: Intento que acaba de fallar.
+             retryAfter: Segundos indicados por el servidor en la cabecera Retry-After, si los hay.
+
+    Salida: retraso: Segundos hasta el siguiente intento.
+    """
+    if retryAfter != None:
+        return min(retryAfter, ESPERA_MAXIMA_RETRY_AFTER)
+    retraso = min(ESPERA_MAXIMA_REINTENTO, gestionarTiempos(motivo, 1, esperar = False) * 2 ** (intento - 1))
+    return random.uniform(retraso / 2, retraso)
+
+def pedirPagina(sesion, url, cabeceras = None):
+    """
+    Petición de la página de un informe con la sesión compartida, midiendo su latencia en la etapa 'descarga' y contando el código
+    de estado de la respuesta o el tipo de excepción, que se vuelve a lanzar para que la trate quien llama.
+
+    Entrada: sesion: Sesión HTTP compartida.
+             url: URL de la página del informe.
+             cabeceras: Cabeceras de la petición condicional o None.
+
+    Salida: web: Respuesta de requests.
+    """
+    try:
+        with metricas.medir('descarga'):
+            web = sesion.get(url, headers = cabeceras, timeout = (TIMEOUT_CONEXION, TIMEOUT_LECTURA))
+    except Exception as e:
+        metricas.contar('peticiones', type(e).__name__)
+        raise
+    metricas.contar('peticiones', web.status_code)
+    return web
+
+def solicitarPagina(url, intento, cubo, sesion, cabeceras = None):
+    """
+    Realiza la petición de la página de un informe y clasifica su resultado con el mismo tratamiento de códigos de estado que el rastreo secuencial.
+    No espera tras un fallo: devuelve el motivo para que el planificador aplace el elemento. Informa al cubo de tokens de cada respuesta para adaptar la tasa global.
+    El token de la petición lo debe haber adquirido quien la llama. Es bloqueante y se comparte entre el modo asíncrono y la tubería.
+
+    Entrada: url: URL de la página del informe.
+             intento: Número de intento actual del elemento.
+             cubo: CuboTokens compartido que limita la tasa global de peticiones.
+             sesion: Sesión HTTP compartida.
+             cabeceras: Cabeceras de la petición condicional (ValidadoresPaginas.cabeceras) o None.
+
+    Salida: resultado: 'CORRECTA' si el html está disponible, 'SIN_CAMBIOS' si la petición condicional responde 304 (sin validadores se reintenta), 'AUSENTE' si el informe no existe, 'HECHO' si el elemento queda resuelto sin html, 'REINTENTAR' si debe aplazarse o 'PARADA' si se detiene el rastreo.
+            motivo: Clave de MOTIVOS con la que calcular la espera del reintento.
+            retryAfter: Segundos indicados por el servidor, si los hay.
+            fallo: Descripción del fallo para las incidencias.
+            web: Respuesta de requests o None si no se ha obtenido.
+    """
+    import requests
+    comienzo = time.monotonic()
+    try:
+        web = pedirPagina(sesion, url, cabeceras)
+    except requests.exceptions.ConnectionError as e:
+        cubo.reducir()
+        print('Error de conexión procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.\n\t' + str(e))
+        return 'REINTENTAR', 'ESPERA_ERROR_CONEXION', None, str(e), None
+    except requests.exceptions.ConnectTimeout as e:
+        cubo.reducir()
+        print('Error de conexión procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.\n\t' + str(e))
+        return 'REINTENTAR', 'ESPERA_TIMEOUT', None, str(e), None
+    except requests.exceptions.ReadTimeout as e:
+        cubo.reducir()
+        print('Error de timeout procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.\n\t' + str(e))
+        return 'REINTENTAR', 'ESPERA_TIMEOUT', None, str(e), None
+    except requests.exceptions.ProxyError as e:
+        print('Error fatal de proxy procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.\n\t' + str(e))
+        return 'PARADA', None, None, str(e), None
+    except requests.exceptions.SSLError as e:
+        print('Error fatal de SSL procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.\n\t' + str(e))
+        return 'PARADA', None, None, str(e), None
+    except Exception as e:
+        print('Error fatal no controlado procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.\n\t' + str(e))
+        return 'PARADA', None, None, str(e), None
+    latencia = time.monotonic() - comienzo
+
+    if web.status_code == 304: #Respuesta a una petición condicional: no es una redirección ni detiene el rastreo
+        if cabeceras: #Informe sin cambios desde la última visita
+            cubo.aumentar()
+            return 'SIN_CAMBIOS', None, None, '', web
+        print('Respuesta 304 sin petición condicional procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
+        return 'REINTENTAR', 'ESPERA_CORRECTA_INCIDENCIAS', leerRetryAfter(web), 'HTTP 304 sin validadores', web
+    if web.status_code in CODIGOS_AUSENTE: #Informe inexistente: respuesta definitiva, no se reintenta
+        print('Informe inexistente (' + str(web.status_code) + ') procesando ' + url)
+        return 'AUSENTE', None, None, 'HTTP ' + str(web.status_code), web
+
+    tipo = evaluarRespuesta(web.status_code)
+    retryAfter = leerRetryAfter(web)
+    if retryAfter != None:
+        cubo.pausar(retryAfter)
+    if tipo == 'ERROR_SERVIDOR' or web.status_code == 429 or latencia > LATENCIA_OBJETIVO:
+        cubo.reducir()
+    elif tipo == 'CORRECTA':
+        cubo.aumentar()
+
+    fallo = 'HTTP ' + str(web.status_code)
+    if tipo == 'ERROR_SERVIDOR':
+        print('Error ' + str(web.status_code) + ' de servidor producido en la request procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
+        return 'REINTENTAR', 'ESPERA_ERROR_SERVIDOR', retryAfter, fallo, web
+    if tipo == 'ERROR_CLIENTE':
+        print('Error ' + str(web.status_code) + ' de cliente producido en la request procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
+        return 'REINTENTAR', 'ESPERA_ERROR_CLIENTE', retryAfter, fallo, web
+    if tipo == 'REDIRECCION':
+        print('Error ' + str(web.status_code) + ' de redirección en la request procesando ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '. Rastreo parado.')
+        return 'PARADA', None, None, fallo, web
+    if tipo == 'CORRECTA_INCIDENCIAS':
+        print('Incidencia ' + str(web.status_code) + ' tras petición correcta procesando  ' + url + '\n\tIntento ' + str(intento) + ' de ' + str(MAX_REINTENTOS) + '.')
+        return 'REINTENTAR', 'ESPERA_CORRECTA_INCIDENCIAS', retryAfter, fallo, web
+    if tipo == 'CORRECTA':
+        return 'CORRECTA', None, None, '', web
+    return 'HECHO', None, None, fallo, web
+
+class PlanificadorElementos:
+    """
+    Reparto de los elementos a rastrear en los modos concurrentes. Los elementos fallidos no bloquean a quien los trataba:
+    pasan a una cola diferida ordenada por el instante de su siguiente intento y mientras tanto se siguen entregando los elementos sanos.
+    Lleva también la cuenta de elementos agotados con errores de cliente para el criterio de parada por final de informes.
+    Es seguro entre hilos.
+
+    Entrada: lista: Ids de los informes a rastrear.
+    """
+    def __init__(self, lista):
+        self.pendientes = list(reversed(lista)) #Elementos aún no intentados, se extraen por el final
+        self.diferidos = [] #Montículo de (instante del reintento, id, intento, último fallo)
+        self.enVuelo = 0
+        self.contador404 = 0
+        self.cerrojo = threading.Lock()
+
+    def siguiente(self):
+        #Devuelve (id, intento) del siguiente elemento a intentar, o None si ahora no hay ninguno disponible
+        with self.cerrojo:
+            if len(self.diferidos) > 0 and self.diferidos[0][0] <= time.monotonic():
+                vence, idElem, intento, fallo = heapq.heappop(self.diferidos)
+            elif len(self.pendientes) > 0:
+                idElem, intento = self.pendientes.pop(), 1
+            else:
+                return None
+            self.enVuelo += 1
+            return idElem, intento
+
+    def terminar(self):
+        with self.cerrojo:
+            self.enVuelo -= 1
+
+    def aplazar(self, idElem, intento, motivo, retryAfter, fallo):
+        vence = time.monotonic() + calcularEsperaReintento(motivo, intento, retryAfter)
+        with self.cerrojo:
+            heapq.heappush(self.diferidos, (vence, idElem, intento + 1, fallo))
+
+    def espera(self):
+        #Segundos hasta que venza el siguiente reintento, o None si no queda nada por intentar ni en vuelo
+        with self.cerrojo:
+            if len(self.diferidos) > 0:
+                return min(max(self.diferidos[0][0] - time.monotonic(), 0.01), 1.0)
+            if self.enVuelo > 0 or len(self.pendientes) > 0:
+                return 0.1
+            return None
+
+    def anotar404(self):
+        #Cuenta un elemento inexistente o agotado con errores de cliente y devuelve True si se alcanza el criterio de parada
+        with self.cerrojo:
+            self.contador404 += 1
+            return self.contador404 >= MAX_REINTENTOS_404
+
+async def rastrearElementoAsincrono(idElem, intento, iconoAFichero, cubo, semaforos, estado, ejecutor):
+    """
+    Realiza un intento de rastreo de un único informe en el modo asíncrono, con el mismo tratamiento de códigos de estado que el rastreo secuencial.
+    No espera tras un fallo: devuelve el motivo para que el planificador aplace el elemento y el resto siga fluyendo.
+    Informa al cubo de tokens de cada respuesta para adaptar la tasa global.
+
+    Entrada: idElem: Id del informe a rastrear.
+             intento: Número de intento actual del elemento.
+             iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             cubo: CuboTokens compartido que limita la tasa global de peticiones.
+             semaforos: Diccionario servidor > asyncio.Semaphore que limita las peticiones simultáneas por servidor.
+             estado: Diccionario compartido de la sesión con registro, planificador, parada, la sesión HTTP, el destino de los iconos, el archivo de respuestas, los validadores y el pool de procesos de iconos.
+             ejecutor: ThreadPoolExecutor donde se ejecutan las llamadas bloqueantes de requests y el parseo.
+
+    Salida: resultado: 'HECHO' si el elemento queda resuelto, 'AUSENTE' si no existe, 'REINTENTAR' si debe aplazarse o 'PARADA' si se detiene el rastreo.
+            motivo: Clave de MOTIVOS con la que calcular la espera del reintento.
+            retryAfter: Segundos indicados por el servidor, si los hay.
+            fallo: Descripción del fallo para las incidencias.
+    """
+    loop = asyncio.get_running_loop()
+    url = URL_BASE + str(idElem) + '/'
+    semaforo = semaforos.setdefault(urlsplit(url).netloc, asyncio.Semaphore(estado['concurrencia']))
+
+    async with semaforo:
+        await cubo.adquirirAsincrono()
+        resultado, motivo, retryAfter, fallo, web = await loop.run_in_executor(ejecutor, solicitarPagina, url, intento, cubo, estado['sesion'])
+
+    if resultado == 'AUSENTE':
+        estado['registro'].anotarAusente(idElem)
+        if SONDEAR_FINAL != True and estado['planificador'].anotar404(): #Sin sondeo del final, una sucesión de informes inexistentes sirve de criterio de parada
+            return 'PARADA', None, None, fallo
+        return 'AUSENTE', None, None, fallo
+    if motivo == 'ESPERA_ERROR_CLIENTE' and intento == MAX_REINTENTOS: #Elemento agotado con errores de cliente: cuenta para el criterio de parada por final de informes
+        if estado['planificador'].anotar404():
+            return 'PARADA', None, None, fallo
+    if resultado == 'CORRECTA': #Petición correcta y html a nuestra disposición
+        #El html se analiza en un hilo; el icono se descarga en un hilo y se decodifica y redimensiona en el pool de procesos
+        if estado['archivo'] != None:
+            estado['archivo'].guardar(idElem, 'html', web.content)
+        try:
+            encargo = time.perf_counter()
+            (app, error, ruta), segundos = await loop.run_in_executor(ejecutor, cronometrar, metricas.perfilar, extraerAtributos, web.content)
+            metricas.observar('parseo', segundos)
+            metricas.observar('parseo_espera', max(0.0, time.perf_counter() - encargo - segundos)) #Espera de la tarea en la cola del ejecutor
+        except Exception as e: #Una página que no se puede analizar queda como incidencia, como en el rastreo secuencial, sin detener el resto
+            estado['registro'].anotarIncidencia(idElem, {'Parseo': str(e)})
+            print('Error analizando ' + url + '\n\t' + str(e))
+            return 'HECHO', None, None, ''
+        contenido, fallo = await loop.run_in_executor(ejecutor, descargarIcono, ruta, estado['sesion'])
+        icono = None
+        if contenido != None:
+            if estado['archivo'] != None:
+                estado['archivo'].guardar(idElem, 'icono', contenido)
+            with metricas.medir('icono_redimension'):
+                icono, fallo = await loop.run_in_executor(estado['procesos'], decodificarIcono, contenido)
+        incorporarIcono(app, error, icono, fallo, iconoAFichero, estado['almacenIconos'])
+        if app != None and len(error) <= TOLERANCIA_ERRORES:
+            estado['registro'].anotarElemento(idElem, app)
+        estado['registro'].anotarIncidencia(idElem, error)
+        if estado['validadores'] != None:
+            estado['validadores'].anotar(idElem, web)
+        print('Rastreada url ' + url + ' con éxito')
+        return 'HECHO', None, None, ''
+    return resultado, motivo, retryAfter, fallo
+
+def anotarReintentos(registro, idElem, intento, estadoElem, fallo):
+    """
+    Registra en las incidencias del elemento los reintentos consumidos, su estado final y el último fallo producido.
+
+    Entrada: registro: RegistroIncremental de la sesión.
+             idElem: Id del informe.
+             intento: Intento en el que se ha resuelto o abandonado el elemento.
+             estadoElem: 'correcto', 'descartado', 'ausente', 'retirado', 'agotado', 'parado' o 'pendiente'.
+             fallo: Descripción del último fallo, si lo hay.
+    """
+    if intento == 1 and estadoElem == 'correcto':
+        return
+    incidencia = {'Reintentos': intento - 1, 'Estado': estadoElem}
+    if fallo != '':
+        incidencia['Ultimo_error'] = fallo
+    registro.anotarIncidencia(idElem, incidencia)
+
+async def ejecutarRastreoAsincrono(lista, iconoAFichero, concurrencia, tasa, registro, almacenIconos = None, archivo = None, validadores = None):
+    """
+    Ejecución del modo asíncrono. Reparte los elementos entre tantos trabajadores como peticiones simultáneas se permitan.
+    Los elementos fallidos no bloquean a su trabajador: el PlanificadorElementos los aplaza y los trabajadores siguen con los elementos sanos mientras tanto.
+
+    Entrada: lista: Ids de los informes a rastrear.
+             iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             concurrencia: Peticiones simultáneas permitidas por servidor.
+             tasa: Peticiones por segundo máximas, punto de partida de la tasa adaptativa.
+             registro: RegistroIncremental donde se anotan los elementos y las incidencias, incluidos reintentos y estado de los elementos fallidos.
+             almacenIconos: Destino de los iconos devuelto por abrirAlmacenIconos.
+             archivo: ArchivoRespuestas donde guardar el html y los iconos, o None.
+             validadores: ValidadoresPaginas donde anotar las respuestas, o None.
+    """
+    cubo = CuboTokens(tasa)
+    semaforos = {}
+    planificador = PlanificadorElementos(lista)
+    estado = {'registro': registro, 'planificador': planificador, 'concurrencia': concurrencia,
+              'parada': asyncio.Event(), 'sesion': crearSesion(max(TAMANO_POOL, 2 * concurrencia)),
+              'almacenIconos': almacenIconos, 'archivo': archivo, 'validadores': validadores}
+
+    async def trabajador():
+        while not estado['parada'].is_set():
+            elemento = planificador.siguiente()
+            if elemento == None:
+                espera = planificador.espera()
+                if espera == None:
+                    return
+                await asyncio.sleep(espera)
+                continue
+            idElem, intento = elemento
+            try:
+                resultado, motivo, retryAfter, fallo = await rastrearElementoAsincrono(idElem, intento, iconoAFichero, cubo, semaforos, estado, ejecutor)
+            finally:
+                planificador.terminar()
+            if resultado == 'HECHO':
+                anotarReintentos(estado['registro'], idElem, intento, 'correcto' if fallo == '' else 'descartado', fallo)
+            elif resultado == 'AUSENTE':
+                anotarReintentos(estado['registro'], idElem, intento, 'ausente', fallo)
+            elif resultado == 'PARADA':
+                anotarReintentos(estado['registro'], idElem, intento, 'parado', fallo)
+                estado['parada'].set()
+            elif intento < MAX_REINTENTOS:
+                planificador.aplazar(idElem, intento, motivo, retryAfter, fallo)
+            else:
+                anotarReintentos(estado['registro'], idElem, intento, 'agotado', fallo)
+
+    with ThreadPoolExecutor(max_workers = concurrencia) as ejecutor, ProcessPoolExecutor(max_workers = PROCESOS_ICONOS) as procesos:
+        estado['procesos'] = procesos
+        await asyncio.gather(*[trabajador() for _ in range(concurrencia)])
+
+    for vence, idElem, intento, fallo in planificador.diferidos: #Si el rastreo se ha parado, los elementos aplazados quedan registrados como pendientes
+        anotarReintentos(estado['registro'], idElem, intento, 'pendiente', fallo)
+
+def rastreoAsincrono(inicio, limite, iconoAFichero, concurrencia = CONCURRENCIA_POR_HOST, tasa = TASA_PETICIONES, fichero = None, previos = None, sondear = True):
+    """
+    Variante concurrente de rastreo(): varias peticiones en vuelo por servidor y un presupuesto global de peticiones por segundo en lugar de la espera estándar entre páginas.
+    Mantiene el tratamiento de códigos de estado, las incidencias y los ficheros de salida del rastreo secuencial.
+
+    Entrada: inicio: Id del primer informe a rastrear.
+             limite: Número de informes a rastrear desde el inicio.
+             iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             concurrencia: Peticiones simultáneas permitidas por servidor.
+             tasa: Peticiones por segundo permitidas en total.
+             fichero: Ruta del json del dataset. Por defecto el que corresponde a iconoAFichero.
+             previos: Tupla (tratados, ausentes) de MapaBits con ids ya resueltos en otros datasets. Por defecto ninguno.
+             sondear: Si es False, el rango no se recorta con acotarRango.
+
+    Salida: limite: Número de informes rastreados desde el inicio, una vez recortado el rango al último existente.
+    """
+    if fichero == None:
+        fichero = ficheroDataSet(iconoAFichero)
+
+    tratados = cargarIdsTratados(fichero)
+    ausentes = cargarIdsAusentes(fichero)
+    if previos != None:
+        tratados.update(previos[0])
+        ausentes.update(previos[1])
+    if sondear == True:
+        limite = acotarRango(inicio, limite, tratados, cuboSondeo('asincrono', tasa))
+    lista = crearListaElementosATratar(tratados, inicio, limite, ausentes)
+    almacenIconos = abrirAlmacenIconos(iconoAFichero, fichero)
+    registro = RegistroIncremental(fichero, inicio, limite, almacenIconos)
+    archivo = abrirArchivoRespuestas()
+    validadores = ValidadoresPaginas(rutaValidadores(fichero))
+
+    try:
+        asyncio.run(ejecutarRastreoAsincrono(lista, iconoAFichero, concurrencia, tasa, registro, almacenIconos, archivo, validadores))
+        registro.anotarFin()
+    finally:
+        registro.cerrar()
+        validadores.cerrar()
+        if almacenIconos != None:
+            almacenIconos.cerrar()
+        if archivo != None:
+            archivo.cerrar()
+
+    print('Rastreo finalizado')
+    compactarRegistro(fichero, UMBRAL_COMPACTACION)
+    return limite
+
+class ColaTuberia(queue.Queue):
+    """
+    Cola acotada entre etapas de la tubería que se puede cerrar cuando una etapa falla. Una vez cerrada, put descarta el elemento
+    en lugar de bloquearse con la cola llena y get devuelve la marca de fin None, de modo que el resto de etapas terminan
+    en vez de quedarse esperando a una etapa que ya no consume ni produce.
+
+    Entrada: maxsize: Elementos que puede acumular la cola.
+    """
+    ESPERA = 0.1 #Segundos entre comprobaciones del cierre mientras la cola está llena o vacía
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.cerrada = threading.Event()
+
+    def put(self, elemento):
+        while not self.cerrada.is_set():
+            try:
+                return super().put(elemento, timeout = self.ESPERA)
+            except queue.Full:
+                continue
+
+    def get(self):
+        while not self.cerrada.is_set():
+            try:
+                return super().get(timeout = self.ESPERA)
+            except queue.Empty:
+                continue
+        return None
+
+    def cerrar(self):
+        self.cerrada.set()
+
+def etapaDescarga(planificador, cubo, sesion, colaParseo, colaEscritura, parada, archivo = None, validadores = None, revalidar = False):
+    """
+    Etapa de descarga de la tubería: pide las páginas al servidor respetando el cubo de tokens y entrega el html a la cola de análisis.
+    Si la cola está llena se bloquea, de modo que la descarga nunca se adelanta más de TAMANO_COLA_TUBERIA páginas al análisis.
+
+    Entrada: planificador: PlanificadorElementos compartido por los hilos de descarga.
+             cubo: CuboTokens compartido que limita la tasa global de peticiones.
+             sesion: Sesión HTTP compartida.
+             colaParseo: Cola acotada de (id, intento, respuesta) hacia la etapa de análisis.
+             colaEscritura: Cola hacia el escritor, donde se envían los reintentos y estados de los elementos.
+             parada: threading.Event que detiene la descarga de nuevos elementos.
+             archivo: ArchivoRespuestas donde guardar el html, o None.
+             validadores: ValidadoresPaginas de los elementos, o None.
+             revalidar: Si es True, las peticiones son condicionales y los informes sin cambios no pasan al análisis.
+    """
+    while not parada.is_set():
+        elemento = planificador.siguiente()
+        if elemento == None:
+            espera = planificador.espera()
+            if espera == None:
+                return
+            parada.wait(espera)
+            continue
+        idElem, intento = elemento
+        try:
+            cubo.adquirir()
+            cabeceras = validadores.cabeceras(idElem) if revalidar == True else None
+            resultado, motivo, retryAfter, fallo, web = solicitarPagina(URL_BASE + str(idElem) + '/', intento, cubo, sesion, cabeceras)
+            if resultado == 'AUSENTE' and revalidar == True: #Informe ya tratado que el servidor ha retirado: conserva su última versión en el dataset y queda como incidencia, sin anotarse como ausente
+                validadores.retirado(idElem)
+                colaEscritura.put(('reintentos', idElem, intento, 'retirado', fallo))
+                continue
+            if resultado == 'AUSENTE':
+                colaEscritura.put(('ausente', idElem, intento, fallo))
+                if SONDEAR_FINAL != True and planificador.anotar404(): #Sin sondeo del final, una sucesión de informes inexistentes sirve de criterio de parada
+                    parada.set()
+                continue
+            if motivo == 'ESPERA_ERROR_CLIENTE' and intento == MAX_REINTENTOS: #Elemento agotado con errores de cliente: cuenta para el criterio de parada por final de informes
+                if planificador.anotar404():
+                    resultado = 'PARADA'
+            if resultado == 'CORRECTA' and revalidar == True and validadores.sinCambios(idElem, web):
+                resultado = 'SIN_CAMBIOS'
+            elif resultado == 'SIN_CAMBIOS':
+                validadores.sinCambios(idElem, web)
+            if resultado == 'SIN_CAMBIOS':
+                colaEscritura.put(('sinCambios', idElem, intento, web))
+            elif resultado == 'CORRECTA':
+                if archivo != None:
+                    archivo.guardar(idElem, 'html', web.content)
+                colaParseo.put((idElem, intento, web))
+            elif resultado == 'HECHO':
+                colaEscritura.put(('reintentos', idElem, intento, 'descartado', fallo))
+            elif resultado == 'PARADA':
+                colaEscritura.put(('reintentos', idElem, intento, 'parado', fallo))
+                parada.set()
+            elif intento < MAX_REINTENTOS:
+                planificador.aplazar(idElem, intento, motivo, retryAfter, fallo)
+            else:
+                colaEscritura.put(('reintentos', idElem, intento, 'agotado', fallo))
+        finally:
+            planificador.terminar()
+
+def etapaParseo(procesos, colaParseo, colaIconos):
+    """
+    Etapa de análisis de la tubería: extrae los atributos del html en el pool de procesos, fuera del intérprete que descarga,
+    y entrega el elemento con la ruta de su icono a la cola de iconos. Termina al recibir None.
+
+    Entrada: procesos: ProcessPoolExecutor donde se ejecuta extraerAtributos.
+             colaParseo: Cola acotada de (id, intento, respuesta).
+             colaIconos: Cola acotada de (id, intento, respuesta, atributos, error, ruta) hacia la etapa de iconos.
+    """
+    while True:
+        tarea = colaParseo.get()
+        if tarea == None:
+            return
+        idElem, intento, web = tarea
+        try:
+            if metricas.enMuestra(): #Las páginas de la muestra de perfilado se analizan en este hilo, ya que cProfile no alcanza al pool
+                with metricas.medir('parseo'):
+                    app, error, ruta = metricas.perfilarLlamada(extraerAtributos, web.content)
+            else: #El análisis se mide en el proceso que lo ejecuta; el resto del tiempo es la espera en la cola del pool
+                encargo = time.perf_counter()
+                (app, error, ruta), segundos = procesos.submit(cronometrar, extraerAtributos, web.content).result()
+                metricas.observar('parseo', segundos)
+                metricas.observar('parseo_espera', max(0.0, time.perf_counter() - encargo - segundos))
+        except Exception as e: #Un fallo del pool no debe detener la tubería: el elemento queda como incidencia
+            app, error, ruta = None, {'Parseo': str(e)}, None
+        colaIconos.put((idElem, intento, web, app, error, ruta))
+
+def etapaIconos(procesos, sesion, colaIconos, colaEscritura, archivo = None):
+    """
+    Etapa de iconos de la tubería: descarga el icono con la sesión compartida, lo decodifica y redimensiona en el pool de procesos
+    y entrega el elemento completo al escritor. Termina al recibir None.
+
+    Entrada: procesos: ProcessPoolExecutor donde se ejecuta decodificarIcono.
+             sesion: Sesión HTTP compartida.
+             colaIconos: Cola acotada de (id, intento, respuesta, atributos, error, ruta).
+             colaEscritura: Cola hacia el escritor.
+             archivo: ArchivoRespuestas donde guardar los bytes del icono, o None.
+    """
+    while True:
+        tarea = colaIconos.get()
+        if tarea == None:
+            return
+        idElem, intento, web, app, error, ruta = tarea
+        icono = None
+        if app == None:
+            contenido, fallo = None, ''
+        else:
+            contenido, fallo = descargarIcono(ruta, sesion)
+        if contenido != None:
+            if archivo != None:
+                archivo.guardar(idElem, 'icono', contenido)
+            try:
+                with metricas.medir('icono_redimension'):
+                    icono, fallo = procesos.submit(decodificarIcono, contenido).result()
+            except Exception as e:
+                fallo = str(e)
+        colaEscritura.put(('elemento', idElem, intento, web, app, error, icono, fallo))
+
+def etapaEscritura(colaEscritura, iconoAFichero, registro, almacenIconos, validadores = None):
+    """
+    Etapa de escritura de la tubería: único hilo que incorpora los iconos a su destino y anota elementos, incidencias y reintentos en el registro incremental.
+    Los validadores de cada página se actualizan después de anotar el elemento, para que nunca indiquen como analizado un html que no ha llegado al registro.
+    Termina al recibir None.
+
+    Entrada: colaEscritura: Cola de ('elemento', id, intento, respuesta, atributos, error, icono, fallo), ('sinCambios', id, intento, respuesta),
+                            ('ausente', id, intento, fallo) y ('reintentos', id, intento, estado, fallo).
+             iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             registro: RegistroIncremental de la sesión.
+             almacenIconos: Destino de los iconos devuelto por abrirAlmacenIconos.
+             validadores: ValidadoresPaginas de los elementos, o None.
+    """
+    while True:
+        tarea = colaEscritura.get()
+        if tarea == None:
+            return
+        if tarea[0] == 'reintentos':
+            anotarReintentos(registro, *tarea[1:])
+            continue
+        if tarea[0] == 'ausente':
+            registro.anotarAusente(tarea[1])
+            anotarReintentos(registro, tarea[1], tarea[2], 'ausente', tarea[3])
+            continue
+        if tarea[0] == 'sinCambios':
+            tipo, idElem, intento, web = tarea
+            print('Sin cambios url ' + URL_BASE + str(idElem) + '/')
+        else:
+            tipo, idElem, intento, web, app, error, icono, fallo = tarea
+            if app != None:
+                incorporarIcono(app, error, icono, fallo, iconoAFichero, almacenIconos)
+                if len(error) <= TOLERANCIA_ERRORES:
+                    registro.anotarElemento(idElem, app)
+            registro.anotarIncidencia(idElem, error)
+            print('Rastreada url ' + URL_BASE + str(idElem) + '/ con éxito')
+        anotarReintentos(registro, idElem, intento, 'correcto', '')
+        if validadores != None:
+            validadores.anotar(idElem, web)
+
+def ejecutarTuberia(lista, iconoAFichero, concurrencia, tasa, registro, almacenIconos = None, archivo = None, validadores = None, revalidar = False):
+    """
+    Ejecución del modo tubería. El rastreo se divide en etapas unidas por colas acotadas: descarga (concurrencia hilos),
+    análisis del html en un pool de PROCESOS_PARSEO procesos, descarga y decodificación de iconos y un único escritor.
+    Mientras unas páginas se descargan otras se analizan, y cuando una etapa se retrasa las colas llenas frenan a las anteriores,
+    por lo que la memoria ocupada no depende del tamaño del rango.
+
+    Entrada: lista: Ids de los informes a rastrear.
+             iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             concurrencia: Hilos de descarga de páginas y de iconos.
+             tasa: Peticiones por segundo máximas, punto de partida de la tasa adaptativa.
+             registro: RegistroIncremental donde se anotan los elementos y las incidencias.
+             almacenIconos: Destino de los iconos devuelto por abrirAlmacenIconos.
+             archivo: ArchivoRespuestas donde guardar el html y los iconos, o None.
+             validadores: ValidadoresPaginas donde anotar las respuestas, o None.
+             revalidar: Si es True, las peticiones son condicionales y los informes sin cambios no se vuelven a analizar (ver refrescarDataSet).
+    """
+    cubo = CuboTokens(tasa)
+    planificador = PlanificadorElementos(lista)
+    sesion = crearSesion(max(TAMANO_POOL, 2 * concurrencia))
+    parada = threading.Event()
+    colaParseo = ColaTuberia(maxsize = TAMANO_COLA_TUBERIA)
+    colaIconos = ColaTuberia(maxsize = TAMANO_COLA_TUBERIA)
+    colaEscritura = ColaTuberia(maxsize = TAMANO_COLA_TUBERIA)
+    fallos = [] #Excepciones de las etapas, que se relanzan en el hilo principal al terminar
+
+    def ejecutarEtapa(funcion, *argumentos):
+        #Si una etapa falla, se para la descarga y se cierran las colas para que el resto de etapas terminen en lugar de bloquearse
+        try:
+            funcion(*argumentos)
+        except BaseException as e:
+            fallos.append(e)
+            parada.set()
+            for cola in (colaParseo, colaIconos, colaEscritura):
+                cola.cerrar()
+
+    def lanzar(numero, funcion, *argumentos):
+        hilos = [threading.Thread(target = ejecutarEtapa, args = (funcion,) + argumentos, daemon = True) for _ in range(numero)]
+        for hilo in hilos:
+            hilo.start()
+        return hilos
+
+    with ProcessPoolExecutor(max_workers = PROCESOS_PARSEO) as procesos:
+        escritor = lanzar(1, etapaEscritura, colaEscritura, iconoAFichero, registro, almacenIconos, validadores)
+        iconos = lanzar(concurrencia, etapaIconos, procesos, sesion, colaIconos, colaEscritura, archivo)
+        analizadores = lanzar(PROCESOS_PARSEO, etapaParseo, procesos, colaParseo, colaIconos)
+        descargas = lanzar(concurrencia, etapaDescarga, planificador, cubo, sesion, colaParseo, colaEscritura, parada, archivo, validadores, revalidar)
+
+        #Cierre ordenado: cuando termina una etapa se envía a la siguiente una marca de fin por hilo, para que vacíe su cola antes de terminar
+        for etapa, cola, siguientes in [(descargas, colaParseo, analizadores), (analizadores, colaIconos, iconos), (iconos, colaEscritura, escritor)]:
+            for hilo in etapa:
+                hilo.join()
+            for _ in siguientes:
+                cola.put(None)
+        escritor[0].join()
+    if len(fallos) > 0:
+        raise fallos[0]
+
+    for vence, idElem, intento, fallo in planificador.diferidos: #Si el rastreo se ha parado, los elementos aplazados quedan registrados como pendientes
+        anotarReintentos(registro, idElem, intento, 'pendiente', fallo)
+
+def rastreoTuberia(inicio, limite, iconoAFichero, concurrencia = CONCURRENCIA_POR_HOST, tasa = TASA_PETICIONES, fichero = None, previos = None, sondear = True):
+    """
+    Variante de rastreo() en tubería de etapas: descarga, análisis en varios procesos, iconos y escritura se solapan en lugar de ejecutarse uno tras otro.
+    Mantiene la limitación por tasa del modo asíncrono, el tratamiento de códigos de estado, las incidencias y los ficheros de salida.
+
+    Entrada: inicio: Id del primer informe a rastrear.
+             limite: Número de informes a rastrear desde el inicio.
+             iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             concurrencia: Hilos de descarga de páginas y de iconos.
+             tasa: Peticiones por segundo permitidas en total.
+             fichero: Ruta del json del dataset. Por defecto el que corresponde a iconoAFichero.
+             previos: Tupla (tratados, ausentes) de MapaBits con ids ya resueltos en otros datasets. Por defecto ninguno.
+             sondear: Si es False, el rango no se recorta con acotarRango.
+
+    Salida: limite: Número de informes rastreados desde el inicio, una vez recortado el rango al último existente.
+    """
+    if fichero == None:
+        fichero = ficheroDataSet(iconoAFichero)
+
+    tratados = cargarIdsTratados(fichero)
+    ausentes = cargarIdsAusentes(fichero)
+    if previos != None:
+        tratados.update(previos[0])
+        ausentes.update(previos[1])
+    if sondear == True:
+        limite = acotarRango(inicio, limite, tratados, cuboSondeo('tuberia', tasa))
+    lista = crearListaElementosATratar(tratados, inicio, limite, ausentes)
+    almacenIconos = abrirAlmacenIconos(iconoAFichero, fichero)
+    registro = RegistroIncremental(fichero, inicio, limite, almacenIconos)
+    archivo = abrirArchivoRespuestas()
+    validadores = ValidadoresPaginas(rutaValidadores(fichero))
+
     try:
-        with open(fichero, 'w') as outfile: #Al acabar, volcar el nuevo fichero con el dataset.
-            json.dump(tratados_dict, outfile)
-        
-        with open(('incidencias_' + str(inicio) + '_' + str(inicio + limite - 1) + '.json'), 'w') as outfile: #Al acabar, volcar el fichero de incidencias
-            json.dump(incidencias, outfile)
-    except Exception as e:
-        print('Error escribiendo dataset')
+        ejecutarTuberia(lista, iconoAFichero, concurrencia, tasa, registro, almacenIconos, archivo, validadores)
+        registro.anotarFin()
+    finally:
+        registro.cerrar()
+        validadores.cerrar()
+        if almacenIconos != None:
+            almacenIconos.cerrar()
+        if archivo != None:
+            archivo.cerrar()
+
+    print('Rastreo finalizado')
+    compactarRegistro(fichero, UMBRAL_COMPACTACION)
+    return limite
+
+def claveFechaAnalisis(fecha):
+    """
+    Convierte el atributo Analysis_date ('d-mm-aaaa') en una clave ordenable. Las fechas desconocidas ('na') quedan las primeras.
+
+    Entrada: fecha: Valor del atributo Analysis_date.
+
+    Salida: Tupla (año, mes, día).
+    """
+    try:
+        dia, mes, anio = str(fecha).split('-')
+        return int(anio), int(mes), int(dia)
+    except ValueError:
+        return 0, 0, 0
+
+def refrescarDataSet(iconoAFichero, limite = None, concurrencia = CONCURRENCIA_POR_HOST, tasa = TASA_PETICIONES):
+    """
+    Revalida los elementos ya tratados del dataset para recoger los informes que el sitio ha vuelto a analizar, sin borrar el dataset ni rastrearlo de nuevo.
+    Se revisitan primero los elementos con Analysis_date más antigua, con peticiones condicionales a partir de los validadores guardados.
+    Si el servidor responde 304 o el html tiene el mismo hash que la última vez, no se analiza; solo los informes modificados pasan
+    por el análisis y los iconos de la tubería y sustituyen a su versión anterior en el dataset. Los informes que el servidor ya no ofrece
+    (CODIGOS_AUSENTE) conservan su última versión y quedan como incidencia con estado 'retirado', sin anotarse como ausentes.
+
+    Entrada: iconoAFichero: Indicador del dataset a refrescar.
+             limite: Número máximo de elementos a revalidar en esta ejecución, o None para todo el dataset.
+             concurrencia: Hilos de descarga de páginas y de iconos.
+             tasa: Peticiones por segundo permitidas en total.
+    """
+    fichero = ficheroDataSet(iconoAFichero)
+
+    fechas = {}
+    if os.path.exists(fichero): #Solo se conserva la fecha de análisis de cada elemento, recorriendo el json en streaming
+        for idElem, elem in recorrerDataSet(fichero):
+            fechas[idElem] = elem.get('Analysis_date', 'na')
+    for anotacion in leerRegistro(rutaRegistro(fichero)): #Los elementos del registro pendiente de compactar sustituyen a los del json
+        if anotacion['tipo'] == 'elemento':
+            fechas[int(anotacion['id'])] = anotacion['datos'].get('Analysis_date', 'na')
+    lista = sorted(fechas, key = lambda idElem: (claveFechaAnalisis(fechas[idElem]), idElem))
+    if limite != None:
+        lista = lista[:limite]
+    if len(lista) == 0:
+        print('No hay elementos que refrescar')
+        return
+
+    almacenIconos = abrirAlmacenIconos(iconoAFichero, fichero, reutilizar = True)
+    registro = RegistroIncremental(fichero, min(lista), max(lista) - min(lista) + 1, almacenIconos)
+    archivo = abrirArchivoRespuestas()
+    validadores = ValidadoresPaginas(rutaValidadores(fichero))
+
+    try:
+        ejecutarTuberia(lista, iconoAFichero, concurrencia, tasa, registro, almacenIconos, archivo, validadores, revalidar = True)
+        registro.anotarFin()
+    finally:
+        registro.cerrar()
+        validadores.cerrar()
+        if almacenIconos != None:
+            almacenIconos.cerrar()
+        if archivo != None:
+            archivo.cerrar()
+
+    print('Refresco finalizado: ' + str(validadores.resumen['No_modificado']) + ' sin modificar (304), ' + str(validadores.resumen['Mismo_hash']) + ' con el mismo html, '
+          + str(validadores.resumen['Modificado']) + ' actualizados, ' + str(validadores.resumen['Retirado']) + ' retirados por el servidor')
+    compactarRegistro(fichero, UMBRAL_COMPACTACION)
+
+class CoordinadorTramos:
+    """
+    Almacén de coordinación del rastreo por tramos, en una base de datos SQLite compartida por todos los trabajadores (procesos de una
+    máquina o de varias sobre un directorio común). El rango a rastrear se divide en tramos de ids que los trabajadores arriendan
+    por un tiempo limitado y renuevan mientras los rastrean. Si un trabajador cae, su arriendo vence y otro trabajador puede tomar el tramo.
+    Cada operación es una transacción inmediata de SQLite, de modo que dos trabajadores nunca obtienen el mismo tramo vigente.
+
+    Entrada: ruta: Ruta de la base de datos SQLite de coordinación.
+    """
+    def __init__(self, ruta = FICHERO_COORDINACION):
+        self.ruta = ruta
+        self.conexion = sqlite3.connect(ruta, timeout = 60, isolation_level = None)
+        self.conexion.execute('CREATE TABLE IF NOT EXISTS tramos (inicio INTEGER PRIMARY KEY, fin INTEGER NOT NULL, estado TEXT NOT NULL, '
+                              'trabajador TEXT, vence REAL, intentos INTEGER NOT NULL DEFAULT 0)')
+
+    def transaccion(self, sentencias):
+        #Ejecuta una función sobre la conexión dentro de una transacción inmediata (bloqueo de escritura desde el principio)
+        self.conexion.execute('BEGIN IMMEDIATE')
+        try:
+            resultado = sentencias(self.conexion)
+            self.conexion.execute('COMMIT')
+            return resultado
+        except Exception:
+            self.conexion.execute('ROLLBACK')
+            raise
+
+    def preparar(self, inicio, limite, tamano = TAMANO_TRAMO):
+        """
+        Divide el rango [inicio, inicio + limite) en tramos de tamano ids. Los tramos que ya existían se conservan con su estado.
+        """
+        tramos = [(ini, min(ini + tamano, inicio + limite) - 1) for ini in range(inicio, inicio + limite, tamano)]
+        self.transaccion(lambda c: c.executemany("INSERT OR IGNORE INTO tramos (inicio, fin, estado) VALUES (?, ?, 'libre')", tramos))
+        return len(tramos)
+
+    def arrendar(self, trabajador, duracion = DURACION_ARRIENDO):
+        """
+        Arrienda al trabajador el primer tramo libre o con el arriendo vencido. Devuelve (inicio, fin) o None si no queda ninguno.
+        """
+        def sentencias(c):
+            ahora = time.time()
+            fila = c.execute("SELECT inicio, fin FROM tramos WHERE estado = 'libre' OR (estado = 'arrendado' AND vence < ?) ORDER BY inicio LIMIT 1", (ahora,)).fetchone()
+            if fila != None:
+                c.execute("UPDATE tramos SET estado = 'arrendado', trabajador = ?, vence = ?, intentos = intentos + 1 WHERE inicio = ?", (trabajador, ahora + duracion, fila[0]))
+            return fila
+        return self.transaccion(sentencias)
+
+    def renovar(self, inicio, trabajador, duracion = DURACION_ARRIENDO):
+        """
+        Prolonga el arriendo del tramo. Devuelve False si el tramo ya no pertenece al trabajador.
+        """
+        return self.transaccion(lambda c: c.execute("UPDATE tramos SET vence = ? WHERE inicio = ? AND trabajador = ? AND estado = 'arrendado'",
+                                                    (time.time() + duracion, inicio, trabajador)).rowcount == 1)
+
+    def completar(self, inicio, trabajador):
+        self.transaccion(lambda c: c.execute("UPDATE tramos SET estado = 'hecho', vence = NULL WHERE inicio = ? AND trabajador = ?", (inicio, trabajador)))
+
+    def liberar(self, inicio, trabajador):
+        """
+        Devuelve el tramo al estado libre sin darlo por hecho, p. ej. cuando el sondeo lo sitúa por encima del último informe existente.
+        """
+        self.transaccion(lambda c: c.execute("UPDATE tramos SET estado = 'libre', trabajador = NULL, vence = NULL WHERE inicio = ? AND trabajador = ? AND estado = 'arrendado'", (inicio, trabajador)))
+
+    def rangoPendiente(self):
+        """
+        Devuelve (inicio, fin) del rango que cubren los tramos aún no hechos, o None si no queda ninguno.
+        """
+        fila = self.conexion.execute("SELECT MIN(inicio), MAX(fin) FROM tramos WHERE estado != 'hecho'").fetchone()
+        return None if fila[0] == None else fila
+
+    def resumen(self):
+        """
+        Devuelve un diccionario estado > número de tramos; los arriendos vencidos se cuentan como 'vencido'.
+        """
+        filas = self.conexion.execute("SELECT CASE WHEN estado = 'arrendado' AND vence < ? THEN 'vencido' ELSE estado END, COUNT(*) FROM tramos GROUP BY 1", (time.time(),)).fetchall()
+        return dict(filas)
+
+    def estados(self):
+        """
+        Devuelve un diccionario inicio > estado de cada tramo; los arriendos vencidos se devuelven como 'vencido'.
+        """
+        filas = self.conexion.execute("SELECT inicio, CASE WHEN estado = 'arrendado' AND vence < ? THEN 'vencido' ELSE estado END FROM tramos", (time.time(),)).fetchall()
+        return dict(filas)
+
+    def cerrar(self):
+        self.conexion.close()
+
+def nombreTrabajador():
+    """
+    Identificador del trabajador actual (máquina y proceso), apto para formar parte de un nombre de fichero.
+
+    Salida: Texto máquina-pid.
+    """
+    return re.sub(r'[^A-Za-z0-9.-]', '-', socket.gethostname()) + '-' + str(os.getpid())
+
+def rutaTramo(iconoAFichero, inicio, fin, trabajador):
+    """
+    Devuelve la ruta del dataset propio de un tramo y un trabajador, dentro de DIRECTORIO_TRAMOS. Ej. tramos/exodus_1_1000_maquina-123.json
+    Cada trabajador escribe solo en sus propios ficheros, de modo que nunca sobrescribe los resultados de otro tramo.
+
+    Entrada: iconoAFichero: Indicador del dataset.
+             inicio, fin: Ids del tramo.
+             trabajador: Identificador del trabajador.
+
+    Salida: Ruta del json del dataset del tramo.
+    """
+    base = os.path.splitext(os.path.basename(ficheroDataSet(iconoAFichero)))[0]
+    return os.path.join(DIRECTORIO_TRAMOS, base + '_' + str(inicio) + '_' + str(fin) + '_' + trabajador + '.json')
+
+def idsPreviosTramo(iconoAFichero, inicio, fin):
+    """
+    Reúne los ids ya tratados y ausentes que no hay que volver a pedir al rastrear un tramo: los del dataset principal y los de los
+    ficheros que otros trabajadores (o este mismo en un arriendo anterior) hayan dejado para el mismo tramo.
+
+    Entrada: iconoAFichero: Indicador del dataset.
+             inicio, fin: Ids del tramo.
+
+    Salida: Tupla (tratados, ausentes) de MapaBits.
+    """
+    principal = ficheroDataSet(iconoAFichero)
+    tratados = cargarIdsTratados(principal)
+    ausentes = cargarIdsAusentes(principal)
+    for ruta in glob.glob(glob.escape(rutaTramo(iconoAFichero, inicio, fin, '')[:-len('.json')]) + '*.json'):
+        tratados.update(cargarIdsTratados(ruta))
+        ausentes.update(cargarIdsAusentes(ruta))
+    return tratados, ausentes
+
+def rastreoPorTramos(iconoAFichero, modo = 'secuencial', concurrencia = CONCURRENCIA_POR_HOST, tasa = TASA_PETICIONES):
+    """
+    Trabajador del rastreo por tramos: arrienda tramos del CoordinadorTramos y rastrea cada uno sobre su propio dataset con rastreo(),
+    renovando el arriendo en segundo plano, hasta que no quedan tramos. Se pueden lanzar tantos trabajadores como se quiera, en la misma
+    máquina o en varias que compartan el directorio de trabajo; la tasa de peticiones indicada es la de cada trabajador.
+    No se piden los ids ya resueltos en el dataset principal ni en otros ficheros del mismo tramo (idsPreviosTramo).
+    El final se sondea una sola vez al empezar, con acotarRango sobre el rango de los tramos pendientes, y no en cada tramo.
+    Un tramo situado por encima del último informe existente se libera sin darlo por hecho y el trabajador termina.
+    Los resultados se incorporan al dataset principal con fusionarTramos.
+
+    Entrada: iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             modo, concurrencia, tasa: Parámetros de rastreo() con los que se rastrea cada tramo.
+    """
+    os.makedirs(DIRECTORIO_TRAMOS, exist_ok = True)
+    coordinador = CoordinadorTramos(FICHERO_COORDINACION)
+    trabajador = nombreTrabajador()
+    try:
+        rango = coordinador.rangoPendiente()
+        if rango == None:
+            print('No quedan tramos por rastrear')
+            return
+        #Un único sondeo del final para todos los tramos pendientes, desde el mayor id del dataset principal en su rango
+        ultimo = rango[0] + acotarRango(rango[0], rango[1] - rango[0] + 1, cargarIdsTratados(ficheroDataSet(iconoAFichero)), cuboSondeo(modo, tasa)) - 1
+        while True:
+            tramo = coordinador.arrendar(trabajador)
+            if tramo == None:
+                break
+            inicio, fin = tramo
+            if inicio > ultimo: #El tramo queda por encima del último informe: se libera para cuando el sitio publique más
+                coordinador.liberar(inicio, trabajador)
+                print('Tramo ' + str(inicio) + '-' + str(fin) + ' por encima del último informe existente; se libera sin darlo por hecho')
+                return
+            print('Tramo ' + str(inicio) + '-' + str(fin) + ' arrendado por ' + trabajador)
+
+            terminado = threading.Event()
+            def renovarArriendo():
+                renovador = CoordinadorTramos(FICHERO_COORDINACION) #Las conexiones de SQLite no se comparten entre hilos
+                while not terminado.wait(DURACION_ARRIENDO / 3):
+                    if not renovador.renovar(inicio, trabajador):
+                        print('Arriendo del tramo ' + str(inicio) + '-' + str(fin) + ' perdido; sus resultados se conservan y se fusionarán igualmente')
+                        break
+                renovador.cerrar()
+            hilo = threading.Thread(target = renovarArriendo, daemon = True)
+            hilo.start()
+            try:
+                rastreo(inicio, min(fin, ultimo) - inicio + 1, iconoAFichero, modo, concurrencia, tasa, rutaTramo(iconoAFichero, inicio, fin, trabajador),
+                        idsPreviosTramo(iconoAFichero, inicio, fin), sondear = False)
+            finally:
+                terminado.set()
+                hilo.join()
+            coordinador.completar(inicio, trabajador)
+    finally:
+        coordinador.cerrar()
+    print('No quedan tramos por rastrear')
+
+def fusionarTramos(iconoAFichero, forzar = False):
+    """
+    Incorpora al dataset principal los datasets de los tramos hechos de DIRECTORIO_TRAMOS, incluidos los parciales de trabajadores caídos en ellos.
+    La fusión es determinista: se parte del dataset principal y se aplican los tramos en orden de inicio, fin y trabajador, de modo que
+    ante un mismo id prevalece siempre el mismo tramo. Se fusionan también el índice de ids, los ids ausentes, los validadores, el índice invertido
+    si existe y los iconos del modo elegido (en el almacén binario se copian y se actualiza su posición). Los ficheros de cada tramo se eliminan tras fusionarlo.
+    Los ficheros de los tramos que no están hechos se conservan sin fusionar, porque su trabajador puede seguir escribiendo en ellos.
+    Con forzar se fusionan también los tramos libres o con el arriendo vencido (trabajadores caídos), pero nunca los de un arriendo vigente.
+
+    Entrada: iconoAFichero: Indicador del dataset a fusionar.
+             forzar: Indicador para fusionar también los tramos no hechos sin arriendo vigente, o todos si no hay base de datos de coordinación.
+    """
+    estados = None
+    if os.path.exists(FICHERO_COORDINACION):
+        coordinador = CoordinadorTramos(FICHERO_COORDINACION)
+        estados = coordinador.estados()
+        coordinador.cerrar()
+    elif forzar != True:
+        print('No existe ' + FICHERO_COORDINACION + ' para saber qué tramos están hechos; use --forzar para fusionarlos igualmente')
+        return
+
+    fichero = ficheroDataSet(iconoAFichero)
+    base = os.path.splitext(os.path.basename(fichero))[0]
+    tramos = []
+    pendientes = set()
+    for ruta in glob.glob(os.path.join(DIRECTORIO_TRAMOS, base + '_*.json')):
+        inicio, fin, trabajador = os.path.basename(ruta)[len(base) + 1:-len('.json')].split('_', 2)
+        estado = 'hecho' if estados == None else estados.get(int(inicio))
+        if estado == 'hecho' or (forzar == True and estado != 'arrendado'):
+            tramos.append(((int(inicio), int(fin), trabajador), ruta))
+        else: #Tramo en curso, libre o vencido: su trabajador puede seguir escribiendo, así que se conservan sus ficheros
+            pendientes.add((int(inicio), int(fin), estado))
+    tramos.sort()
+    for inicio, fin, estado in sorted(pendientes):
+        print('Tramo ' + str(inicio) + '-' + str(fin) + ' ' + str(estado) + ': se conserva sin fusionar')
+    if len(tramos) == 0:
+        print('No hay tramos que fusionar')
+        return
+
+    compactarRegistro(fichero) #El registro pendiente del dataset principal se incorpora antes, para no reproducirlo después sobre lo fusionado
+    tratados_dict, tratados_list = cargarElementosTratados(fichero)
+    ausentes = cargarIdsAusentes(fichero)
+    validadores = ValidadoresPaginas(rutaValidadores(fichero))
+    almacenIconos = AlmacenIconos(rutaAlmacenIconos(fichero)) if iconoAFichero == ICONO_BINARIO else None
+    zipIconos = ZipIconos(os.path.splitext(fichero)[0] + '.png.zip') if iconoAFichero == True and ICONOS_EN_ARCHIVO == True else None
+
+    fusionados = set()
+    try:
+        for clave, ruta in tramos:
+            compactarRegistro(ruta) #Un tramo interrumpido o por debajo de UMBRAL_COMPACTACION conserva su registro incremental sin compactar
+            elementos, ids = cargarElementosTratados(ruta)
+            if almacenIconos != None and os.path.exists(rutaAlmacenIconos(ruta) + '.ids'):
+                iconos, idsIconos = cargarIconos(rutaAlmacenIconos(ruta))
+                for idElem in elementos:
+                    icono = elementos[idElem].get('Icon')
+                    if isinstance(icono, dict) and icono['Posicion'] < len(iconos):
+                        icono['Fichero'] = os.path.basename(almacenIconos.ruta)
+                        icono['Posicion'] = almacenIconos.guardar(int(idElem), iconos[icono['Posicion']])
+                del iconos
+            tratados_dict.update(elementos)
+            fusionados.update(elementos)
+            for idElem in cargarIdsAusentes(ruta):
+                ausentes.add(idElem)
+            validadoresTramo = ValidadoresPaginas(rutaValidadores(ruta))
+            validadoresTramo.cerrar()
+            for idElem in validadoresTramo.entradas:
+                validadores.incorporar(idElem, validadoresTramo.entradas[idElem])
+            if zipIconos != None and os.path.exists(os.path.splitext(ruta)[0] + '.png.zip'):
+                with zipfile.ZipFile(os.path.splitext(ruta)[0] + '.png.zip') as zipTramo:
+                    for nombre in zipTramo.namelist():
+                        zipIconos.writestr(nombre, zipTramo.read(nombre))
+            print('Tramo ' + str(clave[0]) + '-' + str(clave[1]) + ' de ' + clave[2] + ': ' + str(len(elementos)) + ' elementos')
+    finally:
+        validadores.cerrar()
+        if almacenIconos != None:
+            almacenIconos.cerrar()
+        if zipIconos != None:
+            zipIconos.close()
+
+    volcarJsonAtomico(fichero, tratados_dict)
+    MapaBits(int(x) for x in tratados_dict).guardar(rutaIndiceIds(fichero))
+    recortarAusentes(ausentes, tratados_dict).guardar(rutaAusentes(fichero))
+    if os.path.exists(rutaIndiceInvertido(fichero) + '.json'):
+        actualizarIndice(fichero, ((int(idElem), tratados_dict[idElem]) for idElem in sorted(fusionados, key = int)))
+    for clave, ruta in tramos: #Los ficheros de los tramos solo se eliminan cuando el dataset principal ya está escrito
+        for resto in glob.glob(glob.escape(os.path.splitext(ruta)[0]) + '.*'):
+            os.remove(resto)
+    print('Fusión finalizada: ' + str(len(tramos)) + ' tramos, ' + str(len(tratados_dict)) + ' elementos en ' + fichero)
+
+def rutaColumnas(rutaDataSet):
+    """
+    Devuelve el directorio de la exportación en columnas asociado al json del dataset. Ej. exodus.json > exodus.columnas
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+
+    Salida: Ruta del directorio de columnas.
+    """
+    return os.path.splitext(rutaDataSet)[0] + '.columnas'
+
+class ExportadorColumnas:
+    """
+    Exportación del dataset en columnas de NumPy para su análisis sin pasar por el json. Cada columna es un fichero binario de solo añadido
+    con un tipo fijo, de modo que exportar ids nuevos solo escribe al final de cada fichero:
+        Id.bin (int64), Analysis_date.bin (int32 aaaammdd, 0 si es 'na') y las columnas enteras de COLUMNAS_ENTERAS (int32, -1 si es 'na').
+        Las columnas de texto de COLUMNAS_CODIFICADAS (int32) guardan el código de su valor en el diccionario de la columna (-1 si es 'na').
+        Las listas (Trackers, Permissions) guardan los códigos de todas las filas seguidos en <columna>.bin y el final acumulado
+        de cada fila en <columna>.fin (int64). Purposes es una lista por cada rastreador de Trackers, con el mismo esquema.
+        Icon.bin es un tensor uint8 de forma (N,32,32,4) e Icon_presente.bin (uint8) indica si la fila tiene icono.
+    En columnas.json se guardan las filas exportadas, el tamaño confirmado de cada fichero y los diccionarios, que solo crecen, de modo
+    que los códigos de las filas ya exportadas no cambian. Se escribe de forma atómica tras cada lote y al abrir la exportación los ficheros
+    se recortan a su tamaño confirmado, descartando lo escrito por una exportación interrumpida.
+
+    Entrada: ruta: Directorio de la exportación.
+    """
+    FICHEROS = {'Id.bin': np.int64, 'Analysis_date.bin': np.int32, 'Icon.bin': np.uint8, 'Icon_presente.bin': np.uint8}
+    FICHEROS.update({columna + '.bin': np.int32 for columna in COLUMNAS_ENTERAS + COLUMNAS_CODIFICADAS + COLUMNAS_LISTA})
+    FICHEROS.update({columna + '.fin': np.int64 for columna in COLUMNAS_LISTA})
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        os.makedirs(ruta, exist_ok = True)
+        try:
+            with open(os.path.join(ruta, 'columnas.json'), encoding = 'utf-8') as json_file:
+                metadatos = json.load(json_file)
+        except Exception:
+            metadatos = {'filas': 0, 'tamanos': {}, 'diccionarios': {}}
+        self.filas = metadatos['filas']
+        self.tamanos = metadatos['tamanos']
+        self.diccionarios = {columna: metadatos['diccionarios'].get(columna, []) for columna in COLUMNAS_CODIFICADAS + COLUMNAS_LISTA}
+        self.codigos = {columna: {valor: codigo for codigo, valor in enumerate(self.diccionarios[columna])} for columna in self.diccionarios}
+        self.ficheros = {}
+        for nombre in self.FICHEROS:
+            self.ficheros[nombre] = open(os.path.join(ruta, nombre), 'ab')
+            self.ficheros[nombre].truncate(self.tamanos.get(nombre, 0))
+        self.ids = set(np.fromfile(os.path.join(ruta, 'Id.bin'), dtype = np.int64).tolist())
+        self.finales = {columna: self.tamanos.get(columna + '.bin', 0) // 4 for columna in COLUMNAS_LISTA}
+        self.pendientes = {nombre: [] for nombre in self.FICHEROS}
+
+    def codificar(self, columna, valor):
+        """
+        Devuelve el código del valor en el diccionario de la columna, añadiéndolo si es nuevo. 'na' se codifica como -1.
+        """
+        if valor == 'na' or valor == None:
+            return -1
+        valor = str(valor)
+        if valor not in self.codigos[columna]:
+            self.codigos[columna][valor] = len(self.diccionarios[columna])
+            self.diccionarios[columna].append(valor)
+        return self.codigos[columna][valor]
+
+    def anadirLista(self, columna, valores):
+        codigos = [self.codificar(columna, valor) for valor in valores]
+        self.pendientes[columna + '.bin'].extend(codigos)
+        self.finales[columna] += len(codigos)
+        self.pendientes[columna + '.fin'].append(self.finales[columna])
+
+    def anadir(self, idElem, elem, icono = None):
+        """
+        Añade una fila con los atributos del elemento y su icono (array uint8 de forma (32,32,4) o None).
+        """
+        self.pendientes['Id.bin'].append(idElem)
+        anio, mes, dia = claveFechaAnalisis(elem.get('Analysis_date', 'na'))
+        self.pendientes['Analysis_date.bin'].append(anio * 10000 + mes * 100 + dia)
+        for columna in COLUMNAS_ENTERAS:
+            valor = elem.get(columna, 'na')
+            self.pendientes[columna + '.bin'].append(int(valor) if isinstance(valor, (int, float)) else -1)
+        for columna in COLUMNAS_CODIFICADAS:
+            self.pendientes[columna + '.bin'].append(self.codificar(columna, elem.get(columna, 'na')))
+        trackers = elem.get('Trackers') if isinstance(elem.get('Trackers'), list) else []
+        rastreadores = [(nombre, propositos) for tracker in trackers for nombre, propositos in tracker.items()]
+        self.anadirLista('Trackers', [nombre for nombre, propositos in rastreadores])
+        for nombre, propositos in rastreadores:
+            self.anadirLista('Purposes', propositos if isinstance(propositos, list) else [])
+        self.anadirLista('Permissions', elem.get('Permissions') if isinstance(elem.get('Permissions'), list) else [])
+        self.pendientes['Icon.bin'].append(np.zeros((32, 32, 4), dtype = np.uint8) if icono is None else np.ascontiguousarray(icono, dtype = np.uint8).reshape(32, 32, 4))
+        self.pendientes['Icon_presente.bin'].append(0 if icono is None else 1)
+        self.ids.add(idElem)
+
+    def volcar(self):
+        """
+        Escribe las filas pendientes al final de cada columna, las fuerza a disco y confirma la exportación en columnas.json.
+        """
+        if len(self.pendientes['Id.bin']) == 0:
+            return
+        self.filas += len(self.pendientes['Id.bin'])
+        for nombre in self.FICHEROS:
+            if len(self.pendientes[nombre]) > 0:
+                self.ficheros[nombre].write(np.asarray(self.pendientes[nombre], dtype = self.FICHEROS[nombre]).tobytes())
+            self.ficheros[nombre].flush()
+            os.fsync(self.ficheros[nombre].fileno())
+            self.tamanos[nombre] = self.ficheros[nombre].tell()
+            self.pendientes[nombre] = []
+        volcarJsonAtomico(os.path.join(self.ruta, 'columnas.json'), {'filas': self.filas, 'tamanos': self.tamanos, 'diccionarios': self.diccionarios})
+
+    def cerrar(self):
+        self.volcar()
+        for nombre in self.ficheros:
+            self.ficheros[nombre].close()
+
+def leerIconoElemento(idElem, elem, iconoAFichero, iconos = None, zipIconos = None):
+    """
+    Recupera el icono de un elemento del dataset según el modo en que se guardó.
+
+    Entrada: idElem: Id del elemento.
+             elem: Diccionario de atributos del elemento.
+             iconoAFichero: Modo de tratamiento de los iconos del dataset.
+             iconos: Iconos del almacén binario devueltos por cargarIconos si iconoAFichero == ICONO_BINARIO.
+             zipIconos: ZipFile de los iconos PNG si iconoAFichero == True y se agruparon en un zip.
+
+    Salida: Array uint8 de forma (32,32,4) o None si el elemento no tiene icono.
+    """
+    try:
+        if iconoAFichero == ICONO_BINARIO:
+            icono = elem.get('Icon')
+            return iconos[icono['Posicion']] if isinstance(icono, dict) and icono['Posicion'] < len(iconos) else None
+        if iconoAFichero == True:
+            from skimage import io
+            nombre = str(idElem) + '.png'
+            if zipIconos != None:
+                return io.imread(BytesIO(zipIconos.read(nombre))) if nombre in zipIconos.NameToInfo else None
+            return io.imread(nombre) if os.path.exists(nombre) else None
+        icono = elem.get('icon')
+        return np.array(icono, dtype = np.uint8).reshape(32, 32, 4) if isinstance(icono, list) else None
+    except Exception:
+        return None
+
+def exportarColumnas(iconoAFichero, reconstruir = False):
+    """
+    Exporta el dataset del modo indicado a columnas de NumPy con ExportadorColumnas. La exportación es incremental: solo se añaden los ids
+    que aún no estaban exportados, recorriendo el json en streaming y volcando cada LOTE_EXPORTACION filas. Los elementos ya exportados
+    no se actualizan aunque hayan cambiado en el dataset (por ejemplo tras refrescar); para ello se reconstruye la exportación completa.
+    El registro incremental no se compacta: lo que aún no esté en el json se exportará en la siguiente ejecución tras compactarlo.
+
+    Entrada: iconoAFichero: Indicador del dataset a exportar.
+             reconstruir: Si es True, se descarta la exportación existente y se vuelve a exportar todo el dataset.
+
+    Salida: Número de filas añadidas.
+    """
+    fichero = ficheroDataSet(iconoAFichero)
+    ruta = rutaColumnas(fichero)
+    if not os.path.exists(fichero):
+        print('No existe el dataset ' + fichero)
+        return 0
+    if reconstruir and os.path.exists(ruta):
+        for nombre in os.listdir(ruta):
+            os.remove(os.path.join(ruta, nombre))
+
+    exportador = ExportadorColumnas(ruta)
+    iconos = cargarIconos(rutaAlmacenIconos(fichero))[0] if iconoAFichero == ICONO_BINARIO and os.path.exists(rutaAlmacenIconos(fichero) + '.ids') else None
+    rutaZip = os.path.splitext(fichero)[0] + '.png.zip'
+    zipIconos = zipfile.ZipFile(rutaZip) if iconoAFichero == True and os.path.exists(rutaZip) else None
+    anadidas = 0
+    try:
+        for idElem, elem in recorrerDataSet(fichero):
+            if idElem in exportador.ids:
+                continue
+            exportador.anadir(idElem, elem, leerIconoElemento(idElem, elem, iconoAFichero, iconos, zipIconos))
+            anadidas += 1
+            if anadidas % LOTE_EXPORTACION == 0:
+                exportador.volcar()
+    finally:
+        exportador.cerrar()
+        if zipIconos != None:
+            zipIconos.close()
+    print('Exportación en columnas: ' + str(anadidas) + ' filas añadidas, ' + str(exportador.filas) + ' en total en ' + ruta)
+    return anadidas
+
+def cargarColumnas(ruta):
+    """
+    Abre una exportación en columnas para su análisis sin copiarla a memoria. Solo se leen las filas confirmadas en columnas.json.
+
+    Entrada: ruta: Directorio de la exportación.
+
+    Salida: columnas: Diccionario nombre > np.memmap de solo lectura, con los nombres de fichero sin extensión (Id, Trackers, Trackers_fin...).
+                      Icon tiene forma (N,32,32,4). Los valores de la fila i de una lista son columnas[c][inicio:fin] con
+                      inicio = columnas[c + '_fin'][i - 1] (0 si i == 0) y fin = columnas[c + '_fin'][i].
+            diccionarios: Diccionario columna > lista de valores; el código k de la columna corresponde a diccionarios[columna][k].
+    """
+    with open(os.path.join(ruta, 'columnas.json'), encoding = 'utf-8') as json_file:
+        metadatos = json.load(json_file)
+    columnas = {}
+    for nombre, tipo in ExportadorColumnas.FICHEROS.items():
+        clave = nombre.replace('.bin', '').replace('.fin', '_fin')
+        elementos = metadatos['tamanos'].get(nombre, 0) // np.dtype(tipo).itemsize
+        if elementos == 0:
+            columnas[clave] = np.zeros(0, dtype = tipo)
+        else:
+            columnas[clave] = np.memmap(os.path.join(ruta, nombre), dtype = tipo, mode = 'r', shape = (elementos,))
+    columnas['Icon'] = columnas['Icon'].reshape(-1, 32, 32, 4)
+    return columnas, metadatos['diccionarios']
+
+def rutaIndiceInvertido(rutaDataSet):
+    """
+    Devuelve la ruta del índice invertido asociado al json del dataset. Ej. exodus.json > exodus.indice
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+
+    Salida: Ruta del fichero de pares del índice. Sus términos están en la misma ruta con extensión .indice.json
+    """
+    return os.path.splitext(rutaDataSet)[0] + '.indice'
+
+def terminosElemento(elem):
+    """
+    Obtiene los términos indexables de un elemento del dataset: sus rastreadores, los propósitos de todos ellos, sus permisos y su desarrollador.
+
+    Entrada: elem: Diccionario de atributos del elemento.
+
+    Salida: Conjunto de tuplas (campo, valor) con campo en CAMPOS_INDICE.
+    """
+    terminos = set()
+    trackers = elem.get('Trackers') if isinstance(elem.get('Trackers'), list) else []
+    for tracker in trackers:
+        for nombre, propositos in tracker.items():
+            terminos.add(('Trackers', nombre))
+            for proposito in (propositos if isinstance(propositos, list) else []):
+                terminos.add(('Purposes', proposito))
+    for permiso in (elem.get('Permissions') if isinstance(elem.get('Permissions'), list) else []):
+        terminos.add(('Permissions', permiso))
+    if elem.get('Developer', 'na') != 'na':
+        terminos.add(('Developer', elem['Developer']))
+    return {(campo, str(valor)) for campo, valor in terminos if campo in CAMPOS_INDICE}
+
+def actualizarIndice(rutaDataSet, elementos):
+    """
+    Añade elementos al índice invertido del dataset. El índice es un fichero de solo añadido con ternas int32 (término, id, lote):
+    un elemento que ya estaba indexado (por ejemplo tras refrescarlo o reanalizarlo) se vuelve a anotar en un lote posterior y al cargar
+    el índice solo cuentan sus anotaciones del último lote. El término -1 marca cada id indexado y sirve de universo para la negación.
+    Cada LOTE_EXPORTACION elementos se añaden las ternas, se fuerzan a disco y se confirman en .indice.json (términos, lotes y tamaño)
+    de forma atómica; lo escrito tras la última confirmación se descarta en la siguiente actualización.
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+             elementos: Iterable de tuplas (id entero, diccionario de atributos).
+
+    Salida: Número de elementos indexados.
+    """
+    ruta = rutaIndiceInvertido(rutaDataSet)
+    try:
+        with open(ruta + '.json', encoding = 'utf-8') as json_file:
+            metadatos = json.load(json_file)
+    except Exception:
+        metadatos = {'lotes': 0, 'tamano': 0, 'terminos': []}
+    codigos = {(campo, valor): codigo for codigo, (campo, valor) in enumerate(metadatos['terminos'])}
+    indexados = 0
+    with open(ruta, 'ab') as fichero:
+        fichero.truncate(metadatos['tamano'])
+        pendientes = []
+        for idElem, elem in itertools.chain(elementos, [(None, None)]):
+            if idElem != None:
+                pendientes.extend((-1, idElem, metadatos['lotes']))
+                for termino in sorted(terminosElemento(elem)):
+                    if termino not in codigos:
+                        codigos[termino] = len(metadatos['terminos'])
+                        metadatos['terminos'].append(list(termino))
+                    pendientes.extend((codigos[termino], idElem, metadatos['lotes']))
+                indexados += 1
+            if idElem == None or (len(pendientes) > 0 and indexados % LOTE_EXPORTACION == 0): #El último lote se confirma siempre, aunque esté vacío
+                fichero.write(np.asarray(pendientes, dtype = np.int32).tobytes())
+                fichero.flush()
+                os.fsync(fichero.fileno())
+                metadatos['tamano'] = fichero.tell()
+                metadatos['lotes'] += 1
+                volcarJsonAtomico(ruta + '.json', metadatos)
+                pendientes = []
+    return indexados
+
+def indexarDataSet(iconoAFichero, reconstruir = False):
+    """
+    Construye o completa el índice invertido del dataset recorriendo el json en streaming: solo se indexan los ids que aún no lo están.
+    Una vez creado, el índice se mantiene al día en cada compactación del registro y en la fusión de tramos.
+
+    Entrada: iconoAFichero: Indicador del dataset a indexar.
+             reconstruir: Si es True, se descarta el índice existente y se vuelve a indexar todo el dataset.
+
+    Salida: Número de elementos indexados.
+    """
+    fichero = ficheroDataSet(iconoAFichero)
+    ruta = rutaIndiceInvertido(fichero)
+    if not os.path.exists(fichero):
+        print('No existe el dataset ' + fichero)
+        return 0
+    if reconstruir:
+        for resto in (ruta, ruta + '.json'):
+            if os.path.exists(resto):
+                os.remove(resto)
+    indexados = MapaBits()
+    if os.path.exists(ruta + '.json'):
+        indexados = MapaBits(int(x) for x in IndiceInvertido(fichero).universo.ids())
+    numero = actualizarIndice(fichero, ((idElem, elem) for idElem, elem in recorrerDataSet(fichero) if idElem not in indexados))
+    print('Índice invertido: ' + str(numero) + ' elementos indexados en ' + ruta)
+    return numero
+
+class ConsultaIndice:
+    """
+    Resultado de una consulta sobre el IndiceInvertido: un mapa de bits (array numpy bool) sobre los ids del índice.
+    Se combina con & (AND), | (OR) y ~ (NOT, respecto a los ids indexados); len() devuelve el número de aplicaciones.
+
+    Entrada: indice: IndiceInvertido al que pertenece.
+             bits: Array numpy bool con un elemento por id.
+    """
+    def __init__(self, indice, bits):
+        self.indice = indice
+        self.bits = bits
+
+    def __and__(self, otra):
+        return ConsultaIndice(self.indice, self.bits & otra.bits)
+
+    def __or__(self, otra):
+        return ConsultaIndice(self.indice, self.bits | otra.bits)
+
+    def __invert__(self):
+        return ConsultaIndice(self.indice, ~self.bits & self.indice.universo.bits)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.bits))
+
+    def ids(self):
+        return np.flatnonzero(self.bits)
+
+class IndiceInvertido:
+    """
+    Índice invertido de solo lectura sobre los rastreadores, propósitos, permisos y desarrolladores del dataset, para consultar
+    qué aplicaciones cumplen una combinación de términos sin cargar ni recorrer el json. Al abrirse se cargan las ternas confirmadas,
+    se descartan las de lotes superados y se ordenan por término, de modo que la lista de ids de cada término es un tramo contiguo.
+
+    Ej. indice.termino('Trackers', 'Google Ads') & ~indice.termino('Permissions', 'android.permission.CAMERA')
+        indice.consultar('Trackers=Google Ads & (Permissions=android.permission.CAMERA | Permissions=android.permission.RECORD_AUDIO)')
+
+    Entrada: rutaDataSet: Ruta del json del dataset.
+    """
+    def __init__(self, rutaDataSet):
+        ruta = rutaIndiceInvertido(rutaDataSet)
+        with open(ruta + '.json', encoding = 'utf-8') as json_file:
+            metadatos = json.load(json_file)
+        self.terminos = [tuple(termino) for termino in metadatos['terminos']]
+        self.codigos = {termino: codigo for codigo, termino in enumerate(self.terminos)}
+        pares = np.fromfile(ruta, dtype = np.int32, count = metadatos['tamano'] // 4).reshape(-1, 3)
+        self.tamano = int(pares[:, 1].max()) + 1 if len(pares) > 0 else 0
+        ultimo = np.full(self.tamano, -1, dtype = np.int32) #Último lote en que se indexó cada id
+        np.maximum.at(ultimo, pares[:, 1], pares[:, 2])
+        pares = pares[pares[:, 2] == ultimo[pares[:, 1]]]
+        pares = pares[np.lexsort((pares[:, 1], pares[:, 0]))]
+        self.listaTerminos = pares[:, 0] + 1 #El universo (-1) pasa a ser el término 0
+        self.listaIds = pares[:, 1]
+        self.inicios = np.searchsorted(self.listaTerminos, np.arange(len(self.terminos) + 2))
+        self.universo = self.consultaCodigo(-1)
+
+    def consultaCodigo(self, codigo):
+        bits = np.zeros(self.tamano, dtype = bool)
+        bits[self.listaIds[self.inicios[codigo + 1]:self.inicios[codigo + 2]]] = True
+        return ConsultaIndice(self, bits)
+
+    def termino(self, campo, valor):
+        """
+        Devuelve la consulta de las aplicaciones con el término. Un término que no aparece en el índice no tiene aplicaciones.
+        """
+        if campo not in CAMPOS_INDICE:
+            raise ValueError('Campo no indexado: ' + campo)
+        if (campo, valor) not in self.codigos:
+            return ConsultaIndice(self, np.zeros(self.tamano, dtype = bool))
+        return self.consultaCodigo(self.codigos[(campo, valor)])
+
+    def frecuencias(self, campo, consulta = None):
+        """
+        Devuelve un diccionario valor > número de aplicaciones del campo, limitado a las de la consulta si se indica, de mayor a menor.
+        """
+        codigos = self.listaTerminos if consulta == None else self.listaTerminos[consulta.bits[self.listaIds]]
+        cuentas = np.bincount(codigos, minlength = len(self.terminos) + 1)[1:]
+        resultado = {self.terminos[codigo][1]: int(cuentas[codigo]) for codigo in np.flatnonzero(cuentas) if self.terminos[codigo][0] == campo}
+        return dict(sorted(resultado.items(), key = lambda x: -x[1]))
+
+    def consultar(self, expresion):
+        """
+        Evalúa una expresión con términos Campo=valor, los operadores ! (NOT), & (AND) y | (OR) en ese orden de precedencia y paréntesis.
+        Los valores que contengan operadores o paréntesis se escriben entre comillas dobles: Trackers="AT&T Ads".
+        """
+        simbolos = re.findall(r'\s*([()&|!]|[A-Za-z_]+\s*=\s*(?:"[^"]*"|[^&|!()]*)|\S)', expresion)
+        posicion = [0]
+
+        def siguiente():
+            return simbolos[posicion[0]] if posicion[0] < len(simbolos) else None
+
+        def disyuncion():
+            resultado = conjuncion()
+            while siguiente() == '|':
+                posicion[0] += 1
+                resultado = resultado | conjuncion()
+            return resultado
+
+        def conjuncion():
+            resultado = factor()
+            while siguiente() == '&':
+                posicion[0] += 1
+                resultado = resultado & factor()
+            return resultado
+
+        def factor():
+            simbolo = siguiente()
+            posicion[0] += 1
+            if simbolo == '!':
+                return ~factor()
+            if simbolo == '(':
+                resultado = disyuncion()
+                if siguiente() != ')':
+                    raise ValueError('Falta el paréntesis de cierre en: ' + expresion)
+                posicion[0] += 1
+                return resultado
+            if simbolo == None or '=' not in simbolo:
+                raise ValueError('Expresión no válida en ' + str(simbolo) + ': ' + expresion)
+            campo, valor = simbolo.split('=', 1)
+            valor = valor.strip()
+            if len(valor) > 1 and valor[0] == '"' and valor[-1] == '"':
+                valor = valor[1:-1]
+            return self.termino(campo.strip(), valor)
+
+        resultado = disyuncion()
+        if siguiente() != None:
+            raise ValueError('Expresión no válida en ' + siguiente() + ': ' + expresion)
+        return resultado
+
+def consultarIndice(iconoAFichero, expresion, campo = None, mostrar = 50):
+    """
+    Consulta el índice invertido del dataset desde la línea de comandos y muestra el número de aplicaciones y sus ids.
+
+    Entrada: iconoAFichero: Indicador del dataset a consultar.
+             expresion: Expresión de IndiceInvertido.consultar.
+             campo: Si se indica, se muestran también las frecuencias de ese campo entre las aplicaciones resultantes.
+             mostrar: Máximo de ids y de frecuencias que se muestran.
+
+    Salida: ConsultaIndice con el resultado o None si la consulta no es válida.
+    """
+    fichero = ficheroDataSet(iconoAFichero)
+    if not os.path.exists(rutaIndiceInvertido(fichero) + '.json'):
+        print('No existe el índice invertido de ' + fichero + '; se crea con: python exodusWS.py indexar')
+        return None
+    indice = IndiceInvertido(fichero)
+    try:
+        resultado = indice.consultar(expresion)
+    except ValueError as e:
         print(e)
+        return None
+    ids = resultado.ids()
+    print(str(len(ids)) + ' aplicaciones de ' + str(len(indice.universo)))
+    print(', '.join(str(x) for x in ids[:mostrar]) + (' ...' if len(ids) > mostrar else ''))
+    if campo != None:
+        for valor, cuenta in list(indice.frecuencias(campo, resultado).items())[:mostrar]:
+            print('\t' + str(cuenta) + '\t' + valor)
+    return resultado
+
+def reanudarRastreo(iconoAFichero, modo = 'secuencial', concurrencia = CONCURRENCIA_POR_HOST, tasa = TASA_PETICIONES):
+    """
+    Reanuda los rastreos interrumpidos del dataset: obtiene del registro incremental pendiente de compactar los rangos que se estaban
+    rastreando sin llegar a terminar y vuelve a lanzar rastreo() sobre cada uno. Los elementos ya anotados en el registro se consideran tratados y no se piden de nuevo.
+
+    Entrada: iconoAFichero: Indicador si el dataset contendrá el atributo icono o se guardará en un fichero aparte.
+             modo, concurrencia, tasa: Parámetros de rastreo() con los que se reanuda cada rango.
+
+    Salida: Número de rangos reanudados.
+    """
+    fichero = ficheroDataSet(iconoAFichero)
+    rangos = {}
+    terminados = set()
+    for anotacion in leerRegistro(rutaRegistro(fichero)): #Rangos en el orden en que se empezaron a rastrear
+        rangos.setdefault(anotacion['rango'], None)
+        if anotacion['tipo'] == 'fin': #Rango terminado cuyo registro aún no se ha compactado
+            terminados.add(anotacion['rango'])
+    rangos = [rango for rango in rangos if rango not in terminados]
+    if len(rangos) == 0:
+        print('No hay ningún rastreo interrumpido en ' + fichero)
+        return 0
+    for rango in rangos:
+        inicio, fin = (int(x) for x in rango.split('_'))
+        print('Reanudando el rastreo de ' + str(inicio) + '-' + str(fin))
+        rastreo(inicio, fin - inicio + 1, iconoAFichero, modo, concurrencia, tasa)
+    return len(rangos)
+
+def mostrarEstadisticas(iconoAFichero, formato = 'texto', rutaMetricas = FICHERO_METRICAS):
+    """
+    Muestra el estado del dataset (elementos tratados y ausentes, registro pendiente de compactar, exportación en columnas e índice invertido)
+    y las métricas del último rastreo volcadas en rutaMetricas, sin cargar el json del dataset ni las librerías de rastreo.
+
+    Entrada: iconoAFichero: Indicador del dataset.
+             formato: 'texto' para un resumen legible o 'json' para el diccionario completo.
+             rutaMetricas: Fichero de métricas volcado por volcarMetricas.
+
+    Salida: Diccionario con las estadísticas mostradas.
+    """
+    fichero = ficheroDataSet(iconoAFichero)
+    estadisticas = {'dataset': fichero, 'tratados': len(cargarIdsTratados(fichero)), 'ausentes': len(cargarIdsAusentes(fichero)), 'registro': {}}
+    for anotacion in leerRegistro(rutaRegistro(fichero)):
+        if anotacion['tipo'] != 'fin':
+            estadisticas['registro'][anotacion['tipo']] = estadisticas['registro'].get(anotacion['tipo'], 0) + 1
+    for clave, ruta in (('columnas', os.path.join(rutaColumnas(fichero), 'columnas.json')), ('indice', rutaIndiceInvertido(fichero) + '.json'), ('metricas', rutaMetricas)):
+        if os.path.exists(ruta):
+            with open(ruta, encoding = 'utf-8') as json_file:
+                estadisticas[clave] = json.load(json_file)
+    if 'columnas' in estadisticas: #De la exportación y del índice solo se muestra el tamaño, no sus diccionarios de términos
+        estadisticas['columnas'] = {'filas': estadisticas['columnas']['filas'], 'bytes': sum(estadisticas['columnas']['tamanos'].values())}
+    if 'indice' in estadisticas:
+        estadisticas['indice'] = {'lotes': estadisticas['indice']['lotes'], 'terminos': len(estadisticas['indice']['terminos']), 'bytes': estadisticas['indice']['tamano']}
+
+    if formato == 'json':
+        print(json.dumps(estadisticas, indent = 1, ensure_ascii = False))
+        return estadisticas
+    print('Dataset ' + fichero + ': ' + str(estadisticas['tratados']) + ' elementos tratados, ' + str(estadisticas['ausentes']) + ' ausentes')
+    if len(estadisticas['registro']) > 0:
+        print('Registro pendiente de compactar: ' + ', '.join(str(cuenta) + ' ' + tipo for tipo, cuenta in estadisticas['registro'].items()))
+    if 'columnas' in estadisticas:
+        print('Exportación en columnas: ' + str(estadisticas['columnas']['filas']) + ' filas, ' + str(estadisticas['columnas']['bytes']) + ' bytes')
+    if 'indice' in estadisticas:
+        print('Índice invertido: ' + str(estadisticas['indice']['terminos']) + ' términos en ' + str(estadisticas['indice']['lotes']) + ' lotes, ' + str(estadisticas['indice']['bytes']) + ' bytes')
+    if 'metricas' in estadisticas:
+        print('Métricas del rastreo iniciado el ' + estadisticas['metricas']['inicio'] + ' (' + str(estadisticas['metricas']['segundos']) + ' s)')
+        print('\tetapa\tcuenta\tmedia\tp50\tp99')
+        for etapa, histograma in sorted(estadisticas['metricas']['etapas'].items()):
+            print('\t' + '\t'.join(str(x) for x in (etapa, histograma['cuenta'], histograma['media'], histograma['p50'], histograma['p99'])))
+        for nombre, contador in sorted(estadisticas['metricas']['contadores'].items()):
+            print('\t' + nombre + ': ' + ', '.join(str(etiqueta) + '=' + str(valor) for etiqueta, valor in sorted(contador.items())))
+    return estadisticas
+
+def adaptarSintaxisAnterior(argumentos):
+    """
+    Traduce la sintaxis posicional anterior de la línea de comandos a la actual con opciones con nombre, para que los scripts existentes
+    sigan funcionando. Ej. 1 100 False asincrono 8 > crawl 1 100 --icono False --modo asincrono --concurrencia 8
+    Si algún argumento ya es una opción (empieza por -) o los argumentos ya son válidos en la sintaxis actual (p. ej. crawl 1 10), no se modifican:
+    solo se traducen los que empiezan por un número o no se pueden analizar con crearParser.
+
+    Entrada: argumentos: Argumentos de la línea de comandos sin el nombre del programa.
+
+    Salida: Lista de argumentos en la sintaxis actual.
+    """
+    if len(argumentos) == 0 or any(argumento.startswith('-') for argumento in argumentos):
+        return argumentos
+    if not argumentos[0].isdigit(): #Un subcomando cuyos argumentos ya encajan en la sintaxis actual no se traduce
+        try:
+            with open(os.devnull, 'w') as nulo, contextlib.redirect_stderr(nulo):
+                crearParser().parse_args(argumentos)
+            return argumentos
+        except SystemExit:
+            pass
+    if argumentos[0].isdigit(): #inicio limite iconoAFichero [modo] [concurrencia] [tasa]
+        comando, fijos, resto = ['crawl'], argumentos[:2], argumentos[2:]
+    elif argumentos[0].lower() == 'tramos' and len(argumentos) > 1: #La acción de los tramos forma parte del comando
+        comando, fijos, resto = argumentos[:2], [], argumentos[2:]
+    else:
+        comando, fijos, resto = argumentos[:1], [], argumentos[1:]
+    opciones = SINTAXIS_ANTERIOR.get(' '.join(comando).lower(), ())
+    if len(resto) > len(opciones):
+        return argumentos
+    for opcion, valor in zip(opciones, resto):
+        if opcion == '':
+            fijos.append(valor)
+        elif opcion in ('--completa', '--forzar'): #Indicadores que antes se activaban escribiendo su nombre
+            fijos += [opcion] if valor.lower() == opcion[2:] else []
+        else:
+            fijos += [opcion, valor]
+    return [parte.lower() for parte in comando] + fijos
+
+def crearParser():
+    """
+    Construye el analizador de la línea de comandos: un subcomando por operación y opciones con nombre para el modo de los iconos,
+    el modo de rastreo, la concurrencia, la tasa y el formato de salida.
+
+    Salida: argparse.ArgumentParser.
+    """
+    parser = argparse.ArgumentParser(prog = 'exodusWS.py', description = 'Rastreo de los informes de Exodus Privacy y tratamiento del dataset.')
+    subcomandos = parser.add_subparsers(dest = 'comando', required = True)
+
+    def anadir(nombre, ayuda, alias = (), rastrea = False, analiza = False):
+        subparser = subcomandos.add_parser(nombre, aliases = list(alias), help = ayuda, description = ayuda)
+        subparser.set_defaults(comando = nombre)
+        subparser.add_argument('--icono', type = leerModoIcono, default = False, metavar = 'true|false|binario',
+                               help = 'Modo de los iconos del dataset: false (en el json), true (PNG aparte) o binario (almacén binario). Por defecto false.')
+        if rastrea:
+            subparser.add_argument('--modo', type = str.lower, choices = ('secuencial', 'asincrono', 'tuberia'), default = 'secuencial', help = 'Modo de rastreo. Por defecto secuencial.')
+            subparser.add_argument('--concurrencia', type = int, default = CONCURRENCIA_POR_HOST, help = 'Peticiones simultáneas en los modos asíncrono y tubería.')
+            subparser.add_argument('--tasa', type = float, default = TASA_PETICIONES, help = 'Peticiones por segundo en los modos asíncrono y tubería.')
+        if rastrea or analiza: #Opciones de configuración de los comandos que analizan páginas y guardan iconos
+            subparser.add_argument('--iconos-zip', action = 'store_true', help = 'Con --icono true, agrupa los PNG en un único zip (ICONOS_EN_ARCHIVO).')
+            subparser.add_argument('--puerto-metricas', type = int, default = None, help = 'Sirve las métricas por HTTP en este puerto para Prometheus (PUERTO_METRICAS).')
+            subparser.add_argument('--perfilar', type = float, default = None, help = 'Fracción de páginas que se perfilan con cProfile (PERFILAR_MUESTRA).')
+        if rastrea:
+            subparser.add_argument('--archivar', action = 'store_true', help = 'Guarda el html y los iconos descargados en el archivo de respuestas (ARCHIVAR_RESPUESTAS).')
+        return subparser
+
+    subparser = anadir('crawl', 'Rastrea el rango de ids indicado.', ('rastrear',), True)
+    subparser.add_argument('inicio', type = int, help = 'Id inicial.')
+    subparser.add_argument('limite', type = int, help = 'Número de elementos a rastrear.')
+    anadir('resume', 'Reanuda los rastreos interrumpidos a partir del registro incremental.', ('reanudar',), True)
+    subparser = anadir('reparse', 'Reconstruye el dataset desde el archivo de respuestas, sin acceso a la red.', analiza = True)
+    subparser.add_argument('--procesos', type = int, default = PROCESOS_PARSEO, help = 'Procesos del pool de análisis.')
+    subparser = anadir('refrescar', 'Revalida los elementos ya tratados con peticiones condicionales.', (), True)
+    subparser.add_argument('--limite', type = int, default = None, help = 'Máximo de elementos a revalidar.')
+    subparser = anadir('export', 'Exporta el dataset en columnas de NumPy o actualiza su índice invertido.', ('exportar',))
+    subparser.add_argument('--formato', choices = ('columnas', 'indice'), default = 'columnas', help = 'Formato de salida. Por defecto columnas.')
+    subparser.add_argument('--completa', action = 'store_true', help = 'Descarta la salida existente y la reconstruye desde cero.')
+    subparser = anadir('indexar', 'Crea o actualiza el índice invertido (equivale a export --formato indice).')
+    subparser.add_argument('--completa', action = 'store_true', help = 'Descarta el índice existente y lo reconstruye desde cero.')
+    subparser = anadir('consultar', 'Consulta el índice invertido con una expresión AND/OR/NOT.')
+    subparser.add_argument('expresion', help = 'Ej. "Trackers=Google Ads & !Permissions=android.permission.CAMERA"')
+    subparser.add_argument('--campo', default = None, help = 'Muestra las frecuencias de este campo entre las aplicaciones resultantes.')
+    anadir('compactar', 'Compacta el registro incremental sobre el dataset.')
+    subparser = anadir('stats', 'Muestra el estado del dataset y las métricas del último rastreo.', ('estadisticas',))
+    subparser.add_argument('--formato', choices = ('texto', 'json'), default = 'texto', help = 'Formato de salida. Por defecto texto.')
+    subparser.add_argument('--metricas', default = FICHERO_METRICAS, help = 'Fichero de métricas. Por defecto ' + FICHERO_METRICAS + '.')
+    subparser = anadir('tramos', 'Rastreo por tramos: preparar, trabajar, fusionar o estado.', (), True)
+    subparser.add_argument('accion', choices = ('preparar', 'trabajar', 'fusionar', 'estado'))
+    subparser.add_argument('inicio', type = int, nargs = '?', help = 'Id inicial (preparar).')
+    subparser.add_argument('limite', type = int, nargs = '?', help = 'Número de elementos (preparar).')
+    subparser.add_argument('tamano', type = int, nargs = '?', default = TAMANO_TRAMO, help = 'Ids por tramo (preparar).')
+    subparser.add_argument('--forzar', action = 'store_true', help = 'Fusiona también los tramos no hechos sin arriendo vigente, p. ej. de trabajadores caídos (fusionar).')
+    return parser
 
 #Bloque main de llamada al procedimiento
 if __name__ == "__main__":
-    IN_inicio = int(sys.argv[1])
-    IN_limite = int(sys.argv[2])
-    IN_iconoAFichero = sys.argv[3].lower() == 'true'
-    
-    rastreo(IN_inicio, IN_limite, IN_iconoAFichero)
+    args = crearParser().parse_args(adaptarSintaxisAnterior(sys.argv[1:]))
+    if getattr(args, 'iconos_zip', False): #Las opciones de configuración activan su constante para toda la ejecución
+        ICONOS_EN_ARCHIVO = True
+    if getattr(args, 'archivar', False):
+        ARCHIVAR_RESPUESTAS = True
+    if getattr(args, 'puerto_metricas', None) != None:
+        PUERTO_METRICAS = args.puerto_metricas
+    if getattr(args, 'perfilar', None) != None:
+        PERFILAR_MUESTRA = args.perfilar
+    if args.comando in ('crawl', 'resume', 'reparse', 'refrescar', 'tramos'): #Los comandos que hacen peticiones o analizan páginas vuelcan sus métricas
+        iniciarMetricas(puerto = PUERTO_METRICAS)
+
+    if args.comando == 'crawl': #Rastreo de un rango de ids
+        rastreo(args.inicio, args.limite, args.icono, args.modo, args.concurrencia, args.tasa)
+    elif args.comando == 'resume': #Reanudación de los rastreos interrumpidos
+        reanudarRastreo(args.icono, args.modo, args.concurrencia, args.tasa)
+    elif args.comando == 'reparse': #Reconstrucción del dataset desde el archivo de respuestas, sin acceso a la red
+        reanalizarArchivo(args.icono, procesos = args.procesos)
+    elif args.comando == 'refrescar': #Revalidación de los elementos ya tratados con peticiones condicionales
+        refrescarDataSet(args.icono, args.limite, args.concurrencia, args.tasa)
+    elif args.comando == 'export' and args.formato == 'columnas': #Exportación incremental del dataset en columnas de NumPy
+        exportarColumnas(args.icono, args.completa)
+    elif args.comando in ('export', 'indexar'): #Creación o actualización del índice invertido de rastreadores, propósitos, permisos y desarrolladores
+        indexarDataSet(args.icono, args.completa)
+    elif args.comando == 'consultar': #Consulta AND/OR/NOT sobre el índice invertido
+        consultarIndice(args.icono, args.expresion, args.campo)
+    elif args.comando == 'compactar': #Compactación bajo demanda del registro incremental sobre el dataset
+        compactarRegistro(ficheroDataSet(args.icono))
+    elif args.comando == 'stats': #Estado del dataset y métricas del último rastreo
+        mostrarEstadisticas(args.icono, args.formato, args.metricas)
+    elif args.comando == 'tramos': #Rastreo por tramos: preparación de los tramos, trabajadores, estado y fusión
+        if args.accion == 'preparar':
+            if args.inicio == None or args.limite == None:
+                crearParser().error('tramos preparar necesita inicio y limite')
+            coordinador = CoordinadorTramos(FICHERO_COORDINACION)
+            print(str(coordinador.preparar(args.inicio, args.limite, args.tamano)) + ' tramos preparados')
+            coordinador.cerrar()
+        elif args.accion == 'trabajar':
+            rastreoPorTramos(args.icono, args.modo, args.concurrencia, args.tasa)
+        elif args.accion == 'fusionar':
+            fusionarTramos(args.icono, args.forzar)
+        elif args.accion == 'estado':
+            coordinador = CoordinadorTramos(FICHERO_COORDINACION)
+            print(coordinador.resumen())
+            coordinador.cerrar()